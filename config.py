@@ -25,3 +25,19 @@ PRODUCT_IMAGES_CONFIG = {
     "cookie": ("Bánh Quy", "cookie.png", 2800),
     "candy": ("Kẹo Dẻo", "candy.png", 2500)
 }
+
+# Nhận diện khuôn mặt (torch, mediapipe, faiss... chỉ được import khi bật)
+# False: máy chạy bán hàng không cần camera/AI (đăng nhập bằng SĐT vẫn hoạt động)
+FACE_LOGIN_ENABLED = True
+
+# Biến thể model EdgeFace (xem core/Camera_AI/model_registry.py và benchmark_models.py).
+# Ví dụ: "edgeface_base" (chính xác nhất), "edgeface_xs_q" / "edgeface_xxs_q" (nhẹ, lượng tử hóa).
+# Đổi model sẽ tự tính lại embedding gallery ở lần khởi động kế tiếp.
+# Repo chỉ kèm sẵn checkpoint edgeface_xs_q / edgeface_xxs_q; model khác cần chép file {tên}.pt
+# vào core/Camera_AI/checkpoints/, nếu thiếu sẽ dùng model khác có sẵn (kèm cảnh báo khi khởi động).
+FACE_MODEL_NAME = "edgeface_base"
+
+# Backend suy luận embedding: "eager" (PyTorch), "torchscript" hoặc "onnx" (onnxruntime, CPU).
+# 2 backend sau cần graph export trước: python -m core.Camera_AI.export_model
+# Thiếu graph/thư viện thì tự quay về "eager".
+FACE_MODEL_BACKEND = "eager"
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# File: ai_facade.py
+#
+# Lớp "mặt tiền" lazy cho hệ thống AI khuôn mặt.
+# Import module này KHÔNG kéo theo torch/timm/mediapipe/faiss: thư viện nặng chỉ được
+# import ở lần dùng đầu tiên (hoặc trong luồng warmup), và hoàn toàn không import nếu
+# FACE_LOGIN_ENABLED = False trong config.py.
+
+import importlib
+import threading
+import time
+
+LIBRARY_MODULE = "core.Camera_AI.face_recognition_library"
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def is_enabled():
+    """Chức năng khuôn mặt có được bật trong config.py không (mặc định: bật)."""
+    try:
+        from config import FACE_LOGIN_ENABLED
+    except ImportError:
+        return True
+    return bool(FACE_LOGIN_ENABLED)
+
+
+def is_loaded():
+    return _library is not None
+
+
+def load_library():
+    """Import thư viện AI (chỉ 1 lần, an toàn khi gọi từ nhiều luồng)."""
+    global _library
+    if _library is None:
+        if not is_enabled():
+            raise RuntimeError("Chức năng nhận diện khuôn mặt đang tắt (FACE_LOGIN_ENABLED = False).")
+        with _library_lock:
+            if _library is None:
+                t0 = time.perf_counter()
+                _library = importlib.import_module(LIBRARY_MODULE)
+                print(f"[AI] Đã import thư viện AI sau {time.perf_counter() - t0:.2f}s.")
+    return _library
+
+
+def warmup():
+    """Import thư viện AI ở luồng nền (không làm gì nếu đã tắt). Trả về luồng hoặc None."""
+    if not is_enabled() or is_loaded():
+        return None
+    thread = threading.Thread(target=load_library, name="ai-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# --- Các hàm tạo đối tượng (import thư viện khi cần) ---
+def create_detector():
+    return load_library().FaceRecognitionSystemWebcam.create_detector()
+
+
+def create_recognizer():
+    return load_library().FaceRecognitionSystemWebcam.create_recognizer()
+
+
+def create_system(**kwargs):
+    """Tạo FaceRecognitionSystemWebcam (model, index FAISS, luồng webcam)."""
+    return load_library().FaceRecognitionSystemWebcam(**kwargs)
+
+
+def shutdown():
+    """Chờ các luồng FAISS chạy nền kết thúc trước khi thoát (không làm gì nếu chưa import thư viện)."""
+    if _library is not None:
+        _library.close_shared_searchers()
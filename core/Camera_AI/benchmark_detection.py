@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# File: benchmark_detection.py
+#
+# So sánh độ trễ / độ chính xác của MediaPipeFaceDetector theo detection_scale.
+# Mốc tham chiếu là detect trên ảnh gốc (scale = 1.0).
+#
+# Cách chạy (từ thư mục gốc project):
+#   python -m core.Camera_AI.benchmark_detection                      # webcam 1280x720
+#   python -m core.Camera_AI.benchmark_detection --images ./anh_test   # thư mục ảnh
+#   python -m core.Camera_AI.benchmark_detection --scales 1,0.5,0.35 --embed
+
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from core.Camera_AI.face_recognition_library import MediaPipeFaceDetector, ModelEmbedding, align_face_112
+from core.features.face_recognition_handler import CAPTURE_WIDTH, CAPTURE_HEIGHT
+
+# Các điểm mốc dùng để đo sai số (tai thường bị che khi quay đầu nên bỏ qua)
+EVAL_KEYPOINTS = ('right_eye', 'left_eye', 'nose_tip', 'mouth_center')
+
+
+def read_frames(args):
+    """Trả về list frame BGR từ thư mục ảnh hoặc webcam."""
+    frames = []
+    if args.images:
+        for file in sorted(os.listdir(args.images)):
+            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
+                img = cv2.imread(os.path.join(args.images, file))
+                if img is not None:
+                    frames.append(img)
+        return frames[:args.frames]
+
+    cap = cv2.VideoCapture(args.camera)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, args.width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, args.height)
+    print(f"[BENCH] Đang chụp {args.frames} frame từ camera {args.camera}...")
+    while len(frames) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def keypoint_error(kps, ref_kps):
+    """Sai số trung bình các điểm mốc, chuẩn hóa theo khoảng cách 2 mắt (NME)."""
+    ref = np.float32([ref_kps[k] for k in EVAL_KEYPOINTS])
+    cur = np.float32([kps[k] for k in EVAL_KEYPOINTS])
+    inter_ocular = np.linalg.norm(ref[0] - ref[1])
+    if inter_ocular < 1:
+        return None
+    return float(np.mean(np.linalg.norm(cur - ref, axis=1)) / inter_ocular)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detect trên ảnh thu nhỏ.")
+    parser.add_argument('--images', help="Thư mục ảnh (mặc định: dùng webcam)")
+    parser.add_argument('--camera', type=int, default=0)
+    parser.add_argument('--width', type=int, default=CAPTURE_WIDTH)
+    parser.add_argument('--height', type=int, default=CAPTURE_HEIGHT)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--scales', default="1.0,0.75,0.5,0.35,0.25")
+    parser.add_argument('--embed', action='store_true',
+                        help="Đo thêm độ tương đồng embedding so với căn chỉnh từ detect gốc")
+    parser.add_argument('--model', default=None, help="Mặc định: FACE_MODEL_NAME trong config.py")
+    args = parser.parse_args()
+
+    frames = read_frames(args)
+    if not frames:
+        print("[BENCH] Không có frame nào để đo.")
+        return
+    h, w = frames[0].shape[:2]
+    print(f"[BENCH] {len(frames)} frame, độ phân giải {w}x{h}")
+
+    scales = [float(x) for x in args.scales.split(',')]
+    reference = MediaPipeFaceDetector(detection_scale=1.0)
+    ref_faces = [reference.detect(f) for f in frames]
+    n_ref = sum(1 for faces in ref_faces if faces)
+    print(f"[BENCH] Detect gốc thấy mặt ở {n_ref}/{len(frames)} frame.")
+
+    embedder = ModelEmbedding(args.model) if args.embed else None
+    ref_embs = {}
+    if embedder:
+        for i, faces in enumerate(ref_faces):
+            if faces:
+                aligned = align_face_112(frames[i], faces[0][1])
+                if aligned is not None:
+                    ref_embs[i] = embedder.get_embedding(cv2.cvtColor(aligned, cv2.COLOR_BGR2RGB))[0]
+
+    print()
+    header = f"{'scale':>6} | {'ms/frame':>8} | {'p95 ms':>7} | {'tỉ lệ thấy':>10} | {'NME':>7}"
+    if embedder:
+        header += f" | {'cos emb':>7}"
+    print(header)
+    print("-" * len(header))
+
+    for scale in scales:
+        detector = MediaPipeFaceDetector(detection_scale=scale, min_detection_width=0)
+        detector.detect(frames[0])  # khởi động (warm-up)
+        times, errors, sims = [], [], []
+        found = 0
+        for i, frame in enumerate(frames):
+            t0 = time.perf_counter()
+            faces = detector.detect(frame)
+            times.append((time.perf_counter() - t0) * 1000)
+            if not ref_faces[i]:
+                continue
+            if not faces:
+                continue
+            found += 1
+            err = keypoint_error(faces[0][1], ref_faces[i][0][1])
+            if err is not None:
+                errors.append(err)
+            if embedder and i in ref_embs:
+                aligned = align_face_112(frame, faces[0][1])
+                if aligned is not None:
+                    emb = embedder.get_embedding(cv2.cvtColor(aligned, cv2.COLOR_BGR2RGB))[0]
+                    sims.append(float(np.dot(emb, ref_embs[i])))
+
+        row = (f"{scale:>6.2f} | {np.mean(times):>8.2f} | {np.percentile(times, 95):>7.2f} | "
+               f"{(found / n_ref if n_ref else 0):>10.1%} | {(np.mean(errors) if errors else float('nan')):>7.4f}")
+        if embedder:
+            row += f" | {(np.mean(sims) if sims else float('nan')):>7.4f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
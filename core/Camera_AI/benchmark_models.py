@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# File: benchmark_models.py
+#
+# So sánh các biến thể EdgeFace (model_registry.py): độ trễ, bộ nhớ, độ chính xác xác thực
+# trên bộ ảnh thử cục bộ. Mỗi model chạy trong 1 process riêng để đo bộ nhớ không bị lẫn.
+#
+# Bộ ảnh thử: thư mục có dạng giống database/ (mỗi người 1 thư mục con, ảnh mặt đã căn chỉnh
+# 112x112). Mặc định dùng chính core/Camera_AI/database.
+#
+# Cách chạy (từ thư mục gốc project):
+#   python -m core.Camera_AI.benchmark_models                                  # mọi model có checkpoint
+#   python -m core.Camera_AI.benchmark_models --testset ./anh_test --models edgeface_base,edgeface_xs_q
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import subprocess
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from core.Camera_AI import model_registry
+
+DEFAULT_TESTSET = os.path.join(model_registry.MODULE_ROOT, 'database')
+# Ngưỡng đăng nhập đang dùng (FaceRecognitionSystemWebcam.login_customer)
+LOGIN_THRESHOLD = 0.4
+TARGET_FAR = 0.01
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def rss_mb():
+    """Bộ nhớ thường trú hiện tại của process (MB)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_testset(testset, max_per_person):
+    """Trả về (ảnh RGB (N, 112, 112, 3), nhãn người (N,))."""
+    from core.Camera_AI.face_recognition_library import _load_person_faces
+
+    faces, labels = [], []
+    persons = [p for p in sorted(os.listdir(testset)) if os.path.isdir(os.path.join(testset, p))]
+    for label, person in enumerate(persons):
+        person_path = os.path.join(testset, person)
+        files = sorted(f for f in os.listdir(person_path) if f.lower().endswith(('.jpg', '.png')))
+        person_faces = _load_person_faces(person_path, files[:max_per_person])
+        if len(person_faces) >= 2:
+            faces.append(person_faces)
+            labels.extend([label] * len(person_faces))
+    if not faces:
+        return np.empty((0, 112, 112, 3), dtype=np.uint8), np.empty((0,), dtype=np.int32)
+    return np.concatenate(faces), np.asarray(labels, dtype=np.int32)
+
+
+def make_pairs(labels, max_pairs, seed=0):
+    """Cặp cùng người (genuine) và khác người (impostor), mỗi loại tối đa max_pairs."""
+    rng = random.Random(seed)
+    by_label = {}
+    for i, label in enumerate(labels):
+        by_label.setdefault(int(label), []).append(i)
+
+    genuine = [pair for idxs in by_label.values() for pair in itertools.combinations(idxs, 2)]
+    if len(genuine) > max_pairs:
+        genuine = rng.sample(genuine, max_pairs)
+
+    impostor = set()
+    n = len(labels)
+    attempts = 0
+    while len(impostor) < max_pairs and attempts < max_pairs * 20 and len(by_label) > 1:
+        attempts += 1
+        i, j = rng.randrange(n), rng.randrange(n)
+        if labels[i] != labels[j]:
+            impostor.add((min(i, j), max(i, j)))
+    return genuine, sorted(impostor)
+
+
+def verification_metrics(embeddings, genuine, impostor):
+    gen = np.array([np.dot(embeddings[i], embeddings[j]) for i, j in genuine], dtype=np.float32)
+    imp = np.array([np.dot(embeddings[i], embeddings[j]) for i, j in impostor], dtype=np.float32)
+    if len(gen) == 0 or len(imp) == 0:
+        return {}
+
+    scores = np.concatenate([gen, imp])
+    truth = np.concatenate([np.ones(len(gen), bool), np.zeros(len(imp), bool)])
+    best_acc, best_thr = 0.0, 0.0
+    for thr in np.unique(scores):
+        acc = float(np.mean((scores >= thr) == truth))
+        if acc > best_acc:
+            best_acc, best_thr = acc, float(thr)
+
+    far_thr = float(np.quantile(imp, 1 - TARGET_FAR))
+    return {
+        "best_acc": best_acc,
+        "best_thr": best_thr,
+        "acc_at_login_thr": float(np.mean((scores >= LOGIN_THRESHOLD) == truth)),
+        "tar_at_far": float(np.mean(gen > far_thr)),
+        "genuine_pairs": len(gen),
+        "impostor_pairs": len(imp),
+    }
+
+
+def run_worker(args):
+    """(Process con) Đo 1 model, in kết quả JSON với tiền tố RESULT_PREFIX."""
+    import torch
+    from core.Camera_AI.face_recognition_library import ModelEmbedding
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    faces, labels = load_testset(args.testset, args.max_per_person)
+
+    base_rss = rss_mb()
+    t0 = time.perf_counter()
+    embedder = ModelEmbedding(args.worker)
+    load_s = time.perf_counter() - t0
+
+    one = faces[:1] if len(faces) else np.zeros((1, 112, 112, 3), dtype=np.uint8)
+    for _ in range(3):  # khởi động (warm-up)
+        embedder.get_embeddings_batch(one)
+    times = []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        embedder.get_embeddings_batch(one)
+        times.append((time.perf_counter() - t0) * 1000)
+
+    result = {
+        "model": args.worker,
+        "checkpoint_mb": os.path.getsize(embedder.checkpoint_path) / 1e6,
+        "load_s": load_s,
+        "ms_single": float(np.mean(times)),
+        "p95_single": float(np.percentile(times, 95)),
+    }
+
+    if len(faces):
+        t0 = time.perf_counter()
+        embeddings = embedder.get_embeddings_batch(faces)
+        result["img_per_s"] = len(faces) / (time.perf_counter() - t0)
+        genuine, impostor = make_pairs(labels, args.pairs)
+        result.update(verification_metrics(embeddings, genuine, impostor))
+    result["rss_mb"] = rss_mb() - base_rss
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def run_model(name, args):
+    cmd = [sys.executable, '-m', 'core.Camera_AI.benchmark_models', '--worker', name,
+           '--testset', args.testset, '--max-per-person', str(args.max_per_person),
+           '--pairs', str(args.pairs), '--runs', str(args.runs), '--threads', str(args.threads)]
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    proc = subprocess.run(cmd, cwd=root, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"[BENCH] Model {name} lỗi:\n{proc.stderr.strip()[-2000:]}")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các biến thể EdgeFace.")
+    parser.add_argument('--testset', default=DEFAULT_TESTSET, help="Thư mục ảnh thử (mỗi người 1 thư mục)")
+    parser.add_argument('--models', help="Danh sách model, cách nhau bởi dấu phẩy (mặc định: mọi model có checkpoint)")
+    parser.add_argument('--max-per-person', type=int, default=20)
+    parser.add_argument('--pairs', type=int, default=3000, help="Số cặp tối đa mỗi loại (cùng người / khác người)")
+    parser.add_argument('--runs', type=int, default=50, help="Số lần đo độ trễ 1 ảnh")
+    parser.add_argument('--threads', type=int, default=0, help="torch.set_num_threads (0 = mặc định)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    models = args.models.split(',') if args.models else model_registry.available_models()
+    if not models:
+        print(f"[BENCH] Không có checkpoint nào trong {model_registry.CHECKPOINT_DIR}.")
+        return
+    print(f"[BENCH] Bộ ảnh thử: {args.testset}")
+
+    header = (f"{'model':<22} | {'ckpt MB':>7} | {'RAM MB':>7} | {'ms/ảnh':>7} | {'p95 ms':>7} | "
+              f"{'ảnh/s':>6} | {'acc tốt nhất':>12} | {'acc @0.4':>8} | {'TAR@FAR1%':>9}")
+    print(header)
+    print("-" * len(header))
+    nan = float('nan')
+    for name in models:
+        r = run_model(name, args)
+        if r is None:
+            continue
+        print(f"{name:<22} | {r['checkpoint_mb']:>7.1f} | {r['rss_mb']:>7.0f} | {r['ms_single']:>7.2f} | "
+              f"{r['p95_single']:>7.2f} | {r.get('img_per_s', nan):>6.0f} | {r.get('best_acc', nan):>12.2%} | "
+              f"{r.get('acc_at_login_thr', nan):>8.2%} | {r.get('tar_at_far', nan):>9.2%}")
+
+
+if __name__ == "__main__":
+    main()
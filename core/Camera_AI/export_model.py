@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# File: export_model.py
+#
+# Export model EdgeFace (checkpoint trong checkpoints/) thành graph đã đóng băng để
+# ModelEmbedding chạy không qua eager PyTorch/timm:
+#   - TorchScript: checkpoints/exported/{model}.ts.pt  (torch.jit.trace + freeze)
+#   - ONNX:        checkpoints/exported/{model}.onnx   (chạy bằng onnxruntime trên CPU)
+# Sau khi export, kiểm tra embedding khớp với bản eager (parity) và so sánh độ trễ.
+# Chọn backend khi chạy máy bằng FACE_MODEL_BACKEND trong config.py.
+#
+# Cách chạy (từ thư mục gốc project):
+#   python -m core.Camera_AI.export_model                                  # model trong config, cả 2 định dạng
+#   python -m core.Camera_AI.export_model --model edgeface_xs_q --format torchscript
+#   python -m core.Camera_AI.export_model --check-only --testset ./anh_test
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from core.Camera_AI import model_registry
+from core.Camera_AI.face_recognition_library import ModelEmbedding, _load_person_faces
+
+ONNX_OPSET = 17
+# Cosine tối thiểu giữa embedding eager và embedding của graph export
+PARITY_MIN_COSINE = 0.999
+PARITY_SAMPLES = 32
+LATENCY_RUNS = 30
+
+
+def _example_input(embedder):
+    batch = ModelEmbedding._preprocess_batch(np.zeros((1, 112, 112, 3), dtype=np.uint8))
+    return torch.from_numpy(batch).to(embedder.device)
+
+
+def export_torchscript(embedder, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(embedder.model, _example_input(embedder))
+        try:
+            traced = torch.jit.freeze(traced)
+        except Exception as e:
+            # Một số graph (vd. lượng tử hóa động) không freeze được: vẫn dùng bản trace
+            print(f"[EXPORT] Không freeze được graph ({e}), lưu bản trace.")
+    tmp = path + '.tmp'
+    torch.jit.save(traced, tmp)
+    os.replace(tmp, path)
+
+
+def export_onnx(embedder, path):
+    if model_registry.get_spec(embedder.model_name).quantized:
+        raise ValueError("model lượng tử hóa động (quantize_dynamic) không export được sang ONNX; "
+                         "dùng TorchScript hoặc bản float tương ứng")
+    tmp = path + '.tmp'
+    with torch.no_grad():
+        torch.onnx.export(
+            embedder.model, _example_input(embedder), tmp,
+            input_names=['input'], output_names=['embedding'],
+            dynamic_axes={'input': {0: 'batch'}, 'embedding': {0: 'batch'}},
+            opset_version=ONNX_OPSET, do_constant_folding=True,
+        )
+    os.replace(tmp, path)
+
+
+EXPORTERS = {
+    model_registry.BACKEND_TORCHSCRIPT: export_torchscript,
+    model_registry.BACKEND_ONNX: export_onnx,
+}
+
+
+def sample_faces(testset, count, seed=0):
+    """Ảnh mặt 112x112 RGB từ bộ ảnh thử (mỗi người 1 thư mục), thiếu thì bù ảnh ngẫu nhiên."""
+    faces = []
+    if testset and os.path.isdir(testset):
+        for person in sorted(os.listdir(testset)):
+            person_path = os.path.join(testset, person)
+            if not os.path.isdir(person_path):
+                continue
+            files = sorted(f for f in os.listdir(person_path) if f.lower().endswith(('.jpg', '.png')))
+            faces.extend(_load_person_faces(person_path, files[:4]))
+            if len(faces) >= count:
+                break
+    faces = faces[:count]
+    if len(faces) < count:
+        rng = np.random.default_rng(seed)
+        faces.extend(rng.integers(0, 256, size=(count - len(faces), 112, 112, 3), dtype=np.uint8))
+    return np.stack(faces)
+
+
+def _latency_ms(embedder, face):
+    for _ in range(3):
+        embedder.get_embeddings_batch(face)
+    t0 = time.perf_counter()
+    for _ in range(LATENCY_RUNS):
+        embedder.get_embeddings_batch(face)
+    return (time.perf_counter() - t0) * 1000 / LATENCY_RUNS
+
+
+def check_parity(reference, model_name, backend, faces):
+    """So sánh embedding (đã chuẩn hóa L2) của backend với bản eager. Trả về True nếu khớp."""
+    exported = ModelEmbedding(model_name, backend=backend)
+    if exported.backend != backend:
+        print(f"[PARITY] {backend}: không tải được graph export.")
+        return False
+
+    ref = reference.get_embeddings_batch(faces)
+    out = exported.get_embeddings_batch(faces)
+    cosines = np.sum(ref * out, axis=1)
+    max_abs = float(np.max(np.abs(ref - out)))
+    ok = float(cosines.min()) >= PARITY_MIN_COSINE
+
+    ref_ms = _latency_ms(reference, faces[:1])
+    out_ms = _latency_ms(exported, faces[:1])
+    print(f"[PARITY] {backend:<11} cos min {cosines.min():.6f} / TB {cosines.mean():.6f}, "
+          f"sai lệch max {max_abs:.2e} -> {'ĐẠT' if ok else 'KHÔNG ĐẠT'}")
+    print(f"[PARITY] {backend:<11} độ trễ 1 ảnh: eager {ref_ms:.2f} ms, {backend} {out_ms:.2f} ms "
+          f"({ref_ms / out_ms if out_ms else float('nan'):.2f}x)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model EdgeFace sang TorchScript/ONNX và kiểm tra parity.")
+    parser.add_argument('--model', default=None, help="Mặc định: FACE_MODEL_NAME trong config.py")
+    parser.add_argument('--format', default='all', choices=['all', *EXPORTERS])
+    parser.add_argument('--testset', default=os.path.join(model_registry.MODULE_ROOT, 'database'),
+                        help="Thư mục ảnh mặt dùng cho kiểm tra parity (thiếu thì dùng ảnh ngẫu nhiên)")
+    parser.add_argument('--check-only', action='store_true', help="Chỉ kiểm tra parity các graph đã export")
+    args = parser.parse_args()
+
+    model_name = model_registry.resolve_model_name(args.model)
+    backends = list(EXPORTERS) if args.format == 'all' else [args.format]
+    reference = ModelEmbedding(model_name, backend=model_registry.BACKEND_EAGER)
+    os.makedirs(model_registry.EXPORT_DIR, exist_ok=True)
+
+    all_ok = True
+    faces = sample_faces(args.testset, PARITY_SAMPLES)
+    for backend in backends:
+        path = model_registry.exported_path(model_name, backend)
+        if not args.check_only:
+            try:
+                EXPORTERS[backend](reference, path)
+                print(f"[EXPORT] {model_name} -> {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+            except Exception as e:
+                print(f"[EXPORT] Bỏ qua {backend}: {e}")
+                continue
+        all_ok &= check_parity(reference, model_name, backend, faces)
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
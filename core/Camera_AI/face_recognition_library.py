@@ -2,34 +2,44 @@
 # File: face_recognition_webcam_local.py
 #
 # PHIÊN BẢN ĐÃ TỐI ƯU:
-# 1. Giảm độ trễ (queue.Queue(maxsize=1)).
+# 1. Giảm độ trễ (1 luồng giữ camera, phát frame qua FrameBus - frame_bus.py).
 # 2. Tăng độ chính xác (dùng vector trung bình - centroid - khi đăng ký).
 # 3. Đồng bộ logic vector trung bình khi xây dựng lại cache.
 # 4. Sửa lỗi đường dẫn (path) bằng os.path.join và MODULE_ROOT.
 
 import os
+import shutil
 import cv2
 import torch
 import faiss
 import pickle
+import json
 import numpy as np
-from torchvision import transforms
 from PIL import Image
 import time
 import threading
 import queue
+import itertools
+import collections
+import concurrent.futures
 from collections import Counter
 import mediapipe as mp
 try:
     # --- TỐI ƯU 4 ---
     # Import tương đối, giả định backbones.py nằm cùng thư mục
     from .backbones import get_model
+    from . import gallery_journal
+    from . import model_registry
+    from .frame_bus import FrameBus
 except ImportError:
     print("LỖI: Không thể import 'get_model' từ 'backbones.py'.")
     print("Vui lòng đảm bảo file 'backbones.py' nằm chung thư mục với file này.")
     # Thử import trực tiếp nếu chạy như script
     try:
         from backbones import get_model
+        import gallery_journal
+        import model_registry
+        from frame_bus import FrameBus
     except ImportError:
         print("LỖI: Import trực tiếp 'backbones.py' cũng thất bại.")
         exit()
@@ -38,77 +48,595 @@ except ImportError:
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 MODULE_ROOT = os.path.dirname(os.path.abspath(__file__))
 
+# Đăng nhập: dừng sớm khi có 3 frame liên tiếp cùng một người,
+# với điểm hơn người đứng thứ 2 ít nhất 0.05
+LOGIN_EARLY_EXIT_FRAMES = 3
+LOGIN_MIN_MARGIN = 0.05
+
+# Gallery nhiều prototype: mỗi người tối đa PROTOTYPES_PER_PERSON vector (tâm k-means
+# trên các embedding lúc đăng ký), mỗi prototype cần ít nhất PROTOTYPE_MIN_SAMPLES ảnh
+PROTOTYPES_PER_PERSON = 5
+PROTOTYPE_MIN_SAMPLES = 20
+
 # =========================================================================
 # CÁC CLASS LOGIC (TỪ APP_FAISS.PY VÀ MODEL.PY)
 # =========================================================================
 
+def compute_prototypes(embeddings, max_prototypes=PROTOTYPES_PER_PERSON, min_samples=PROTOTYPE_MIN_SAMPLES):
+    """
+    Gom các embedding (N, 512) đã chuẩn hóa của 1 người thành k prototype (k, 512) bằng
+    k-means cầu (spherical), để giữ được các góc mặt khác nhau (thẳng, nghiêng trái/phải...)
+    thay vì 1 vector trung bình. Ít ảnh thì k = 1 (vector trung bình như trước).
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    k = max(1, min(max_prototypes, len(embeddings) // max(1, min_samples)))
+    if k == 1:
+        prototypes = embeddings.mean(axis=0, keepdims=True)
+    else:
+        kmeans = faiss.Kmeans(embeddings.shape[1], k, niter=20, spherical=True, seed=1234, verbose=False)
+        kmeans.train(embeddings)
+        prototypes = np.array(kmeans.centroids, dtype=np.float32)
+    faiss.normalize_L2(prototypes)
+    return prototypes
+
+def _load_person_faces(person_path, files):
+    """
+    (Chạy được trên luồng phụ) Đọc, resize về 112x112 và đổi sang RGB
+    toàn bộ ảnh của 1 người. Trả về ndarray (N, 112, 112, 3) uint8.
+    """
+    faces = np.empty((len(files), 112, 112, 3), dtype=np.uint8)
+    count = 0
+    for file in files:
+        img = cv2.imread(os.path.join(person_path, file))
+        if img is None: continue
+        if img.shape[:2] != (112, 112):
+            img = cv2.resize(img, (112, 112))
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=faces[count])
+        count += 1
+    return faces[:count]
+
+
 class ModelEmbedding:
     """
     Tải model EdgeFace từ file checkpoint cục bộ và trích xuất đặc trưng.
+    model_name: tên trong model_registry.MODELS (None = FACE_MODEL_NAME trong config.py).
+    backend: 'eager' (PyTorch từ checkpoint), 'torchscript' hoặc 'onnx' (graph đã export
+    bằng export_model.py). None = FACE_MODEL_BACKEND trong config.py. Nếu thiếu graph
+    export hoặc thiếu onnxruntime thì tự quay về 'eager'.
     """
-    def __init__(self, model_name="edgeface_base"):
-        print(f"[MODEL] Đang tải model {model_name} từ file cục bộ...")
+    # Số ảnh tối đa cho một lần forward (giới hạn RAM trên Pi)
+    DEFAULT_MAX_BATCH_SIZE = 32
+    EMBEDDING_SIZE = 512
+
+    def __init__(self, model_name=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE, backend=None):
+        model_name = model_name or model_registry.resolve_model_name()
+        self.model_name = model_name
+        backend = backend or model_registry.configured_backend()
+        print(f"[MODEL] Đang tải model {model_name} ({backend}) từ file cục bộ...")
         
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.max_batch_size = max(1, int(max_batch_size))
         
         # --- TỐI ƯU 4: Sửa đường dẫn ---
-        self.checkpoint_path = os.path.join(MODULE_ROOT, 'checkpoints', f'{model_name}.pt')
-        
+        self.checkpoint_path = model_registry.checkpoint_path(model_name)
+
+        self.backend = None
+        if backend != model_registry.BACKEND_EAGER:
+            try:
+                self._load_exported(backend)
+            except Exception as e:
+                print(f"[MODEL] Không dùng được backend '{backend}' ({e}), quay về eager.")
+        if self.backend is None:
+            self._load_eager()
+
+    def _load_eager(self):
         if not os.path.exists(self.checkpoint_path):
             print(f"Lỗi: Không tìm thấy file checkpoint tại: {self.checkpoint_path}")
             print("Vui lòng tải model vào thư mục 'checkpoints'.")
             raise FileNotFoundError(self.checkpoint_path)
         
         try:
-            self.model = get_model(model_name) 
+            self.model = get_model(self.model_name) 
             self.model.load_state_dict(torch.load(self.checkpoint_path, map_location=self.device))
             self.model.to(self.device)
             self.model.eval() 
+            self.backend = model_registry.BACKEND_EAGER
+            self._infer = self._infer_torch
             print(f"[MODEL] Đã tải model cục bộ lên {self.device} thành công.")
         except Exception as e:
             print(f"Lỗi nghiêm trọng khi tải model: {e}")
             raise
 
-        self.transform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-        ])
+    def _load_exported(self, backend):
+        """Tải graph đã export (đã freeze, không cần timm/backbones)."""
+        path = model_registry.exported_path(self.model_name, backend)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"chưa export: {path} (chạy python -m core.Camera_AI.export_model)")
 
-    def get_embedding(self, image_np_rgb):
+        if backend == model_registry.BACKEND_TORCHSCRIPT:
+            self.model = torch.jit.load(path, map_location=self.device)
+            self.model.eval()
+            self._infer = self._infer_torch
+        else:
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+            self._onnx_input = self.session.get_inputs()[0].name
+            self._infer = self._infer_onnx
+        self.backend = backend
+        print(f"[MODEL] Đã tải graph {backend} từ {path}.")
+
+    def _infer_torch(self, chunk):
+        input_tensor = torch.from_numpy(chunk).to(self.device)
+        return self.model(input_tensor).cpu().numpy()
+
+    def _infer_onnx(self, chunk):
+        return self.session.run(None, {self._onnx_input: chunk})[0]
+
+    @staticmethod
+    def _preprocess_batch(faces_rgb):
+        """
+        Chuẩn hóa (N, 112, 112, 3) uint8 RGB -> (N, 3, 112, 112) float32 trong [-1, 1].
+        Tương đương ToTensor() + Normalize(0.5, 0.5) nhưng làm một lần cho cả batch.
+        """
+        batch = np.asarray(faces_rgb, dtype=np.float32)
+        if batch.ndim == 3:
+            batch = batch[np.newaxis]
+        batch = batch.transpose(0, 3, 1, 2)
+        batch *= 1.0 / 127.5
+        batch -= 1.0
+        return np.ascontiguousarray(batch)
+
+    def get_embeddings_batch(self, faces_rgb, max_batch_size=None):
+        """
+        Trích xuất embedding cho nhiều khuôn mặt 112x112 RGB cùng lúc.
+        - faces_rgb: list các ảnh (112, 112, 3) hoặc ndarray (N, 112, 112, 3).
+        Trả về: ndarray (N, 512) float32 đã chuẩn hóa L2, hoặc None nếu lỗi.
+        """
         try:
-            input_tensor = self.transform(image_np_rgb).unsqueeze(0).to(self.device)
+            if len(faces_rgb) == 0:
+                return np.empty((0, self.EMBEDDING_SIZE), dtype=np.float32)
+
+            batch_size = max(1, int(max_batch_size or self.max_batch_size))
+            outputs = []
             with torch.no_grad():
-                embedding = self.model(input_tensor).cpu().numpy()
-            faiss.normalize_L2(embedding)
-            return embedding
+                for start in range(0, len(faces_rgb), batch_size):
+                    chunk = self._preprocess_batch(faces_rgb[start:start + batch_size])
+                    outputs.append(self._infer(chunk))
+
+            embeddings = np.ascontiguousarray(np.concatenate(outputs, axis=0), dtype=np.float32)
+            faiss.normalize_L2(embeddings)
+            return embeddings
         except Exception as e:
-            print(f"[MODEL] Lỗi khi trích xuất embedding: {e}")
+            print(f"[MODEL] Lỗi khi trích xuất embedding theo batch: {e}")
             return None
 
+    def get_embedding(self, image_np_rgb):
+        # Giữ nguyên giao diện cũ: trả về (1, 512)
+        return self.get_embeddings_batch([image_np_rgb])
+
+# Các FastFaceSearch dùng chung trong process, theo (model, thư mục database)
+_shared_searchers = {}
+_shared_searchers_lock = threading.Lock()
+
+
+def close_shared_searchers():
+    """Dừng luồng nền (dựng ANN) của mọi FastFaceSearch dùng chung. Gọi khi thoát ứng dụng."""
+    with _shared_searchers_lock:
+        searchers = list(_shared_searchers.values())
+    for searcher in searchers:
+        searcher.close()
+
+
 class FastFaceSearch:
     """
     Quản lý database FAISS, bao gồm tải, lưu cache, tìm kiếm và thêm.
+    Dùng FastFaceSearch.shared(...) để mọi nơi trong process (hệ thống webcam,
+    FaceRecognitionHandler) tra cứu cùng 1 gallery / 1 index trong RAM.
+    Điểm trả về từ search() là cosine (tích vô hướng trên vector đã chuẩn hóa L2).
+
+    Định dạng lưu trữ (trong db_dir):
+    - {model}_embeddings.npy : embedding (N, 512) float32, ghi thẳng từ bộ đệm trong RAM
+                               ({model}_index.faiss của bản cũ vẫn đọc được và được chuyển đổi)
+    - {model}_labels.npy  : label (int32) của từng vector
+    - {model}_meta.json   : name_map (label -> tên) và thông tin kiểm tra
+    - {model}_journal.bin : nhật ký append-only (đăng ký mới, đổi tên),
+                            được gộp vào snapshot khi khởi động
+    Mỗi thư mục người dùng có thêm {model}_manifest.json (danh sách ảnh, mtime,
+    vector trung bình) để lần xây dựng lại chỉ tính lại thư mục đã thay đổi.
+
+    Bộ đệm embedding là bản float32 DUY NHẤT trong RAM: gallery nhỏ tìm chính xác trực tiếp
+    trên bộ đệm; gallery lớn (thành viên toàn chuỗi) đi qua index ANN chỉ chứa mã nén
+    (HNSW + SQ 8 bit, rồi IVF-PQ) được dựng ở luồng nền, rồi tính lại điểm cosine chính xác
+    cho vài ứng viên từ bộ đệm. Xem ann_stats() cho recall/độ trễ. Gọi close() khi thoát.
     """
-    def __init__(self, recognizer, model_name='edgeface_base', db_dir='database'):
+    # Gộp journal vào snapshot khi số bản ghi vượt ngưỡng này (lúc khởi động)
+    JOURNAL_COMPACT_THRESHOLD = 64
+    # Loại bỏ hẳn prototype đã xóa (label -1) khi số lượng vượt ngưỡng này (lúc đang chạy):
+    # search_batch phải lấy thêm từng đó ứng viên
+    TOMBSTONE_COMPACT_THRESHOLD = 256
+    PROTOTYPES_PER_PERSON = PROTOTYPES_PER_PERSON
+    # Đọc snapshot bằng mmap (giảm bộ nhớ đỉnh khi tải gallery lớn)
+    USE_MMAP = False
+    MANIFEST_VERSION = 2  # 2: lưu nhiều prototype thay vì 1 vector trung bình
+    IMAGE_EXTENSIONS = ('.jpg', '.png')
+    # Số người được đọc trước (đang chờ trong pool) cho mỗi worker, giới hạn RAM
+    REBUILD_PREFETCH_PER_WORKER = 2
+
+    # --- INDEX ANN THEO KÍCH THƯỚC GALLERY ---
+    ANN_FLAT_MAX = 5000          # <= số vector này: tìm kiếm chính xác trên bộ đệm
+    ANN_HNSW_MAX = 50000         # <= số vector này: HNSW (SQ 8 bit, 512 byte/vector), lớn hơn: IVF-PQ
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = 64
+    IVF_NPROBE = 16
+    PQ_M = 64                    # 512 chiều -> 64 mã 8 bit = 64 byte/vector
+    PQ_NBITS = 8
+    IVF_TRAIN_MAX = 100000       # Số vector tối đa dùng để train SQ / IVF-PQ
+    ANN_ADD_CHUNK = 2000         # Thêm vector vào ANN theo từng khúc (kiểm tra close() giữa các khúc)
+    ANN_RERANK_MIN = 16          # Số ứng viên tối thiểu lấy từ ANN để tính lại điểm chính xác
+    ANN_REBUILD_GROWTH = 0.2     # Dựng lại khi số vector thêm sau lần dựng > 20%
+    ANN_EVAL_QUERIES = 200       # Số truy vấn đo recall/độ trễ so với tìm chính xác
+    EXACT_QUERY_CHUNK = 16       # Số truy vấn mỗi lần nhân ma trận khi tìm chính xác (giới hạn RAM)
+
+    # Bộ đệm embedding/label cấp phát trước, tăng 25% khi đầy (thêm 1 người = O(1) khấu hao,
+    # dư thừa tối đa 25% thay vì gấp đôi)
+    MIN_BUFFER_CAPACITY = 256
+    BUFFER_GROWTH = 1.25
+
+    def __init__(self, recognizer, model_name='edgeface_base', db_dir='database', use_mmap=None,
+                 rebuild_workers=None, progress_callback=None, force_rebuild=False):
+        """
+        force_rebuild=True: bỏ qua index đã lưu, xây dựng lại từ thư mục database
+        (dùng khi đổi model: manifest của model này vẫn giúp bỏ qua thư mục không đổi).
+        """
         print("[FAISS] Khởi tạo hệ thống tìm kiếm...")
         self.recognizer = recognizer
+        # Số luồng dùng để đọc/tiền xử lý ảnh khi xây dựng lại (None = số nhân CPU)
+        self.rebuild_workers = rebuild_workers
+        # progress_callback(số người đã xong, tổng số người, thông điệp) cho màn hình chờ
+        self.progress_callback = progress_callback
+        self.model_name = model_name
         self.db_dir = db_dir # Đã là đường dẫn tuyệt đối từ MODULE_ROOT
+        self.use_mmap = self.USE_MMAP if use_mmap is None else bool(use_mmap)
         
         # --- TỐI ƯU 4: Sửa đường dẫn ---
+        # Cache pickle cũ, chỉ còn dùng để chuyển đổi sang định dạng mới
         self.cache_file = os.path.join(self.db_dir, f"{model_name}_cache.pkl")
+        # Snapshot cũ (index FAISS flat), chỉ còn dùng để chuyển đổi sang {model}_embeddings.npy
+        self.index_file = os.path.join(self.db_dir, f"{model_name}_index.faiss")
+        self.embeddings_file = os.path.join(self.db_dir, f"{model_name}_embeddings.npy")
+        self.labels_file = os.path.join(self.db_dir, f"{model_name}_labels.npy")
+        self.meta_file = os.path.join(self.db_dir, f"{model_name}_meta.json")
+        self.journal_file = os.path.join(self.db_dir, f"{model_name}{gallery_journal.JOURNAL_SUFFIX}")
+        self.manifest_name = f"{model_name}_manifest.json"
 
+        self.embedding_size = 512
         self.embeddings = []
         self.labels = []
         self.name_map = {}
-        self.index = None
-        self.faiss_id_to_name = {}
-        self.embedding_size = 512
+        self._lock = threading.Lock()
+        self._ann = None             # Index ANN đang dùng (None = tìm chính xác trên bộ đệm)
+        self._ann_kind = 'flat'
+        self._ann_built_ntotal = 0
+        self._ann_building = False
+        # Bảo vệ _ann_building (không dùng _lock: _schedule_ann_build có thể được gọi khi đang giữ _lock)
+        self._ann_build_lock = threading.Lock()
+        self._ann_thread = None
+        self._closed = threading.Event()  # close(): không dựng ANN mới, dừng lần dựng đang chạy
+        self._index_generation = 0  # Tăng mỗi khi gallery bị thay (bỏ kết quả dựng ANN cũ)
+        # rebuild(): chỉ 1 lần tại 1 thời điểm; thêm/đổi tên trong lúc đang dựng được ghi lại
+        # ở đây rồi áp dụng lại lên gallery mới (None = không có rebuild nào đang chạy)
+        self._rebuild_lock = threading.Lock()
+        self._ops_during_rebuild = None
+        self.ann_metrics = {}
+
+        self._build_index(force_rebuild)
+
+    @classmethod
+    def shared(cls, recognizer, model_name, db_dir, **kwargs):
+        """
+        Instance dùng chung cho (model_name, db_dir), tạo ở lần gọi đầu tiên
+        (kwargs chỉ có tác dụng lúc tạo). Đăng ký/đổi tên ở bất kỳ đâu đều thấy ngay.
+        """
+        key = (model_name, os.path.abspath(db_dir))
+        with _shared_searchers_lock:
+            searcher = _shared_searchers.get(key)
+            if searcher is None:
+                searcher = cls(recognizer, model_name, db_dir, **kwargs)
+                _shared_searchers[key] = searcher
+        return searcher
+
+    # --- DỮ LIỆU GALLERY: bộ đệm tăng dần + map ngược tên -> label ---
+
+    @property
+    def embeddings(self):
+        """(N, 512) float32: view trên bộ đệm (không copy)."""
+        return self._emb_buf[:self._size]
+
+    @embeddings.setter
+    def embeddings(self, value):
+        """Gán lại toàn bộ (build/tải snapshot). labels phải được gán ngay sau đó."""
+        value = np.asarray(value, dtype=np.float32).reshape(-1, self.embedding_size)
+        self._size = len(value)
+        self._emb_buf = np.empty((max(self.MIN_BUFFER_CAPACITY, self._size), self.embedding_size), dtype=np.float32)
+        self._emb_buf[:self._size] = value
+        self._label_buf = np.full(len(self._emb_buf), -1, dtype=np.int32)
+
+    @property
+    def ntotal(self):
+        """Số vector trong gallery (kể cả prototype đã xóa, label -1)."""
+        return self._size
+
+    @property
+    def labels(self):
+        """(N,) int32: label của từng vector (-1 = đã xóa), view trên bộ đệm."""
+        return self._label_buf[:self._size]
+
+    @labels.setter
+    def labels(self, value):
+        value = np.asarray(value, dtype=np.int32).reshape(-1)
+        if len(value) != self._size:
+            raise ValueError(f"labels ({len(value)}) không khớp embeddings ({self._size})")
+        self._label_buf[:self._size] = value
+        self._tombstones = int(np.count_nonzero(value < 0))
+        # label -> vị trí các dòng của label đó: thay/gộp prototype 1 người là O(k), không quét N dòng
+        self._rows_by_label = {}
+        for row, label in enumerate(value.tolist()):
+            if label >= 0:
+                self._rows_by_label.setdefault(label, []).append(row)
+
+    @property
+    def name_map(self):
+        """{label: tên}. Chỉ sửa qua _apply_add/_apply_rename để giữ map ngược đồng bộ."""
+        return self._name_map
+
+    @name_map.setter
+    def name_map(self, value):
+        self._name_map = {int(k): v for k, v in dict(value).items()}
+        self._label_by_name = {name: label for label, name in self._name_map.items()}
+        self._next_label = max(self._name_map, default=-1) + 1
+
+    def _set_gallery(self, embeddings, labels, name_map):
+        self.embeddings = embeddings
+        self.labels = labels
+        self.name_map = name_map
+
+    def _append_rows(self, vectors, label):
+        """Ghi thêm vector vào cuối bộ đệm, tăng dung lượng BUFFER_GROWTH lần khi đầy."""
+        end = self._size + len(vectors)
+        if end > len(self._emb_buf):
+            capacity = max(end, int(self.BUFFER_GROWTH * len(self._emb_buf)))
+            emb_buf = np.empty((capacity, self.embedding_size), dtype=np.float32)
+            emb_buf[:self._size] = self._emb_buf[:self._size]
+            label_buf = np.full(capacity, -1, dtype=np.int32)
+            label_buf[:self._size] = self._label_buf[:self._size]
+            self._emb_buf, self._label_buf = emb_buf, label_buf
+        self._emb_buf[self._size:end] = vectors
+        self._label_buf[self._size:end] = label
+        self._rows_by_label.setdefault(label, []).extend(range(self._size, end))
+        self._size = end
+
+    def reload(self):
+        """
+        Tải lại index từ đĩa (snapshot + journal) mà KHÔNG tính lại embedding,
+        ví dụ sau khi công cụ bên ngoài ghi vào database. Giữ index hiện tại nếu đọc lỗi.
+        """
+        with self._lock:
+            ok = self._load_snapshot()
+        if ok:
+            print(f"[FAISS] Đã tải lại index, đang theo dõi {self.ntotal} vector.")
+        else:
+            print("[FAISS] Không tải lại được index, giữ index hiện tại.")
+        return ok
+
+    # --- INDEX ANN (dựng ở luồng nền) ---
+
+    def _choose_ann_kind(self, ntotal):
+        if ntotal <= self.ANN_FLAT_MAX:
+            return 'flat'
+        if ntotal <= self.ANN_HNSW_MAX:
+            return 'hnsw'
+        return 'ivfpq'
+
+    def _create_ann(self, kind, vectors):
+        """
+        Dựng index ANN chỉ chứa mã nén (không giữ thêm bản float32: điểm chính xác được tính
+        lại từ bộ đệm embedding). Trả về None nếu close() được gọi trong lúc dựng.
+        """
+        if kind == 'hnsw':
+            ann = faiss.IndexHNSWSQ(self.embedding_size, faiss.ScalarQuantizer.QT_8bit, self.HNSW_M,
+                                    faiss.METRIC_INNER_PRODUCT)
+            ann.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+            ann.hnsw.efSearch = self.HNSW_EF_SEARCH
+        else:
+            nlist = int(4 * np.sqrt(len(vectors)))
+            quantizer = faiss.IndexFlatIP(self.embedding_size)
+            ann = faiss.IndexIVFPQ(quantizer, self.embedding_size, nlist, self.PQ_M, self.PQ_NBITS,
+                                   faiss.METRIC_INNER_PRODUCT)
+            ann.nprobe = self.IVF_NPROBE
+        if len(vectors) > self.IVF_TRAIN_MAX:
+            sample = np.random.default_rng(0).choice(len(vectors), self.IVF_TRAIN_MAX, replace=False)
+            ann.train(vectors[np.sort(sample)])
+        else:
+            ann.train(vectors)
+        for start in range(0, len(vectors), self.ANN_ADD_CHUNK):
+            if self._closed.is_set():
+                return None
+            ann.add(vectors[start:start + self.ANN_ADD_CHUNK])
+        return ann
+
+    def _schedule_ann_build(self):
+        """Dựng (lại) index ANN ở luồng nền nếu kích thước gallery cần. Gọi khi đã giữ hoặc không giữ _lock."""
+        ntotal = self.ntotal
+        kind = self._choose_ann_kind(ntotal)
+        if kind == 'flat':
+            self._ann, self._ann_kind, self._ann_built_ntotal = None, 'flat', ntotal
+            return
+        with self._ann_build_lock:
+            if self._ann_building or self._closed.is_set():
+                return
+            self._ann_building = True
+            # daemon chỉ để không chặn thoát khi quên close(); close() join luồng này
+            self._ann_thread = threading.Thread(target=self._build_ann, args=(kind,),
+                                                name="faiss-ann-build", daemon=True)
+            self._ann_thread.start()
+
+    def _build_ann(self, kind):
+        stale = False
+        try:
+            with self._lock:
+                generation = self._index_generation
+                # View, không copy: các dòng đã ghi trong bộ đệm không bao giờ bị sửa tại chỗ
+                # (thêm = ghi sau _size, thay gallery/tăng dung lượng = cấp phát bộ đệm mới)
+                vectors = self.embeddings
+            t0 = time.perf_counter()
+            ann = self._create_ann(kind, vectors)
+            build_s = time.perf_counter() - t0
+            if ann is None:
+                print("[FAISS] Đã dừng dựng index ANN (đang đóng).")
+                return
+            # Đo trên ann/vectors riêng của luồng này (chưa công bố) nên không cần giữ _lock
+            metrics = self.evaluate_ann(kind, ann, vectors)
+            metrics['build_s'] = build_s
+            with self._lock:
+                if generation != self._index_generation:
+                    # Index đã bị thay (reload/rebuild) trong lúc dựng: bỏ kết quả này, dựng lại
+                    print("[FAISS] Index thay đổi trong lúc dựng ANN, dựng lại.")
+                    stale = True
+                    return
+                # Thêm các vector được đăng ký trong lúc đang dựng (id ANN = vị trí trong bộ đệm)
+                if self.ntotal > ann.ntotal:
+                    ann.add(self.embeddings[ann.ntotal:])
+                self._ann, self._ann_kind, self._ann_built_ntotal = ann, kind, ann.ntotal
+                self.ann_metrics = metrics
+            print(f"[FAISS] Đã dựng index {kind} cho {ann.ntotal} vector sau {build_s:.1f}s.")
+            m = metrics
+            print(f"[FAISS] ANN {kind}: recall@1 {m['recall_at_1']:.1%}, "
+                  f"{m['ann_ms']:.2f} ms/truy vấn (flat {m['flat_ms']:.2f} ms).")
+        except Exception as e:
+            print(f"[FAISS] Lỗi khi dựng index ANN, tiếp tục tìm chính xác: {e}")
+        finally:
+            with self._ann_build_lock:
+                self._ann_building = False
+            if stale:
+                self._schedule_ann_build()
+
+    def close(self, timeout=None):
+        """
+        Dừng dựng index ANN ở luồng nền và chờ luồng đó kết thúc. Gọi trước khi thoát process:
+        FAISS/OpenMP còn chạy lúc interpreter thoát sẽ làm process bị abort.
+        Bước train đang chạy không ngắt được, close() chờ nó xong.
+        """
+        with self._ann_build_lock:
+            self._closed.set()
+            thread = self._ann_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def evaluate_ann(self, kind, ann, vectors, queries=None, topk=1):
+        """
+        So sánh index ANN với tìm kiếm chính xác trên `vectors` (các vector đã thêm vào ann):
+        recall@topk và độ trễ TB mỗi truy vấn. Không đọc trạng thái của searcher nên chạy
+        ngoài _lock; ann/vectors không được bị luồng khác sửa trong lúc đo.
+        queries: (N, 512) đã chuẩn hóa; mặc định lấy mẫu vector trong gallery + nhiễu nhỏ.
+        """
+        ntotal = len(vectors)
+        if queries is None and ntotal:
+            rng = np.random.default_rng(0)
+            idx = rng.choice(ntotal, min(self.ANN_EVAL_QUERIES, ntotal), replace=False)
+            queries = vectors[idx] + rng.normal(0, 0.02, (len(idx), self.embedding_size))
+        if queries is None or len(queries) == 0:
+            return {'kind': kind, 'ntotal': ntotal}
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        faiss.normalize_L2(queries)
+        topk = min(topk, ntotal)
 
-        self._build_index()
+        t0 = time.perf_counter()
+        _, exact = self._exact_search(vectors, queries, topk)
+        flat_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        _, approx = self._ann_rerank(ann, vectors, queries, topk)
+        ann_s = time.perf_counter() - t0
+
+        hits = sum(len(set(e) & set(a[a >= 0])) for e, a in zip(exact, approx))
+        return {
+            'kind': kind,
+            'ntotal': ntotal,
+            f'recall_at_{topk}': hits / float(len(queries) * topk),
+            'flat_ms': 1000 * flat_s / len(queries),
+            'ann_ms': 1000 * ann_s / len(queries),
+        }
+
+    def ann_stats(self):
+        """Loại index đang dùng và số liệu recall/độ trễ của lần dựng gần nhất."""
+        return {'kind': self._ann_kind, 'ntotal': self.ntotal,
+                'building': self._ann_building, **self.ann_metrics}
+
+    def _search_rows(self, queries, k, use_ann=True):
+        """
+        (GỌI KHI ĐANG GIỮ _lock) Tìm k vector gần nhất cho cả lô truy vấn trong 1 lần gọi.
+        Trả về (D, I) dạng (N, k) giảm dần, I = vị trí trong bộ đệm (-1 nếu thiếu).
+        Có ANN: lấy rộng từ ANN rồi xếp lại bằng cosine chính xác.
+        """
+        k = min(k, self.ntotal)
+        if not use_ann or self._ann is None:
+            return self._exact_search(self.embeddings, queries, k)
+        return self._ann_rerank(self._ann, self.embeddings, queries, k)
+
+    def _exact_search(self, embeddings, queries, k):
+        """Tìm chính xác (tích vô hướng) trực tiếp trên bộ đệm, không cần index flat riêng."""
+        D_parts, I_parts = [], []
+        for start in range(0, len(queries), self.EXACT_QUERY_CHUNK):
+            scores = queries[start:start + self.EXACT_QUERY_CHUNK] @ embeddings.T
+            if k < scores.shape[1]:
+                I = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                I = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            D = np.take_along_axis(scores, I, axis=1)
+            order = np.argsort(-D, axis=1)
+            D_parts.append(np.take_along_axis(D, order, axis=1))
+            I_parts.append(np.take_along_axis(I, order, axis=1))
+        return np.concatenate(D_parts), np.concatenate(I_parts)
+
+    def _ann_rerank(self, ann, embeddings, queries, k):
+        """Lấy rộng ứng viên từ ann rồi xếp lại bằng cosine chính xác trên embeddings."""
+        _, I = ann.search(queries, max(k * 4, self.ANN_RERANK_MIN))
+        D = np.einsum('nkd,nd->nk', embeddings[np.maximum(I, 0)], queries)
+        D[I < 0] = -np.inf
+        order = np.argsort(-D, axis=1)[:, :k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+    def _reduce_by_label(self, D_row, I_row, topk):
+        """
+        Gộp kết quả theo người: điểm của 1 người = max trên các prototype của người đó
+        (D_row đã giảm dần nên lần xuất hiện đầu tiên của mỗi label là điểm max).
+        Bỏ vector đã xóa (label -1).
+        """
+        valid = I_row >= 0
+        D_row, I_row = D_row[valid], I_row[valid]
+        labels = self.labels[I_row]
+        keep = labels >= 0
+        D_row, labels = D_row[keep], labels[keep]
+        _, first = np.unique(labels, return_index=True)
+        first.sort()
+        return [(self.name_map.get(int(labels[i]), "Unknown"), float(D_row[i])) for i in first[:topk]]
+
+    def _build_index(self, force_rebuild=False):
+        if force_rebuild:
+            print(f"[FAISS] Yêu cầu xây dựng lại index cho model {self.model_name}...")
+            self._set_gallery(*self._build_from_database())
+            self._reset_index_from_arrays()
+            print(f"[FAISS] Index đã sẵn sàng, đang theo dõi {self.ntotal} vector.")
+            return
+
+        if self._load_snapshot():
+            print(f"[FAISS] Index đã sẵn sàng, đang theo dõi {self.ntotal} vector.")
+            return
 
-    def _build_index(self):
         if os.path.exists(self.cache_file):
-            print(f"[FAISS] Đang tải cache từ {self.cache_file}")
+            print(f"[FAISS] Đang chuyển đổi cache cũ từ {self.cache_file}")
             try:
                 with open(self.cache_file, 'rb') as f:
                     cache = pickle.load(f)
@@ -117,153 +645,490 @@ class FastFaceSearch:
                     self.name_map = cache['name_map']
             except Exception as e:
                 print(f"[FAISS] Lỗi tải cache, sẽ xây dựng lại: {e}")
-                self._build_from_database()
+                self._set_gallery(*self._build_from_database())
         else:
-            print("[FAISS] Không tìm thấy cache, đang xây dựng từ database...")
-            self._build_from_database()
+            print("[FAISS] Không tìm thấy index, đang xây dựng từ database...")
+            self._set_gallery(*self._build_from_database())
 
-        # Đảm bảo self.embeddings là float32 ngay cả khi rỗng
-        if not isinstance(self.embeddings, np.ndarray) or self.embeddings.size == 0:
+        self._reset_index_from_arrays()
+        if os.path.exists(self.cache_file) and os.path.exists(self.embeddings_file):
+            # Cache pickle cũ đã được chuyển đổi, đổi tên để không bị đọc lại
+            try: os.replace(self.cache_file, self.cache_file + '.migrated')
+            except OSError: pass
+        print(f"[FAISS] Index đã sẵn sàng, đang theo dõi {self.ntotal} vector.")
+
+    def _reset_index_from_arrays(self):
+        """Bắt đầu gallery mới từ self.embeddings/self.labels: lưu snapshot, dựng lại ANN."""
+        if self.embeddings.size == 0:
             print("[FAISS] Database rỗng hoặc bị lỗi. Khởi tạo index rỗng.")
-            self.embeddings = np.empty((0, self.embedding_size), dtype=np.float32)
-            self.labels = np.empty((0,), dtype=np.int32)
+            self.embeddings = []
+            self.labels = []
             self.name_map = {}
         
-        self.embeddings = self.embeddings.astype(np.float32)
-        dim = self.embedding_size
-        self.index = faiss.IndexFlatIP(dim) 
-        
-        if self.embeddings.shape[0] > 0:
-            self.index.add(self.embeddings)
-            for i in range(len(self.embeddings)):
-                label_idx = int(self.labels[i])
-                self.faiss_id_to_name[i] = self.name_map.get(label_idx, "Unknown_Label")
+        self._ann = None
+        self._index_generation += 1
         
-        print(f"[FAISS] Index đã sẵn sàng, đang theo dõi {self.index.ntotal} vector.")
+        self._save_snapshot()
+        self._schedule_ann_build()
 
-    def _build_from_database(self):
-        person_idx = 0
-        self.embeddings = []
-        self.labels = []
-        self.name_map = {}
+    def rebuild(self, progress_callback=None, workers=None):
+        """
+        Xây dựng lại index từ thư mục database (ví dụ khi cấp phát máy mới từ
+        một thư mục database/ được sao chép sang). Thư mục không đổi sẽ dùng lại manifest.
+        Việc đọc ảnh + tính embedding chạy NGOÀI _lock (tìm kiếm vẫn dùng gallery cũ),
+        chỉ bước thay gallery mới giữ _lock.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                self._ops_during_rebuild = []
+            try:
+                gallery = self._build_from_database(progress_callback=progress_callback, workers=workers)
+            except Exception:
+                with self._lock:
+                    self._ops_during_rebuild = None
+                raise
+
+            with self._lock:
+                ops, self._ops_during_rebuild = self._ops_during_rebuild, None
+                self._set_gallery(*gallery)
+                self._reset_index_from_arrays()
+                # Đăng ký/đổi tên xảy ra trong lúc dựng: áp dụng lại và ghi vào journal mới
+                for op, args in ops:
+                    if op == 'add':
+                        self._add_locked(*args)
+                    else:
+                        self._rename_locked(*args)
+            if ops:
+                print(f"[FAISS] Đã áp dụng lại {len(ops)} thay đổi xảy ra trong lúc xây dựng lại.")
+        print(f"[FAISS] Xây dựng lại hoàn tất, đang theo dõi {self.ntotal} vector.")
+
+    # --- XÂY DỰNG LẠI THEO MANIFEST ---
+
+    def _list_person_images(self, person_path):
+        """Trả về {tên file: mtime_ns} của các ảnh trong thư mục một người."""
+        files = {}
+        with os.scandir(person_path) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.IMAGE_EXTENSIONS):
+                    files[entry.name] = entry.stat().st_mtime_ns
+        return files
+
+    def _load_person_manifest(self, person_path, current_files):
+        """Trả về các prototype (k, 512) đã lưu nếu manifest còn khớp với thư mục, ngược lại None."""
+        manifest_path = os.path.join(person_path, self.manifest_name)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != self.MANIFEST_VERSION or manifest.get('files') != current_files:
+                return None
+            prototypes = np.asarray(manifest['prototypes'], dtype=np.float32)
+            if prototypes.ndim != 2 or prototypes.shape[1] != self.embedding_size or len(prototypes) == 0:
+                return None
+            return prototypes
+        except Exception as e:
+            print(f"[FAISS] Manifest lỗi tại {manifest_path}, sẽ tính lại: {e}")
+            return None
+
+    def save_person_manifest(self, person_name, prototypes, files=None):
+        """Ghi manifest cho 1 người (gọi sau khi đăng ký hoặc sau khi tính lại)."""
+        person_path = os.path.join(self.db_dir, person_name)
+        if files is None:
+            files = self._list_person_images(person_path)
+        manifest_path = os.path.join(person_path, self.manifest_name)
+        try:
+            tmp_path = manifest_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': self.MANIFEST_VERSION,
+                    'model': self.model_name,
+                    'files': files,
+                    'prototypes': np.asarray(prototypes, dtype=np.float32).reshape(-1, self.embedding_size).tolist(),
+                }, f)
+            os.replace(tmp_path, manifest_path)
+        except Exception as e:
+            print(f"[FAISS] Lỗi khi lưu manifest cho {person_name}: {e}")
+
+    def _iter_person_faces(self, pending, workers):
+        """
+        Đọc + tiền xử lý ảnh của từng người (theo đúng thứ tự `pending`).
+        Với workers > 1, việc đọc ảnh chạy trong thread pool (cv2 nhả GIL khi giải mã/resize)
+        và được đọc trước trong lúc luồng chính tính embedding. Không dùng process pool:
+        fork một process đang chạy torch/OpenMP, Tk và luồng camera có thể bị treo.
+        """
+        if workers <= 1 or len(pending) <= 1:
+            for item in pending:
+                yield item, _load_person_faces(item[2], list(item[3]))
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="faiss-load")
+        window = max(1, workers * self.REBUILD_PREFETCH_PER_WORKER)
+        pending_iter = iter(pending)
+        in_flight = collections.deque()
+        with executor:
+            for item in itertools.islice(pending_iter, window):
+                in_flight.append((item, executor.submit(_load_person_faces, item[2], list(item[3]))))
+            while in_flight:
+                item, future = in_flight.popleft()
+                next_item = next(pending_iter, None)
+                if next_item is not None:
+                    in_flight.append((next_item, executor.submit(_load_person_faces, next_item[2], list(next_item[3]))))
+                try:
+                    faces = future.result()
+                except Exception as e:
+                    print(f"[FAISS] Lỗi đọc ảnh của {item[1]}: {e}")
+                    faces = np.empty((0, 112, 112, 3), dtype=np.uint8)
+                yield item, faces
+
+    def _build_from_database(self, progress_callback=None, workers=None):
+        """
+        Tính gallery từ thư mục database. KHÔNG sửa self: trả về (embeddings, labels, name_map)
+        để người gọi gán bằng _set_gallery (rebuild() gán dưới _lock sau khi tính xong).
+        """
+        progress_callback = progress_callback or self.progress_callback
+        if workers is None:
+            workers = self.rebuild_workers if self.rebuild_workers is not None else (os.cpu_count() or 1)
+        name_map = {}
+        empty = np.empty((0, self.embedding_size), dtype=np.float32)
 
         if not os.path.isdir(self.db_dir):
             print(f"[FAISS] Thư mục database '{self.db_dir}' không tồn tại. Tạo mới.")
             os.makedirs(self.db_dir, exist_ok=True)
-            return
+            return empty, [], name_map
 
-        for person_name in os.listdir(self.db_dir):
+        # --- LƯỢT 1: Dùng lại prototype nếu thư mục không đổi ---
+        prototypes_by_label = {}
+        pending = []
+        person_idx = 0
+        for person_name in sorted(os.listdir(self.db_dir)):
             person_path = os.path.join(self.db_dir, person_name)
             if not os.path.isdir(person_path):
                 continue
             
-            print(f"[FAISS] Đang quét ảnh cho: {person_name}")
-            self.name_map[person_idx] = person_name
-            
-            # --- TỐI ƯU 3: LOGIC VECTOR TRUNG BÌNH ---
-            person_embeddings = []
-            for file in os.listdir(person_path):
-                if not (file.endswith('.jpg') or file.endswith('.png')):
-                    continue
-                
-                img_path = os.path.join(person_path, file)
-                img = cv2.imread(img_path)
-                if img is None: continue
-                
-                img_resized = cv2.resize(img, (112, 112))
-                img_rgb = cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB)
-                
-                emb = self.recognizer.get_embedding(img_rgb)
-                if emb is not None:
-                    person_embeddings.append(emb[0])
-            
-            # Tính trung bình và chỉ thêm 1 vector cho người này
-            if person_embeddings:
-                person_embeddings_np = np.array(person_embeddings).astype(np.float32)
-                avg_embedding = np.mean(person_embeddings_np, axis=0, keepdims=False)
-                faiss.normalize_L2(avg_embedding.reshape(1, -1)) # Chuẩn hóa
-                
-                self.embeddings.append(avg_embedding)
-                self.labels.append(person_idx)
-                print(f"[FAISS] Đã tạo 1 vector trung bình cho {person_name} từ {len(person_embeddings)} ảnh.")
-            # --- HẾT TỐI ƯU 3 ---
-                
+            name_map[person_idx] = person_name
+            files = self._list_person_images(person_path)
+            prototypes = self._load_person_manifest(person_path, files)
+            if prototypes is not None:
+                prototypes_by_label[person_idx] = prototypes
+            else:
+                pending.append((person_idx, person_name, person_path, files))
             person_idx += 1
 
-        if self.embeddings:
-            self.embeddings = np.array(self.embeddings).astype(np.float32)
-            self.labels = np.array(self.labels)
-            self._save_cache()
-        else:
+        total_persons = person_idx
+        done = total_persons - len(pending)
+        print(f"[FAISS] Xây dựng lại: dùng lại {done} người, cần tính lại {len(pending)} người ({workers} worker).")
+        if progress_callback:
+            progress_callback(done, total_persons, "Đang chuẩn bị dữ liệu khuôn mặt...")
+
+        # --- LƯỢT 2: Đọc ảnh song song + tính embedding theo batch ---
+        # --- TỐI ƯU 3: MỖI NGƯỜI MỘT VÀI PROTOTYPE (k-means) ---
+        t_start = time.time()
+        images_done = 0
+        for (idx, person_name, _, files), faces in self._iter_person_faces(pending, workers):
+            if len(faces) > 0:
+                person_embeddings = self.recognizer.get_embeddings_batch(faces)
+                if person_embeddings is not None and len(person_embeddings) > 0:
+                    prototypes = compute_prototypes(person_embeddings)
+                    prototypes_by_label[idx] = prototypes
+                    self.save_person_manifest(person_name, prototypes, files)
+                    print(f"[FAISS] Đã tạo {len(prototypes)} prototype cho {person_name} từ {len(person_embeddings)} ảnh.")
+            images_done += len(faces)
+            done += 1
+
+            elapsed = max(time.time() - t_start, 1e-6)
+            if progress_callback:
+                progress_callback(done, total_persons, f"Đang xử lý khuôn mặt {done}/{total_persons} ({images_done / elapsed:.0f} ảnh/s)")
+
+        if pending:
+            elapsed = max(time.time() - t_start, 1e-6)
+            print(f"[FAISS] Đã tính {images_done} ảnh trong {elapsed:.1f}s ({images_done / elapsed:.1f} ảnh/s).")
+
+        # Thêm các prototype của từng người, theo thứ tự label
+        embeddings, labels = [], []
+        for idx in sorted(prototypes_by_label):
+            embeddings.append(prototypes_by_label[idx])
+            labels.extend([idx] * len(prototypes_by_label[idx]))
+        # --- HẾT TỐI ƯU 3 ---
+
+        if not embeddings:
             print("[FAISS] Không tìm thấy ảnh nào trong database.")
+            return empty, [], name_map
+        return np.concatenate(embeddings), labels, name_map
 
+    # --- LƯU TRỮ: SNAPSHOT + JOURNAL ---
 
-    def _save_cache(self):
+    def _load_snapshot(self):
+        """Đọc snapshot + sidecar đã lưu và áp dụng journal. Trả về False nếu không dùng được."""
+        legacy = not os.path.exists(self.embeddings_file)
+        data_file = self.index_file if legacy else self.embeddings_file
+        if not all(os.path.exists(p) for p in (data_file, self.labels_file, self.meta_file)):
+            return False
         try:
-            with open(self.cache_file, 'wb') as f:
-                pickle.dump({
-                    'embeddings': self.embeddings,
-                    'labels': self.labels,
-                    'name_map': self.name_map
-                }, f)
-            print(f"[FAISS] Đã lưu cache vào {self.cache_file}")
+            if legacy:
+                # Snapshot cũ: index flat -> lấy lại vector (lần lưu kế tiếp ghi định dạng mới)
+                index = faiss.read_index(self.index_file, faiss.IO_FLAG_MMAP if self.use_mmap else 0)
+                embeddings = index.reconstruct_n(0, index.ntotal) if index.ntotal else np.empty((0, index.d), np.float32)
+                del index
+            else:
+                embeddings = np.load(self.embeddings_file, mmap_mode='r' if self.use_mmap else None)
+            labels = np.load(self.labels_file).astype(np.int32)
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if embeddings.ndim != 2 or embeddings.shape[1] != self.embedding_size or len(embeddings) != len(labels):
+                raise ValueError(f"embeddings {embeddings.shape} không khớp labels ({len(labels)})")
+        except Exception as e:
+            print(f"[FAISS] Lỗi đọc index đã lưu, sẽ xây dựng lại: {e}")
+            return False
+
+        print(f"[FAISS] Đã tải index từ {data_file}")
+        self._ann = None
+        self._index_generation += 1
+        self.name_map = meta.get('name_map', {})
+        self.embeddings = embeddings  # Copy vào bộ đệm (đóng mmap khi embeddings bị thu hồi)
+        del embeddings
+        self.labels = labels
+
+        replayed = self._replay_journal()
+        if replayed:
+            print(f"[FAISS] Đã áp dụng {replayed} bản ghi từ journal.")
+        if np.any(self.labels < 0):
+            # Có prototype đã bị thay khi đăng ký lại: loại bỏ hẳn và gộp snapshot
+            self._drop_tombstones()
+        elif replayed >= self.JOURNAL_COMPACT_THRESHOLD or legacy:
+            self._save_snapshot()
+        self._schedule_ann_build()
+        return True
+
+    def _drop_tombstones(self):
+        keep = self.labels >= 0
+        print(f"[FAISS] Loại bỏ {int(np.count_nonzero(~keep))} prototype cũ đã bị thay.")
+        live_labels = self.labels[keep]
+        self.embeddings = self.embeddings[keep]
+        self.labels = live_labels
+        self._reset_index_from_arrays()
+
+    def _save_snapshot(self):
+        """Ghi bộ đệm embedding + sidecar (atomic, không copy) rồi bắt đầu journal mới."""
+        try:
+            os.makedirs(self.db_dir, exist_ok=True)
+            tmp_embeddings = self.embeddings_file + '.tmp'
+            with open(tmp_embeddings, 'wb') as f:
+                np.save(f, self.embeddings)
+            os.replace(tmp_embeddings, self.embeddings_file)
+
+            tmp_labels = self.labels_file + '.tmp'
+            with open(tmp_labels, 'wb') as f:
+                np.save(f, np.asarray(self.labels, dtype=np.int32))
+            os.replace(tmp_labels, self.labels_file)
+
+            tmp_meta = self.meta_file + '.tmp'
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': 1,
+                    'dim': self.embedding_size,
+                    'ntotal': int(self.ntotal),
+                    'name_map': {str(k): v for k, v in self.name_map.items()},
+                }, f, ensure_ascii=False)
+            os.replace(tmp_meta, self.meta_file)
+
+            gallery_journal.start_journal(self.journal_file, self.ntotal)
+            if os.path.exists(self.index_file):
+                os.remove(self.index_file)  # Snapshot định dạng cũ đã được thay
+            print(f"[FAISS] Đã lưu index vào {self.embeddings_file}")
         except Exception as e:
-            print(f"[FAISS] Lỗi khi lưu cache: {e}")
+            print(f"[FAISS] Lỗi khi lưu index: {e}")
+
+    def _append_journal(self, payload):
+        try:
+            gallery_journal.append_record(self.journal_file, payload)
+        except Exception as e:
+            print(f"[FAISS] Lỗi khi ghi journal: {e}")
+
+    def _replay_journal(self):
+        """Áp dụng các bản ghi journal lên snapshot vừa tải. Trả về số bản ghi đã áp dụng."""
+        base_ntotal, records = gallery_journal.read_journal(self.journal_file, self.embedding_size)
+        if base_ntotal is None:
+            return 0
+        if base_ntotal != self.ntotal:
+            # Journal thuộc về snapshot khác (ví dụ mất điện giữa lúc gộp) -> bỏ qua
+            print("[FAISS] Journal không khớp với snapshot, bỏ qua.")
+            return 0
+
+        for kind, label, name, count, payload in records:
+            if kind in (gallery_journal.KIND_ADD, gallery_journal.KIND_REPLACE):
+                vectors = np.frombuffer(payload, dtype=np.float32).reshape(count, self.embedding_size)
+                self._apply_add(vectors.copy(), label, name, replace=(kind == gallery_journal.KIND_REPLACE))
+            elif kind == gallery_journal.KIND_RENAME:
+                self._apply_rename(*gallery_journal.split_rename(name))
+        return len(records)
+
+    def _label_of(self, person_name):
+        return self._label_by_name.get(person_name)
+
+    def _apply_add(self, new_embs, label, person_name, replace=False):
+        self._name_map[label] = person_name
+        self._label_by_name[person_name] = label
+        self._next_label = max(self._next_label, label + 1)
+        old_rows = self._rows_by_label.pop(label, None) if replace else None
+        if old_rows:
+            # Xóa mềm (tombstone) các prototype cũ: giữ vị trí trong index, label = -1.
+            # Được loại bỏ hẳn ở lần gộp snapshot kế tiếp (_drop_tombstones).
+            self._label_buf[old_rows] = -1
+            self._tombstones += len(old_rows)
+        self._append_rows(new_embs, label)
+        if self._ann is not None:
+            # HNSW / IVF-PQ (đã train) thêm trực tiếp được; dựng lại khi gallery lớn lên nhiều
+            self._ann.add(new_embs)
+            grown = self.ntotal - self._ann_built_ntotal
+            if grown > self.ANN_REBUILD_GROWTH * max(1, self._ann_built_ntotal) \
+                    or self._choose_ann_kind(self.ntotal) != self._ann_kind:
+                self._schedule_ann_build()
+        elif self._choose_ann_kind(self.ntotal) != 'flat':
+            self._schedule_ann_build()
+
+    def _apply_rename(self, old_name, new_name):
+        old_label = self._label_of(old_name)
+        if old_label is None or old_name == new_name:
+            return False
+        existing_label = self._label_of(new_name)
+        del self._label_by_name[old_name]
+        if existing_label is None:
+            # Đổi tên tại chỗ: các vector giữ nguyên label
+            self._name_map[old_label] = new_name
+            self._label_by_name[new_name] = old_label
+        else:
+            # Tên mới đã tồn tại -> gộp vector của label cũ sang label đó
+            old_rows = self._rows_by_label.pop(old_label, [])
+            self._label_buf[old_rows] = existing_label
+            merged = self._rows_by_label.setdefault(existing_label, [])
+            merged.extend(old_rows)
+            del self._name_map[old_label]
+            if len(merged) > self.PROTOTYPES_PER_PERSON:
+                # Gom lại để mỗi người vẫn tối đa PROTOTYPES_PER_PERSON prototype
+                # (search_batch chỉ lấy topk * PROTOTYPES_PER_PERSON ứng viên).
+                # Tất định (seed cố định) nên khi áp dụng lại journal cho cùng kết quả.
+                prototypes = compute_prototypes(self.embeddings[merged], self.PROTOTYPES_PER_PERSON, min_samples=1)
+                self._apply_add(prototypes, existing_label, new_name, replace=True)
+        return True
+
+    def rename_person(self, old_name, new_name):
+        """
+        Đổi nhãn 1 người trong index (ví dụ local_xxx -> user_xxx sau khi đồng bộ server)
+        mà không cần xóa cache và xây dựng lại toàn bộ.
+        """
+        with self._lock:
+            if self._ops_during_rebuild is not None:
+                self._ops_during_rebuild.append(('rename', (old_name, new_name)))
+            if not self._rename_locked(old_name, new_name):
+                print(f"[FAISS] Không tìm thấy '{old_name}' trong index, bỏ qua đổi tên.")
+                return False
+        print(f"[FAISS] Đã đổi nhãn '{old_name}' -> '{new_name}'.")
+        return True
+
+    def _rename_locked(self, old_name, new_name):
+        """(GỌI KHI ĐANG GIỮ _lock) Đổi tên trong RAM + ghi journal."""
+        if not self._apply_rename(old_name, new_name):
+            return False
+        self._append_journal(gallery_journal.pack_rename(old_name, new_name))
+        self._compact_if_needed()
+        return True
+
+    def _compact_if_needed(self):
+        """(GỌI KHI ĐANG GIỮ _lock) Loại bỏ hẳn tombstone khi đã quá nhiều (ghi snapshot mới)."""
+        if self._tombstones > self.TOMBSTONE_COMPACT_THRESHOLD:
+            self._drop_tombstones()
 
     def search(self, query_emb, topk=1):
-        if self.index.ntotal == 0: return []
+        """
+        query_emb: (512,) hoặc (1, 512) đã chuẩn hóa L2 (đầu ra của ModelEmbedding).
+        Trả về list (tên, điểm cosine) giảm dần, mỗi người tối đa 1 lần
+        (điểm = max trên các prototype của người đó).
+        """
+        results = self.search_batch(np.asarray(query_emb).reshape(1, -1), topk)
+        return results[0] if results else []
+
+    def search_batch(self, query_embs, topk=1):
+        """
+        Như search() cho nhiều truy vấn (N, 512): 1 lần tìm kiếm vector hóa cho cả lô,
+        sau đó gộp theo người. Trả về list (độ dài N) các list (tên, điểm cosine).
+        """
         try:
-            D, I = self.index.search(query_emb, topk) 
-            results = []
-            for idx, score in zip(I[0], D[0]):
-                if idx == -1: continue 
-                name = self.faiss_id_to_name.get(idx, "Unknown")
-                results.append((name, float(score)))
-            return results
+            queries = np.ascontiguousarray(query_embs, dtype=np.float32).reshape(-1, self.embedding_size)
+            with self._lock:
+                if self.ntotal == 0: return [[] for _ in range(len(queries))]
+                # Lấy đủ vector để vẫn còn topk người sau khi gộp các prototype,
+                # cộng thêm số prototype đã xóa (label -1) có thể chiếm chỗ trong kết quả
+                D, I = self._search_rows(queries, topk * self.PROTOTYPES_PER_PERSON + self._tombstones)
+                return [self._reduce_by_label(D[n], I[n], topk) for n in range(len(queries))]
         except Exception as e:
             print(f"[FAISS] Lỗi khi tìm kiếm: {e}")
             return []
 
-    def add_embedding(self, new_embs, person_name):
-        # new_embs bây giờ được kỳ vọng là (1, 512) hoặc (N, 512)
+    def add_embedding(self, new_embs, person_name, replace=True):
+        """
+        Thêm các prototype (N, 512) của 1 người. replace=True (mặc định): đăng ký lại sẽ
+        THAY các prototype cũ của người đó thay vì cộng dồn thêm dòng mới.
+        """
         if new_embs.ndim == 1:
             new_embs = np.expand_dims(new_embs, axis=0)
         
-        new_embs = new_embs.astype(np.float32)
+        new_embs = np.ascontiguousarray(new_embs, dtype=np.float32)
         
-        if person_name in self.name_map.values():
-            new_label = [k for k, v in self.name_map.items() if v == person_name][0]
-            print(f"[FAISS] {person_name} đã tồn tại, dùng lại label {new_label}.")
-            # TÙY CHỌN: Có thể cập nhật vector trung bình cũ, nhưng giờ ta chỉ thêm mới
-        else:
-            new_label = len(self.name_map)
-            self.name_map[new_label] = person_name
-            print(f"[FAISS] Tạo label mới {new_label} cho {person_name}.")
+        with self._lock:
+            if self._ops_during_rebuild is not None:
+                self._ops_during_rebuild.append(('add', (new_embs, person_name, replace)))
+            self._add_locked(new_embs, person_name, replace)
 
-        start_id = self.index.ntotal
-        self.index.add(new_embs)
-        
-        # Thêm vào cache
-        self.embeddings = np.vstack([self.embeddings, new_embs])
-        new_labels_arr = np.array([new_label] * len(new_embs))
-        self.labels = np.hstack([self.labels, new_labels_arr])
+        print(f"[FAISS] Đã thêm {len(new_embs)} prototype cho {person_name}.")
 
-        for i in range(len(new_embs)):
-            self.faiss_id_to_name[start_id + i] = person_name
+    def _add_locked(self, new_embs, person_name, replace):
+        """(GỌI KHI ĐANG GIỮ _lock) Chọn label, thêm vào RAM + ghi journal."""
+        new_label = self._label_of(person_name)
+        if new_label is not None:
+            print(f"[FAISS] {person_name} đã tồn tại, dùng lại label {new_label}"
+                  f"{' (thay prototype cũ)' if replace else ''}.")
+        else:
+            new_label = self._next_label
+            print(f"[FAISS] Tạo label mới {new_label} cho {person_name}.")
 
-        print(f"[FAISS] Đã thêm {len(new_embs)} vector trung bình cho {person_name}.")
-        self._save_cache()
+        self._apply_add(new_embs, new_label, person_name, replace=replace)
+        # Chỉ ghi thêm vào journal, không ghi lại toàn bộ index
+        self._append_journal(gallery_journal.pack_add(new_label, person_name, len(new_embs),
+                                                      new_embs.tobytes(), replace=replace))
+        self._compact_if_needed()
 
 
 class MediaPipeFaceDetector:
     """
     Sử dụng MediaPipe để phát hiện khuôn mặt VÀ 6 điểm mốc chính.
     """
-    def __init__(self):
+    def __init__(self, detection_scale=1.0, min_detection_width=160):
+        """
+        detection_scale: tỉ lệ thu nhỏ frame trước khi detect (1.0 = giữ nguyên).
+        Tọa độ MediaPipe là tương đối nên bbox/keypoints vẫn được trả về theo frame gốc,
+        và việc căn chỉnh (align_face_112) vẫn cắt từ ảnh độ phân giải đầy đủ.
+        min_detection_width: không thu nhỏ ảnh xuống hẹp hơn mức này (ví dụ ROI của tracker).
+        """
         print("[DETECT] Đang tải model MediaPipe Face Detection...")
+        self.detection_scale = float(detection_scale)
+        self.min_detection_width = int(min_detection_width)
         self.detector = mp.solutions.face_detection.FaceDetection(
             model_selection=0, min_detection_confidence=0.7)
-        print("[DETECT] Tải model MediaPipe thành công.")
+        # 1 graph MediaPipe không an toàn khi gọi process() từ nhiều luồng cùng lúc
+        # (luồng webcam + FaceRecognitionHandler dùng chung detector này)
+        self._process_lock = threading.Lock()
+        print(f"[DETECT] Tải model MediaPipe thành công (detection_scale={self.detection_scale}).")
+
+    def _prepare_rgb(self, frame_bgr):
+        """Thu nhỏ (nếu cần) rồi chuyển sang RGB. Thu nhỏ trước để cvtColor rẻ hơn."""
+        w = frame_bgr.shape[1]
+        scale = self.detection_scale
+        if scale < 1.0 and w > self.min_detection_width:
+            scale = max(scale, self.min_detection_width / w)
+            small = cv2.resize(frame_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            return cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        return cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
 
     def detect(self, frame_bgr):
         """
@@ -273,9 +1138,11 @@ class MediaPipeFaceDetector:
         - keypoints: Dictionary chứa 6 điểm mốc (ví dụ: 'left_eye', 'right_eye', ...)
         """
         try:
+            # h, w luôn là kích thước frame GỐC: tọa độ tương đối được nhân ngược lại
             h, w, _ = frame_bgr.shape
-            rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-            results = self.detector.process(rgb)
+            rgb = self._prepare_rgb(frame_bgr)
+            with self._process_lock:
+                results = self.detector.process(rgb)
             
             detected_faces = []
             
@@ -310,6 +1177,71 @@ class MediaPipeFaceDetector:
         except Exception as e:
             print(f"[DETECT] Lỗi MediaPipe: {e}")
             return []
+
+
+class FaceTracker:
+    """
+    Bám theo khuôn mặt qua các frame liên tiếp để giảm chi phí MediaPipe.
+    - Khi đã thấy mặt: chỉ detect trong vùng ROI (bbox cũ + lề) thay vì cả frame.
+    - Cứ full_detect_interval frame thì detect lại toàn frame một lần.
+    - reuse_frames > 0: dùng lại bbox/keypoints cũ cho chừng ấy frame giữa 2 lần detect.
+    - Mất dấu trong ROI -> quay về detect toàn frame ngay.
+    Giao diện detect() giống MediaPipeFaceDetector.detect().
+    """
+    def __init__(self, detector, roi_padding=0.5, full_detect_interval=10, reuse_frames=0, min_roi_size=64):
+        self.detector = detector
+        self.roi_padding = roi_padding
+        self.full_detect_interval = full_detect_interval
+        self.reuse_frames = reuse_frames
+        self.min_roi_size = min_roi_size
+        self.reset()
+
+    def reset(self):
+        """Quên khuôn mặt đang theo dõi (gọi khi bắt đầu một phiên đăng ký/đăng nhập mới)."""
+        self._last_face = None
+        self._frames_since_full = 0
+        self._frames_since_detect = 0
+
+    def _detect_in_roi(self, frame_bgr):
+        h, w = frame_bgr.shape[:2]
+        x1, y1, x2, y2 = self._last_face[0]
+        pad_x = int((x2 - x1) * self.roi_padding)
+        pad_y = int((y2 - y1) * self.roi_padding)
+        rx1, ry1 = max(0, x1 - pad_x), max(0, y1 - pad_y)
+        rx2, ry2 = min(w, x2 + pad_x), min(h, y2 + pad_y)
+        if rx2 - rx1 < self.min_roi_size or ry2 - ry1 < self.min_roi_size:
+            return []
+
+        faces = self.detector.detect(frame_bgr[ry1:ry2, rx1:rx2])
+        # Đổi tọa độ từ ROI về frame gốc
+        shifted = []
+        for (bx1, by1, bx2, by2), keypoints in faces:
+            bbox = (bx1 + rx1, by1 + ry1, bx2 + rx1, by2 + ry1)
+            kps = {name: (x + rx1, y + ry1) for name, (x, y) in keypoints.items()}
+            shifted.append((bbox, kps))
+        return shifted
+
+    def detect(self, frame_bgr):
+        if self._last_face is not None:
+            if self._frames_since_detect < self.reuse_frames:
+                self._frames_since_detect += 1
+                return [self._last_face]
+
+            if self._frames_since_full < self.full_detect_interval:
+                faces = self._detect_in_roi(frame_bgr)
+                if faces:
+                    self._last_face = faces[0]
+                    self._frames_since_full += 1
+                    self._frames_since_detect = 0
+                    return faces
+
+        # Chưa có mặt, mất dấu hoặc đến lượt detect toàn frame
+        faces = self.detector.detect(frame_bgr)
+        self._last_face = faces[0] if faces else None
+        self._frames_since_full = 0
+        self._frames_since_detect = 0
+        return faces
+
 # =========================================================================
 # CLASS THƯ VIỆN CHÍNH
 # =========================================================================
@@ -318,39 +1250,90 @@ class FaceRecognitionSystemWebcam:
     # --- CẤU HÌNH ---
     
     # --- TỐI ƯU 4: Sửa đường dẫn ---
-    # Chỉ định tên model
-    MODEL_NAME = "edgeface_base"
+    # Chỉ định tên model (None = FACE_MODEL_NAME trong config.py, xem model_registry.py)
+    MODEL_NAME = None
     # Chỉ định thư mục database (sẽ được join với MODULE_ROOT)
     DATABASE_DIR_NAME = os.path.join(MODULE_ROOT, 'database')
     
     # --- TỐI ƯU 1: GIẢM ĐỘ TRỄ ---
-    # Chỉ giữ frame mới nhất để giảm độ trễ
-    IMAGE_QUEUE_SIZE = 1 
+    # Một luồng duy nhất giữ camera, phát frame qua FrameBus (ring buffer nhỏ).
+    # Mỗi nơi dùng (preview, đăng nhập, đăng ký, nhận diện nền) đọc bằng cursor riêng.
+    FRAME_BUS_CAPACITY = 4
+    CAMERA_INDEX = 0
+
+    # --- ĐĂNG NHẬP: DỪNG SỚM ---
+    # Số ứng viên lấy từ FAISS để tính độ chênh lệch với người đứng thứ 2
+    LOGIN_SEARCH_TOPK = 5
+
+    # --- THEO DÕI KHUÔN MẶT (giảm số lần detect toàn frame) ---
+    FACE_TRACKING = True
+    TRACK_ROI_PADDING = 0.5
+    TRACK_FULL_DETECT_INTERVAL = 10
+    TRACK_REUSE_FRAMES = 0
+
+    # --- DETECT TRÊN ẢNH THU NHỎ (align vẫn dùng ảnh gốc) ---
+    # Xem benchmark_detection.py để so sánh độ trễ/độ chính xác theo từng tỉ lệ
+    DETECTION_SCALE = 0.5
+
+    # --- ĐĂNG KÝ: CĂN CHỈNH THEO LÔ ---
+    # Số frame đã detect được gom lại rồi căn chỉnh 1 lần (ma trận tính chung bằng NumPy)
+    REGISTER_ALIGN_CHUNK = 8
     
-    def __init__(self):
+    def __init__(self, rebuild_progress_callback=None, detector=None, recognizer=None):
+        """
+        rebuild_progress_callback(số người đã xong, tổng số người, thông điệp):
+        được gọi khi phải xây dựng lại index từ thư mục database (màn hình chờ hiển thị).
+        detector / recognizer: có thể truyền vào nếu đã được tải sẵn ở luồng khác
+        (bộ điều phối khởi động tải MediaPipe và model EdgeFace song song).
+        """
         print("--- Đang khởi tạo Hệ thống Nhận diện Khuôn mặt (Webcam) ---")
         
-        self.latest_frame_for_display = None
-
         # --- TỐI ƯU 4: Sửa đường dẫn ---
         # Tạo đường dẫn tuyệt đối cho thư mục database
         self.DATABASE_BACKUP_DIR = os.path.join(MODULE_ROOT, self.DATABASE_DIR_NAME)
         os.makedirs(self.DATABASE_BACKUP_DIR, exist_ok=True) # Đảm bảo thư mục tồn tại
 
-        self.detector = MediaPipeFaceDetector()
-        self.recognizer = ModelEmbedding(self.MODEL_NAME)
-        self.searcher = FastFaceSearch(self.recognizer, self.MODEL_NAME, self.DATABASE_BACKUP_DIR)
+        self.detector = detector or self.create_detector()
+        self.tracker = FaceTracker(
+            self.detector,
+            roi_padding=self.TRACK_ROI_PADDING,
+            full_detect_interval=self.TRACK_FULL_DETECT_INTERVAL,
+            reuse_frames=self.TRACK_REUSE_FRAMES
+        )
+        self.recognizer = recognizer or self.create_recognizer()
+
+        # Mỗi model có cache riêng; đổi model -> tính lại embedding gallery từ ảnh gốc
+        self.model_name = self.recognizer.model_name
+        previous_model = model_registry.read_active_model(self.DATABASE_BACKUP_DIR)
+        model_changed = previous_model is not None and previous_model != self.model_name
+        if model_changed:
+            print(f"[MODEL] Đổi model {previous_model} -> {self.model_name}: tính lại embedding gallery.")
+        # Gallery dùng chung trong process (FaceRecognitionHandler cũng dùng instance này)
+        self.searcher = FastFaceSearch.shared(self.recognizer, self.model_name, self.DATABASE_BACKUP_DIR,
+                                              progress_callback=rebuild_progress_callback,
+                                              force_rebuild=model_changed)
+        model_registry.write_active_model(self.DATABASE_BACKUP_DIR, self.model_name)
         
-        self.image_queue = queue.Queue(maxsize=self.IMAGE_QUEUE_SIZE)
+        self.frame_bus = FrameBus(capacity=self.FRAME_BUS_CAPACITY)
+        # Cursor dùng chung cho đăng ký/đăng nhập (2 chức năng không chạy cùng lúc)
+        self._capture_cursor = self.frame_bus.subscribe()
         
         self.webcam_thread = threading.Thread(target=self._webcam_reader_thread, daemon=True)
         self.webcam_thread.start()
         
-        print(f"--- Hệ thống đã sẵn sàng (Queue size: {self.IMAGE_QUEUE_SIZE}) ---")
+        print(f"--- Hệ thống đã sẵn sàng (Frame bus: {self.FRAME_BUS_CAPACITY} frame) ---")
+
+    @classmethod
+    def create_detector(cls):
+        return MediaPipeFaceDetector(detection_scale=cls.DETECTION_SCALE)
+
+    @classmethod
+    def create_recognizer(cls):
+        return ModelEmbedding(model_registry.resolve_model_name(cls.MODEL_NAME))
 
     def _webcam_reader_thread(self):
         print("[WEBCAM] Đang mở webcam...")
-        cap = cv2.VideoCapture(0)
+        cap = cv2.VideoCapture(self.CAMERA_INDEX)
         if not cap.isOpened():
             print("[WEBCAM] Lỗi: Không thể mở webcam.")
             return
@@ -361,91 +1344,95 @@ class FaceRecognitionSystemWebcam:
                 print("[WEBCAM] Lỗi: Không thể đọc frame. Thử lại...")
                 cap.release()
                 time.sleep(2)
-                cap = cv2.VideoCapture(0)
+                cap = cv2.VideoCapture(self.CAMERA_INDEX)
                 continue
 
             # --- TỐI ƯU 1: LOGIC "LATEST FRAME" ---
-            # Logic này đã đúng: nếu queue đầy (size=1),
-            # nó sẽ vứt frame cũ đi để nhét frame mới vào.
-            if self.image_queue.full():
-                try: self.image_queue.get_nowait()
-                except queue.Empty: pass
-            
-            self.latest_frame_for_display = frame
-            self.image_queue.put(frame)
+            # Ghi đè frame cũ nhất trong ring buffer, không ai bị "cướp" frame.
+            # cap.read() trả về mảng mới mỗi lần nên chia sẻ theo tham chiếu là an toàn.
+            self.frame_bus.publish(frame, time.monotonic())
             time.sleep(0.01) # Vẫn giữ sleep nhỏ để tránh lãng phí 100% CPU
 
         cap.release()
+        self.frame_bus.close()
         print("[WEBCAM] Đã đóng webcam.")
 
     def get_latest_frame_for_display(self):
-        return self.latest_frame_for_display
+        latest = self.frame_bus.latest()
+        return latest[2] if latest else None
     
     def clear_image_queue(self):
-        while not self.image_queue.empty():
-            try: self.image_queue.get_nowait()
-            except queue.Empty: break
+        # Không xóa gì trong bus (nơi khác vẫn đang đọc), chỉ dời cursor của mình
+        # để lần đọc sau chờ frame chụp sau thời điểm này.
+        self._capture_cursor.skip_to_latest()
         print("[QUEUE] Bộ đệm ảnh đã được dọn dẹp.")
 
     def _get_image_from_camera(self, timeout=3.0):
-        try:
-            # Lấy frame mới nhất từ queue
-            return self.image_queue.get(timeout=timeout)
-        except queue.Empty:
+        # Chờ frame mới hơn frame đã dùng lần trước (không bao giờ trả lại cùng 1 frame)
+        frame = self._capture_cursor.next(timeout=timeout)
+        if frame is None:
             print(f"[CAMERA] Lỗi: Không nhận được ảnh từ webcam trong {timeout} giây.")
-            return None
+        return frame
+
+    def _detect_primary_face(self, bgr_frame):
+        """Detect (qua tracker nếu bật), trả về (bbox, keypoints) của khuôn mặt đầu tiên hoặc (None, None)."""
+        if self.FACE_TRACKING:
+            detected_faces = self.tracker.detect(bgr_frame)
+        else:
+            detected_faces = self.detector.detect(bgr_frame)
 
-    def _find_and_prep_face(self, bgr_frame):
-        """
-        Tìm, căn chỉnh (xoay) và chuẩn bị khuôn mặt.
-        """
-    
-        # 1. Dùng detector mới, trả về cả bbox và keypoints
-        detected_faces = self.detector.detect(bgr_frame) 
-    
         if not detected_faces:
             return None, None # Không tìm thấy mặt
 
         # Lấy khuôn mặt đầu tiên (hoặc lớn nhất)
-        bbox, keypoints = detected_faces[0]
-    
-        # 2. Gọi hàm alignment mới (Dùng cv2.warpAffine)
-        aligned_face_bgr = align_face_112(bgr_frame, keypoints)
-    
-        if aligned_face_bgr is None:
+        return detected_faces[0]
+
+    def _find_and_prep_face(self, bgr_frame, out=None):
+        """
+        Tìm, căn chỉnh (xoay) và chuẩn bị khuôn mặt.
+        Trả về (ảnh RGB 112x112, bbox). out: buffer (1, 112, 112, 3) cấp phát sẵn (tùy chọn).
+        """
+        bbox, keypoints = self._detect_primary_face(bgr_frame)
+        if keypoints is None:
             return None, None
-        
-        # 3. Chuyển sang RGB để chuẩn bị cho model EdgeFace
-        aligned_face_rgb = cv2.cvtColor(aligned_face_bgr, cv2.COLOR_BGR2RGB)
-    
-        return aligned_face_rgb, bbox
+
+        # Căn chỉnh + chuyển sang RGB (đầu vào của EdgeFace) trong 1 bước
+        aligned = align_faces_batch([bgr_frame], [keypoints], out=out)
+        if len(aligned) == 0:
+            return None, None
+
+        return aligned[0], bbox
 
     # =========================================================================
     # CHỨC NĂNG 1: ĐĂNG KÝ KHÁCH HÀNG
     # =========================================================================
     def register_customer(self, customer_name, num_images_to_capture=200, progress_callback=None, stop_flag_check=None):
         """
-        Phiên bản Hybrid:
-        - Tính toán AI (Embedding) NGAY LẬP TỨC trong vòng lặp chụp.
-        - Lưu ảnh vào RAM buffer.
+        Phiên bản Batch:
+        - Vòng lặp chụp chỉ Detect; cứ REGISTER_ALIGN_CHUNK frame thì căn chỉnh theo lô,
+          warp thẳng vào 1 buffer (N, 112, 112, 3) RGB cấp phát sẵn trong RAM.
+        - Sau khi đủ ảnh, tính embedding theo batch (ít lần forward hơn nhiều).
         - Chỉ ghi xuống ổ cứng (I/O) sau khi hoàn tất.
-        -> Tận dụng thời gian tính AI làm độ trễ tự nhiên để khách quay đầu.
         """
         if not customer_name or not customer_name.strip():
             print("[REGISTER] Lỗi: Tên khách hàng không hợp lệ.")
             return False
         
         customer_name = customer_name.strip()
-        print(f"--- BẮT ĐẦU ĐĂNG KÝ (REAL-TIME AI) CHO '{customer_name}' ---")
+        print(f"--- BẮT ĐẦU ĐĂNG KÝ (BATCH AI) CHO '{customer_name}' ---")
         
-        # Buffer chứa bộ đôi: (ảnh_đã_crop, vector_đặc_trưng)
-        captured_data_buffer = [] 
+        # Buffer cấp phát 1 lần cho mọi khuôn mặt đã căn chỉnh (RGB 112x112), warp thẳng vào đây
+        faces_buf = np.empty((num_images_to_capture, ALIGN_SIZE, ALIGN_SIZE, 3), dtype=np.uint8)
+        count = 0
+        # Frame đã detect, chờ căn chỉnh theo lô (chỉ giữ vài frame, không giữ cả 200 frame gốc)
+        pending_frames, pending_kps = [], []
+        self.tracker.reset()
         
         if progress_callback:
             progress_callback(0, num_images_to_capture, "Chuẩn bị...")
 
-        # --- GIAI ĐOẠN 1: CHỤP & TÍNH TOÁN (Vừa chụp vừa tính) ---
-        while len(captured_data_buffer) < num_images_to_capture:
+        # --- GIAI ĐOẠN 1: CHỤP & CĂN CHỈNH ---
+        while count < num_images_to_capture:
             # 1. Kiểm tra hủy
             if stop_flag_check and stop_flag_check():
                 self.clear_image_queue()
@@ -455,75 +1442,77 @@ class FaceRecognitionSystemWebcam:
             bgr_frame = self._get_image_from_camera(timeout=1.0)
             if bgr_frame is None: continue
 
-            # 3. Detect & Crop (Bước này nhanh)
-            rgb_face_112, _ = self.find_and_prep_face(bgr_frame)
-            
-            if rgb_face_112 is not None:
-                # 4. TÍNH AI NGAY LẬP TỨC (Bước này tốn ~100-200ms)
-                # Chính bước này tạo ra độ trễ tự nhiên giúp khách kịp quay đầu
-                embedding = self.recognizer.get_embedding(rgb_face_112)
-                
-                if embedding is not None:
-                    # Chỉ lưu vào RAM, CHƯA ghi ổ cứng
-                    captured_data_buffer.append({
-                        "image": rgb_face_112,
-                        "embedding": embedding[0]
-                    })
-                    
-                    count = len(captured_data_buffer)
-                    
-                    # Gửi callback "CAPTURING" để UI hiện hướng dẫn (Quay trái/phải...)
-                    if progress_callback:
-                        progress_callback(count, num_images_to_capture, "CAPTURING")
-                        
-                    if count % 10 == 0:
-                        print(f"[REGISTER] Đã xử lý: {count}/{num_images_to_capture}")
-            
-            # Không cần time.sleep() vì hàm get_embedding đã tốn thời gian rồi
+            # 3. Detect (Bước này nhanh), gom frame để căn chỉnh theo lô
+            _, keypoints = self._detect_primary_face(bgr_frame)
+            if keypoints is None: continue
+            pending_frames.append(bgr_frame)
+            pending_kps.append(keypoints)
+            if (len(pending_frames) < self.REGISTER_ALIGN_CHUNK
+                    and count + len(pending_frames) < num_images_to_capture):
+                continue
+
+            aligned = align_faces_batch(pending_frames, pending_kps,
+                                        out=faces_buf[count:count + len(pending_frames)])
+            pending_frames.clear()
+            pending_kps.clear()
+            if len(aligned) == 0: continue
 
-        print(f"[REGISTER] Đã thu thập đủ {len(captured_data_buffer)} ảnh và vector. Đang lưu đĩa...")
+            prev_count, count = count, count + len(aligned)
+            # Gửi callback "CAPTURING" để UI hiện hướng dẫn (Quay trái/phải...)
+            if progress_callback:
+                progress_callback(count, num_images_to_capture, "CAPTURING")
+
+            if count // 10 > prev_count // 10:
+                print(f"[REGISTER] Đã chụp: {count}/{num_images_to_capture}")
+
+        captured_faces = faces_buf[:count]
+
+        # --- GIAI ĐOẠN 2: TÍNH EMBEDDING THEO BATCH ---
+        if progress_callback:
+            progress_callback(num_images_to_capture, num_images_to_capture, "Đang xử lý dữ liệu khuôn mặt...")
 
-        # --- GIAI ĐOẠN 2: LƯU TRỮ (Chỉ tốn I/O disk, rất nhanh) ---
+        t0 = time.time()
+        embeddings_np = self.recognizer.get_embeddings_batch(captured_faces)
+        if embeddings_np is not None:
+            print(f"[REGISTER] Đã tính {len(embeddings_np)} embedding trong {time.time() - t0:.2f}s.")
+
+        if stop_flag_check and stop_flag_check():
+            self.clear_image_queue()
+            return False
+
+        # --- GIAI ĐOẠN 3: LƯU TRỮ (Chỉ tốn I/O disk, rất nhanh) ---
         if progress_callback:
             progress_callback(num_images_to_capture, num_images_to_capture, "Đang lưu dữ liệu...")
 
         person_dir = os.path.join(self.searcher.db_dir, customer_name)
         os.makedirs(person_dir, exist_ok=True)
 
-        all_embeddings = []
-        
         # Duyệt qua buffer để lưu ra file
-        for idx, data in enumerate(captured_data_buffer):
+        for idx, face_img in enumerate(captured_faces):
             if stop_flag_check and stop_flag_check(): return False
 
-            face_img = data["image"]
-            emb_vec = data["embedding"]
-            
-            all_embeddings.append(emb_vec)
-            
             # Lưu ảnh JPG (để làm dataset train sau này)
             save_path = os.path.join(person_dir, f"{idx:03d}.jpg")
             # Chuyển RGB -> BGR khi lưu bằng OpenCV
             cv2.imwrite(save_path, cv2.cvtColor(face_img, cv2.COLOR_RGB2BGR))
         
-        # --- GIAI ĐOẠN 3: TẠO VECTOR TRUNG BÌNH & KẾT THÚC ---
+        # --- GIAI ĐOẠN 4: TẠO PROTOTYPE (k-means theo góc mặt) & KẾT THÚC ---
         success = False
-        if all_embeddings:
-            embeddings_np = np.array(all_embeddings).astype(np.float32)
-            
-            # Tính trung bình cộng
-            avg_embedding = np.mean(embeddings_np, axis=0, keepdims=True)
-            faiss.normalize_L2(avg_embedding)
+        if embeddings_np is not None and len(embeddings_np) > 0:
+            prototypes = compute_prototypes(embeddings_np)
             
-            # Thêm vào database nhận diện
-            self.searcher.add_embedding(avg_embedding, customer_name)
+            # Thêm vào database nhận diện (thay prototype cũ nếu đăng ký lại)
+            self.searcher.add_embedding(prototypes, customer_name)
             
             # Lưu ảnh đại diện (lấy ảnh cuối)
-            last_img = captured_data_buffer[-1]["image"]
+            last_img = captured_faces[-1]
             cv2.imwrite(os.path.join(person_dir, "000_avg_ref.jpg"), cv2.cvtColor(last_img, cv2.COLOR_RGB2BGR))
+
+            # Ghi manifest để lần xây dựng lại sau không phải tính lại thư mục này
+            self.searcher.save_person_manifest(customer_name, prototypes)
             
             success = True
-            print(f"[REGISTER] Hoàn tất đăng ký {customer_name} với {len(all_embeddings)} ảnh.")
+            print(f"[REGISTER] Hoàn tất đăng ký {customer_name} với {len(embeddings_np)} ảnh.")
         else:
              if progress_callback:
                 progress_callback(0, num_images_to_capture, "Lỗi: Không có dữ liệu AI", error=True)
@@ -534,9 +1523,36 @@ class FaceRecognitionSystemWebcam:
     # =========================================================================
     # CHỨC NĂNG 2: ĐĂNG NHẬP / NHẬN DIỆN KHÁCH HÀNG
     # =========================================================================
-    def login_customer(self, num_images_to_capture=10, similarity_threshold=0.4, progress_callback=None, stop_flag_check=None): # <-- THÊM STOP_FLAG_CHECK
-        
-        if self.searcher.index.ntotal == 0:
+    def _login_face_producer(self, num_frames, face_queue, stop_event):
+        """
+        (LUỒNG PHỤ) Lấy ảnh + Detect + Align cho đăng nhập pipeline.
+        Trong lúc luồng chính tính embedding cho frame N, luồng này đã detect frame N+1.
+        Đẩy vào face_queue khuôn mặt RGB 112x112 (hoặc None nếu frame không có mặt).
+        """
+        produced = 0
+        while produced < num_frames and not stop_event.is_set():
+            bgr_frame = self._get_image_from_camera(timeout=1.0)
+            if bgr_frame is None: continue
+
+            rgb_face_112, _ = self.find_and_prep_face(bgr_frame)
+            while not stop_event.is_set():
+                try:
+                    face_queue.put(rgb_face_112, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            produced += 1
+
+    def login_customer(self, num_images_to_capture=10, similarity_threshold=0.4, progress_callback=None, stop_flag_check=None, # <-- THÊM STOP_FLAG_CHECK
+                       pipelined=True, early_exit_frames=LOGIN_EARLY_EXIT_FRAMES, min_margin=LOGIN_MIN_MARGIN):
+        """
+        Nhận diện khách hàng từ tối đa num_images_to_capture frame.
+        - pipelined: detect frame kế tiếp song song với embedding frame hiện tại.
+        - early_exit_frames: dừng sớm khi có chừng ấy frame LIÊN TIẾP cùng kết quả,
+          điểm > similarity_threshold và hơn người đứng thứ 2 ít nhất min_margin
+          (0/None để tắt, luôn lấy đủ số frame rồi bỏ phiếu như cũ).
+        """
+        if self.searcher.ntotal == 0:
             print("[LOGIN] Cảnh báo: Database rỗng. Không thể nhận diện.")
             if progress_callback:
                 progress_callback(0, num_images_to_capture, "Database rỗng", error=True)
@@ -547,43 +1563,98 @@ class FaceRecognitionSystemWebcam:
             progress_callback(0, num_images_to_capture, "Bắt đầu nhận diện...")
         
         votes = []
+        streak_name, streak_len = None, 0
+        early_result = None
+
+        self.tracker.reset()
+        stop_event = threading.Event()
+        face_queue = queue.Queue(maxsize=2)
+        producer = None
+        if pipelined:
+            producer = threading.Thread(
+                target=self._login_face_producer,
+                args=(num_images_to_capture, face_queue, stop_event),
+                name="login-face-producer",
+                daemon=True
+            )
+            producer.start()
         
-        for i in range(num_images_to_capture):
-            if stop_flag_check and stop_flag_check():
-                print("[LOGIN] Người dùng hủy bỏ.")
-                self.clear_image_queue()
-                return "Unknown" # Trả về "Unknown" nếu bị hủy
-            msg = f"Đang lấy ảnh {i + 1}/{num_images_to_capture}..."
-            print(f"[LOGIN] {msg}")
-            if progress_callback:
-                progress_callback(i, num_images_to_capture, msg)
+        cancelled = False
+        try:
+            for i in range(num_images_to_capture):
+                if stop_flag_check and stop_flag_check():
+                    print("[LOGIN] Người dùng hủy bỏ.")
+                    cancelled = True
+                    break
+                msg = f"Đang lấy ảnh {i + 1}/{num_images_to_capture}..."
+                print(f"[LOGIN] {msg}")
+                if progress_callback:
+                    progress_callback(i, num_images_to_capture, msg)
 
-            bgr_frame = self._get_image_from_camera()
-            if bgr_frame is None: continue
+                if pipelined:
+                    try:
+                        rgb_face_112 = face_queue.get(timeout=3.0)
+                    except queue.Empty:
+                        print("[CAMERA] Lỗi: Không nhận được khuôn mặt từ luồng detect trong 3 giây.")
+                        continue
+                else:
+                    bgr_frame = self._get_image_from_camera()
+                    if bgr_frame is None: continue
+                    rgb_face_112, _ = self.find_and_prep_face(bgr_frame)
+                
+                if rgb_face_112 is None:
+                    continue
 
-            rgb_face_112, _ = self.find_and_prep_face(bgr_frame)
-            
-            if rgb_face_112 is not None:
                 embedding = self.recognizer.get_embedding(rgb_face_112)
-                
-                if embedding is not None:
-                    results = self.searcher.search(embedding, topk=1)
-                    
-                    if results:
-                        best_name, best_score = results[0]
-                        print(f"  -> {best_name} (Score: {best_score:.4f})")
-                        if best_score > similarity_threshold:
-                            votes.append(best_name)
-                        else:
-                            votes.append("Unknown")
-            
-            time.sleep(0.05)
+                if embedding is None:
+                    continue
+
+                results = self.searcher.search(embedding, topk=self.LOGIN_SEARCH_TOPK)
+                if not results:
+                    continue
+
+                best_name, best_score = results[0]
+                # Điểm của người khác tốt nhất (để đo độ chênh lệch)
+                second_score = next((score for name, score in results[1:] if name != best_name), -1.0)
+                print(f"  -> {best_name} (Score: {best_score:.4f}, Margin: {best_score - second_score:.4f})")
+
+                if best_score > similarity_threshold:
+                    votes.append(best_name)
+                else:
+                    votes.append("Unknown")
+
+                # --- DỪNG SỚM KHI ĐỦ TIN CẬY ---
+                if best_score > similarity_threshold and best_score - second_score >= min_margin:
+                    if best_name == streak_name:
+                        streak_len += 1
+                    else:
+                        streak_name, streak_len = best_name, 1
+                else:
+                    streak_name, streak_len = None, 0
+
+                if early_exit_frames and streak_len >= early_exit_frames:
+                    early_result = streak_name
+                    print(f"[LOGIN] Dừng sớm sau {i + 1} frame: {streak_len} frame liên tiếp khớp {streak_name}.")
+                    break
+        finally:
+            # Chờ luồng producer dừng hẳn (tối đa 1 lần đọc camera + 1 lần detect) trước khi
+            # dọn cursor: phiên đăng nhập/đăng ký sau dùng chung tracker, graph MediaPipe
+            # (không thread-safe) và _capture_cursor.
+            stop_event.set()
+            if producer is not None:
+                producer.join()
+
+        if cancelled:
+            self.clear_image_queue()
+            return "Unknown" # Trả về "Unknown" nếu bị hủy
         
         if progress_callback:
             progress_callback(num_images_to_capture, num_images_to_capture, "Đang xử lý kết quả...")
 
         result = "Unknown"
-        if votes:
+        if early_result is not None:
+            result = early_result
+        elif votes:
             most_common_vote = Counter(votes).most_common(1)[0]
             name = most_common_vote[0]
             count = most_common_vote[1]
@@ -596,47 +1667,112 @@ class FaceRecognitionSystemWebcam:
         return result
     
     # --- Hàm helper để gọi từ bên ngoài ---
+
+    def rename_person(self, old_name, new_name):
+        """
+        Đổi tên thư mục ảnh và nhãn trong index của 1 người (ví dụ ID local -> ID server).
+        Manifest nằm trong thư mục nên được giữ nguyên, không cần tính lại embedding.
+        """
+        old_dir = os.path.join(self.searcher.db_dir, str(old_name))
+        new_dir = os.path.join(self.searcher.db_dir, str(new_name))
+        if os.path.isdir(old_dir):
+            if os.path.exists(new_dir):
+                # Gộp file nếu thư mục mới đã tồn tại
+                for f in os.listdir(old_dir):
+                    shutil.move(os.path.join(old_dir, f), os.path.join(new_dir, f))
+                shutil.rmtree(old_dir)
+            else:
+                os.rename(old_dir, new_dir)
+            print(f"[RENAME] Đã đổi tên thư mục ảnh '{old_name}' -> '{new_name}'.")
+        return self.searcher.rename_person(str(old_name), str(new_name))
     
     def find_and_prep_face(self, bgr_frame):
         # Wrapper cho hàm private
         return self._find_and_prep_face(bgr_frame)
 
+# Vị trí "chuẩn" của các điểm mốc trên ảnh 112x112 (template ArcFace; miệng = trung điểm 2 khóe miệng).
+# 2 điểm tai (tragion) của MediaPipe nằm ngoài khung 112x112 và dao động mạnh khi quay mặt nên không dùng.
+ALIGN_SIZE = 112
+ALIGN_KEYPOINTS = ('right_eye', 'left_eye', 'nose_tip', 'mouth_center')
+ALIGN_TEMPLATE_112 = np.array([
+    [38.2946, 51.6963],  # Mắt phải
+    [73.5318, 51.5014],  # Mắt trái
+    [56.0252, 71.7366],  # Chóp mũi
+    [56.1396, 92.2848],  # Tâm miệng
+], dtype=np.float64)
+# Điểm mốc gần như trùng nhau (phương sai < ngưỡng, đơn vị pixel^2) -> không căn chỉnh được
+_ALIGN_MIN_SPREAD = 1.0
+
+
+def similarity_transforms_batch(src_points, dst_points=ALIGN_TEMPLATE_112):
+    """
+    Ma trận similarity (xoay + co giãn đều + dịch) cho nhiều khuôn mặt cùng lúc, bình phương
+    tối thiểu trên mọi điểm mốc (nghiệm đóng Umeyama, không phản xạ), tính hoàn toàn bằng NumPy.
+    - src_points: (N, K, 2) điểm mốc trên ảnh gốc; dst_points: (K, 2).
+    Trả về (ma trận (N, 2, 3) float64 cho cv2.warpAffine, mảng bool (N,) hợp lệ).
+    """
+    src = np.asarray(src_points, dtype=np.float64)
+    dst = np.asarray(dst_points, dtype=np.float64)
+    src_mean = src.mean(axis=1)
+    dst_mean = dst.mean(axis=0)
+    src_c = src - src_mean[:, np.newaxis]
+    dst_c = dst - dst_mean
+
+    spread = np.einsum('nkd,nkd->n', src_c, src_c)
+    valid = spread >= _ALIGN_MIN_SPREAD * src.shape[1]
+    denom = np.where(valid, spread, 1.0)
+    a = (src_c[..., 0] @ dst_c[:, 0] + src_c[..., 1] @ dst_c[:, 1]) / denom
+    b = (src_c[..., 0] @ dst_c[:, 1] - src_c[..., 1] @ dst_c[:, 0]) / denom
+
+    matrices = np.empty((len(src), 2, 3), dtype=np.float64)
+    matrices[:, 0, 0] = a
+    matrices[:, 0, 1] = -b
+    matrices[:, 1, 0] = b
+    matrices[:, 1, 1] = a
+    matrices[:, 0, 2] = dst_mean[0] - (a * src_mean[:, 0] - b * src_mean[:, 1])
+    matrices[:, 1, 2] = dst_mean[1] - (b * src_mean[:, 0] + a * src_mean[:, 1])
+    return matrices, valid
+
+
+def align_faces_batch(frames_bgr, keypoints_list, out=None, rgb=True):
+    """
+    Căn chỉnh nhiều khuôn mặt về 112x112 trong 1 lần gọi.
+    - frames_bgr: list ảnh BGR (mỗi phần tử 1 khuôn mặt, có thể lặp lại cùng 1 frame).
+    - keypoints_list: list dict điểm mốc từ MediaPipeFaceDetector.detect().
+    - out: mảng uint8 (>= N, 112, 112, 3) cấp phát sẵn; ảnh được warp thẳng vào đây (không tạo ảnh tạm).
+    - rgb: True -> ghi RGB (đưa thẳng vào ModelEmbedding.get_embeddings_batch), False -> BGR.
+    Các khuôn mặt hợp lệ được ghi liên tiếp từ out[0]. Trả về out[:số khuôn mặt đã căn chỉnh].
+    """
+    n = len(frames_bgr)
+    if out is None:
+        out = np.empty((n, ALIGN_SIZE, ALIGN_SIZE, 3), dtype=np.uint8)
+    if n == 0:
+        return out[:0]
+
+    src = np.array([[kps[name] for name in ALIGN_KEYPOINTS] for kps in keypoints_list], dtype=np.float64)
+    matrices, valid = similarity_transforms_batch(src)
+
+    written = 0
+    for frame, M, ok in zip(frames_bgr, matrices, valid):
+        if not ok:
+            continue
+        face = out[written]
+        cv2.warpAffine(frame, M, (ALIGN_SIZE, ALIGN_SIZE), dst=face,
+                       borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+        if rgb:
+            cv2.cvtColor(face, cv2.COLOR_BGR2RGB, dst=face)
+        written += 1
+    return out[:written]
+
+
 def align_face_112(frame_bgr, keypoints):
     """
-    Căn chỉnh (xoay + co giãn) khuôn mặt về 112x112
-    dựa trên 3 điểm mốc: 2 mắt và chóp mũi.
+    Căn chỉnh (xoay + co giãn) 1 khuôn mặt về 112x112 (BGR), dựa trên
+    2 mắt, chóp mũi và tâm miệng. Giữ giao diện cũ; bên trong dùng align_faces_batch.
     """
     try:
-        # Lấy 3 điểm mốc từ khuôn mặt phát hiện được
-        src_pts = np.float32([
-            keypoints['right_eye'], 
-            keypoints['left_eye'], 
-            keypoints['nose_tip']
-        ])
-
-        # Định nghĩa 3 điểm mốc "chuẩn" (đích) trên ảnh 112x112
-        # Các giá trị này được chọn để căn mắt và mũi vào vị trí hợp lý
-        dst_pts = np.float32([
-            [38.2946, 51.6963],  # Vị trí mắt phải chuẩn
-            [73.5318, 51.5014],  # Vị trí mắt trái chuẩn
-            [56.0252, 71.7366]   # Vị trí chóp mũi chuẩn
-        ])
-        
-        # 1. Tính toán ma trận biến đổi (xoay, co giãn, dịch chuyển)
-        # Chỉ dùng 3 điểm nên 'fullAffine' = False
-        M = cv2.getAffineTransform(src_pts, dst_pts)
-        
-        # 2. Áp dụng phép biến đổi lên ảnh gốc
-        # Kích thước ảnh đầu ra là (width, height) = (112, 112)
-        aligned_face = cv2.warpAffine(
-            frame_bgr, 
-            M, 
-            (112, 112), 
-            borderMode=cv2.BORDER_CONSTANT, 
-            borderValue=(0, 0, 0)
-        )
-        
-        return aligned_face
+        aligned = align_faces_batch([frame_bgr], [keypoints], rgb=False)
+        return aligned[0] if len(aligned) else None
 
     except Exception as e:
         print(f"[ALIGN] Lỗi khi căn chỉnh: {e}")
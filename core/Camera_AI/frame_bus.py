@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# File: frame_bus.py
+#
+# Bus phát frame camera cho nhiều nơi dùng cùng lúc.
+# Chỉ có MỘT luồng sở hữu camera và gọi publish(); các nơi dùng (preview, đăng nhập,
+# đăng ký, nhận diện nền) mỗi nơi giữ một FrameCursor riêng và chờ "frame mới hơn seq X".
+# Đọc frame KHÔNG lấy mất frame của nơi khác (khác với queue.Queue).
+#
+# Lưu ý: frame được chia sẻ theo tham chiếu, nơi dùng KHÔNG được sửa trực tiếp lên frame
+# (cần vẽ/ghi đè thì .copy() trước).
+
+import time
+import threading
+from collections import deque
+
+
+class FrameBus:
+    """Ring buffer nhỏ chứa (seq, timestamp, frame) mới nhất."""
+
+    DEFAULT_CAPACITY = 4
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._frames = deque(maxlen=max(1, int(capacity)))
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._closed = False
+
+    @property
+    def seq(self):
+        """Số thứ tự của frame mới nhất (0 = chưa có frame nào)."""
+        return self._seq
+
+    def publish(self, frame, timestamp=None):
+        """(Luồng camera) Đẩy frame mới vào bus, đánh thức mọi nơi đang chờ. Trả về seq."""
+        with self._cond:
+            self._seq += 1
+            self._frames.append((self._seq, timestamp if timestamp is not None else time.monotonic(), frame))
+            self._cond.notify_all()
+            return self._seq
+
+    def latest(self):
+        """Trả về (seq, timestamp, frame) mới nhất hoặc None. Không chờ."""
+        with self._cond:
+            return self._frames[-1] if self._frames else None
+
+    def wait_newer(self, after_seq, timeout=None):
+        """
+        Chờ frame có seq > after_seq.
+        Trả về (seq, timestamp, frame) MỚI NHẤT (bỏ qua các frame trung gian để giảm độ trễ),
+        hoặc None nếu hết timeout / bus đã đóng.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq or self._closed, timeout):
+                return None
+            if self._closed and self._seq <= after_seq:
+                return None
+            return self._frames[-1]
+
+    def frames_since(self, after_seq):
+        """Trả về các frame còn trong ring buffer có seq > after_seq (cũ -> mới)."""
+        with self._cond:
+            return [item for item in self._frames if item[0] > after_seq]
+
+    def subscribe(self, start_at_latest=True):
+        """Tạo cursor đọc riêng cho 1 nơi dùng."""
+        return FrameCursor(self, self._seq if start_at_latest else 0)
+
+    def close(self):
+        """Đánh thức mọi nơi đang chờ (khi tắt camera)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FrameCursor:
+    """Vị trí đọc của 1 nơi dùng trên FrameBus."""
+
+    def __init__(self, bus, last_seq=0):
+        self.bus = bus
+        self.last_seq = last_seq
+        self.last_timestamp = None
+
+    def next(self, timeout=None):
+        """Chờ và trả về frame mới hơn frame đã đọc lần trước (hoặc None nếu hết timeout)."""
+        item = self.bus.wait_newer(self.last_seq, timeout)
+        if item is None:
+            return None
+        self.last_seq, self.last_timestamp, frame = item
+        return frame
+
+    def skip_to_latest(self):
+        """Bỏ qua mọi frame hiện có: lần next() sau sẽ chờ frame chụp SAU thời điểm này."""
+        self.last_seq = self.bus.seq
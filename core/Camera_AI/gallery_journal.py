@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# File: gallery_journal.py
+#
+# Định dạng journal append-only dùng bởi FastFaceSearch.
+# Module này cố ý KHÔNG import torch/faiss/mediapipe, để các module nhẹ
+# (ví dụ LocalDatabaseManager) có thể ghi bản ghi đổi tên ngay cả khi
+# hệ thống AI chưa được khởi tạo.
+#
+# Cấu trúc file:
+#   [base_ntotal: u64]                        -> ntotal của snapshot khi journal bắt đầu
+#   lặp lại: [kind: u8][label: u32][name_len: u32][name: utf-8]
+#            + nếu kind == ADD/REPLACE: [count: u32][count * dim * float32]
+
+import os
+import struct
+
+JOURNAL_SUFFIX = "_journal.bin"
+
+KIND_ADD = 0
+KIND_RENAME = 1   # name = "<tên cũ>\0<tên mới>", label không dùng
+KIND_REPLACE = 2  # Như ADD nhưng xóa (tombstone) các vector cũ của label trước khi thêm
+
+_BASE = struct.Struct('<Q')
+_RECORD = struct.Struct('<BII')
+_COUNT = struct.Struct('<I')
+_RENAME_SEP = '\x00'
+
+
+def start_journal(path, base_ntotal):
+    """Tạo (hoặc làm rỗng) journal, gắn với snapshot có base_ntotal vector."""
+    with open(path, 'wb') as f:
+        f.write(_BASE.pack(int(base_ntotal)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _pack(kind, label, name):
+    name_bytes = name.encode('utf-8')
+    return _RECORD.pack(kind, int(label), len(name_bytes)) + name_bytes
+
+
+def pack_add(label, person_name, count, vectors_bytes, replace=False):
+    kind = KIND_REPLACE if replace else KIND_ADD
+    return _pack(kind, label, person_name) + _COUNT.pack(int(count)) + vectors_bytes
+
+
+def pack_rename(old_name, new_name):
+    return _pack(KIND_RENAME, 0, f"{old_name}{_RENAME_SEP}{new_name}")
+
+
+def split_rename(name_field):
+    old_name, _, new_name = name_field.partition(_RENAME_SEP)
+    return old_name, new_name
+
+
+def append_record(path, payload):
+    """Ghi thêm 1 bản ghi vào cuối journal (chi phí không phụ thuộc kích thước DB)."""
+    with open(path, 'ab') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(path, dim):
+    """
+    Đọc journal.
+    Trả về (base_ntotal, records) với records là list (kind, label, name, count, vectors_bytes).
+    Bản ghi cuối bị ghi dở (mất điện) sẽ bị bỏ qua. Trả về (None, []) nếu không có journal.
+    """
+    if not os.path.exists(path):
+        return None, []
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _BASE.size:
+        return None, []
+
+    (base_ntotal,) = _BASE.unpack_from(data, 0)
+    records = []
+    pos = _BASE.size
+    vec_bytes = dim * 4
+    while pos + _RECORD.size <= len(data):
+        kind, label, name_len = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if pos + name_len > len(data):
+            break
+        name = data[pos:pos + name_len].decode('utf-8', errors='replace')
+        pos += name_len
+
+        count, payload = 0, b''
+        if kind in (KIND_ADD, KIND_REPLACE):
+            if pos + _COUNT.size > len(data):
+                break
+            (count,) = _COUNT.unpack_from(data, pos)
+            pos += _COUNT.size
+            if pos + count * vec_bytes > len(data):
+                break
+            payload = data[pos:pos + count * vec_bytes]
+            pos += count * vec_bytes
+        elif kind != KIND_RENAME:
+            print(f"[JOURNAL] Bỏ qua phần còn lại: bản ghi không rõ loại {kind}.")
+            break
+        records.append((kind, label, name, count, payload))
+    return base_ntotal, records
+
+
+def append_rename_to_all(db_dir, old_name, new_name):
+    """
+    Ghi bản ghi đổi tên vào journal của MỌI model trong db_dir.
+    Dùng khi hệ thống AI chưa chạy; bản ghi sẽ được áp dụng ở lần tải index tiếp theo.
+    Trả về số journal đã ghi.
+    """
+    if not os.path.isdir(db_dir):
+        return 0
+    written = 0
+    for file in os.listdir(db_dir):
+        if file.endswith(JOURNAL_SUFFIX):
+            try:
+                append_record(os.path.join(db_dir, file), pack_rename(old_name, new_name))
+                written += 1
+            except OSError as e:
+                print(f"[JOURNAL] Lỗi khi ghi đổi tên vào {file}: {e}")
+    return written
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# File: model_registry.py
+#
+# Danh sách các biến thể EdgeFace mà máy có thể dùng, chọn bằng FACE_MODEL_NAME trong config.py.
+# Module này KHÔNG import torch: ai_facade/config có thể dùng mà không kéo thư viện nặng.
+#
+# Mỗi model có bộ cache riêng trong thư mục database ({model}_embeddings.npy, {model}_manifest.json...),
+# vì embedding của 2 model khác nhau không so sánh được với nhau. Khi đổi model, gallery được
+# tính lại embedding từ ảnh gốc (xem FaceRecognitionSystemWebcam / FastFaceSearch).
+
+import os
+import json
+from collections import namedtuple
+
+MODULE_ROOT = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_DIR = os.path.join(MODULE_ROOT, 'checkpoints')
+# Graph đã export sẵn (export_model.py): {model}.ts.pt (TorchScript), {model}.onnx (ONNX Runtime)
+EXPORT_DIR = os.path.join(CHECKPOINT_DIR, 'exported')
+
+# params_m / mflops: số liệu từ checkpoints/README.md (None nếu không công bố)
+ModelSpec = namedtuple('ModelSpec', ['name', 'params_m', 'mflops', 'quantized', 'description'])
+
+MODELS = {
+    'edgeface_base':        ModelSpec('edgeface_base', 18.23, 1398.83, False, "Chính xác nhất, nặng nhất"),
+    'edgeface_s_gamma_05':  ModelSpec('edgeface_s_gamma_05', 3.65, 306.12, False, "Low-rank (rank 0.5)"),
+    'edgeface_xs_gamma_06': ModelSpec('edgeface_xs_gamma_06', 1.77, 154.00, False, "Low-rank (rank 0.6)"),
+    'edgeface_xxs':         ModelSpec('edgeface_xxs', 1.24, 94.72, False, "Nhỏ nhất (float)"),
+    'edgeface_xs_q':        ModelSpec('edgeface_xs_q', None, None, True, "Lượng tử hóa int8 (Linear)"),
+    'edgeface_xxs_q':       ModelSpec('edgeface_xxs_q', None, None, True, "Lượng tử hóa int8 (Linear), nhỏ nhất"),
+}
+
+DEFAULT_MODEL = 'edgeface_base'
+# Thứ tự thử khi model trong config không dùng được (thiếu checkpoint)
+FALLBACK_ORDER = ('edgeface_base', 'edgeface_s_gamma_05', 'edgeface_xs_gamma_06',
+                  'edgeface_xs_q', 'edgeface_xxs', 'edgeface_xxs_q')
+
+# Backend suy luận của ModelEmbedding, chọn bằng FACE_MODEL_BACKEND trong config.py
+BACKEND_EAGER = 'eager'
+BACKEND_TORCHSCRIPT = 'torchscript'
+BACKEND_ONNX = 'onnx'
+BACKENDS = (BACKEND_EAGER, BACKEND_TORCHSCRIPT, BACKEND_ONNX)
+_EXPORT_SUFFIX = {BACKEND_TORCHSCRIPT: '.ts.pt', BACKEND_ONNX: '.onnx'}
+
+# File trong thư mục database ghi lại model đã dùng ở lần chạy trước
+ACTIVE_MODEL_FILE = 'active_model.json'
+
+
+def get_spec(name):
+    if name not in MODELS:
+        raise ValueError(f"Model '{name}' không có trong registry. Có: {', '.join(MODELS)}")
+    return MODELS[name]
+
+
+def checkpoint_path(name):
+    get_spec(name)
+    return os.path.join(CHECKPOINT_DIR, f'{name}.pt')
+
+
+def exported_path(name, backend):
+    """Đường dẫn graph đã export của model cho backend (không áp dụng cho 'eager')."""
+    get_spec(name)
+    if backend not in _EXPORT_SUFFIX:
+        raise ValueError(f"Backend '{backend}' không dùng graph export. Có: {', '.join(_EXPORT_SUFFIX)}")
+    return os.path.join(EXPORT_DIR, f'{name}{_EXPORT_SUFFIX[backend]}')
+
+
+def configured_backend():
+    """FACE_MODEL_BACKEND trong config.py (mặc định: eager)."""
+    try:
+        from config import FACE_MODEL_BACKEND
+    except ImportError:
+        return BACKEND_EAGER
+    if FACE_MODEL_BACKEND not in BACKENDS:
+        print(f"[MODEL] Cảnh báo: backend '{FACE_MODEL_BACKEND}' không hợp lệ, dùng '{BACKEND_EAGER}'.")
+        return BACKEND_EAGER
+    return FACE_MODEL_BACKEND
+
+
+def available_models():
+    """Các model có checkpoint trên máy này."""
+    return [name for name in MODELS if os.path.exists(checkpoint_path(name))]
+
+
+def configured_model_name():
+    """FACE_MODEL_NAME trong config.py (mặc định: DEFAULT_MODEL)."""
+    try:
+        from config import FACE_MODEL_NAME
+    except ImportError:
+        return DEFAULT_MODEL
+    return FACE_MODEL_NAME or DEFAULT_MODEL
+
+
+def resolve_model_name(name=None):
+    """
+    Tên model sẽ dùng: `name` hoặc model trong config. Nếu không hợp lệ hoặc thiếu checkpoint
+    thì chọn model đầu tiên có checkpoint theo FALLBACK_ORDER (in cảnh báo).
+    """
+    name = name or configured_model_name()
+    if name in MODELS and os.path.exists(checkpoint_path(name)):
+        return name
+
+    if name not in MODELS:
+        reason = "không có trong registry"
+    else:
+        reason = f"thiếu checkpoint {checkpoint_path(name)}"
+    for candidate in FALLBACK_ORDER:
+        if os.path.exists(checkpoint_path(candidate)):
+            # In nổi bật: gallery sẽ được tính bằng model thay thế, không phải model đã chọn
+            print("[MODEL] " + "!" * 60)
+            print(f"[MODEL] CẢNH BÁO: model '{name}' {reason}.")
+            print(f"[MODEL] Đang dùng '{candidate}' THAY THẾ (gallery khuôn mặt sẽ được tính bằng model này).")
+            print(f"[MODEL] Chép {name}.pt vào {CHECKPOINT_DIR} hoặc đặt FACE_MODEL_NAME = \"{candidate}\" "
+                  f"trong config.py để tắt cảnh báo.")
+            print("[MODEL] " + "!" * 60)
+            return candidate
+    # Không có checkpoint nào: để ModelEmbedding báo lỗi rõ ràng với tên model đã cấu hình
+    return name
+
+
+# --- Model đã dùng ở lần chạy trước (để biết khi nào phải tính lại gallery) ---
+def read_active_model(db_dir):
+    try:
+        with open(os.path.join(db_dir, ACTIVE_MODEL_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('model')
+    except (OSError, ValueError):
+        return None
+
+
+def write_active_model(db_dir, name):
+    """
+    Ghi model đang dùng. 'configured' là model trong config.py: khác 'model' nghĩa là
+    đang chạy bằng model thay thế (xem resolve_model_name).
+    """
+    path = os.path.join(db_dir, ACTIVE_MODEL_FILE)
+    try:
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'model': name, 'configured': configured_model_name()}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[MODEL] Không ghi được {path}: {e}")
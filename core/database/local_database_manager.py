@@ -7,26 +7,47 @@ import logging
 import os
 import random
 import string
+import hashlib
 import shutil
 import threading 
-import requests
+import json
+
+from core.features.http_session import get_session, timeout_for
+from core.database.sqlite_pool import SQLitePool, PRIORITY_CHECKOUT, PRIORITY_NORMAL, PRIORITY_SYNC
 
 DB_PATH = "vending_machine_data.db"
+FACE_DB_DIR = os.path.join('core', 'Camera_AI', 'database')
+
+# Khóa trong bảng sync_state
+SYNC_KEY_CONFIG_HASH = "config_push_hash"
+SYNC_KEY_PRODUCTS_ETAG = "products_etag"
+SYNC_KEY_PRODUCTS_VERSION = "products_version"
+
+# transaction_history.is_synced = -1: server đã từ chối đơn quá số lần cho phép,
+# outbox không gửi lại nữa (xem requeue_parked_transactions)
+TX_PARKED = -1
 
 class LocalDatabaseManager:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
+        # Callback (old_id, new_id) do hệ thống AI đăng ký để đổi nhãn khuôn mặt tại chỗ
+        self.face_id_rename_callback = None
         os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # Kết nối dùng lại theo luồng + WAL + 1 luồng ghi duy nhất (xem sqlite_pool.py)
+        self.pool = SQLitePool(db_path)
         self._init_db()
 
     def _get_connection(self):
-        con = sqlite3.connect(self.db_path, timeout=10)
-        con.row_factory = sqlite3.Row
-        return con
+        """Kết nối ĐỌC của luồng hiện tại (dùng lại, không mở mới mỗi lần gọi)."""
+        return self.pool.connection()
+
+    def _write(self, func, priority=PRIORITY_NORMAL):
+        """Chạy func(con) trên luồng writer trong 1 transaction, trả về kết quả."""
+        return self.pool.write(func, priority=priority)
 
     def _init_db(self):
         try:
-            with self._get_connection() as con:
+            def create_tables(con):
                 cursor = con.cursor()
                 # <<< SỬA ĐỔI: Đổi tên cột password_hash thành password >>>
                 cursor.execute("""
@@ -67,23 +88,47 @@ class LocalDatabaseManager:
                         is_synced INTEGER DEFAULT 0
                     )
                 """)
-                con.commit()
-            logging.info("Đang khởi động DB và đồng bộ 2 chiều...")
+                # Outbox: lưu sẵn payload API (JSON) để đồng bộ lại theo lô khi có mạng
+                columns = [row['name'] for row in cursor.execute("PRAGMA table_info(transaction_history)")]
+                if 'sync_payload' not in columns:
+                    cursor.execute("ALTER TABLE transaction_history ADD COLUMN sync_payload TEXT")
+                # Số lần server từ chối đơn + lý do gần nhất (không tính lần lỗi mạng)
+                if 'sync_attempts' not in columns:
+                    cursor.execute("ALTER TABLE transaction_history ADD COLUMN sync_attempts INTEGER DEFAULT 0")
+                if 'sync_error' not in columns:
+                    cursor.execute("ALTER TABLE transaction_history ADD COLUMN sync_error TEXT")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_transaction_unsynced ON transaction_history (is_synced, id)")
+                # 4. Bảng sync_state: ETag / version / hash của lần đồng bộ gần nhất (delta sync)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS sync_state (
+                        key TEXT PRIMARY KEY,
+                        value TEXT,
+                        updated_at TEXT
+                    )
+                """)
+            self._write(create_tables)
+            logging.info("Đang khởi động DB...")
             
-            # 1. Nạp dữ liệu local từ Config (Dự phòng)
+            # Nạp dữ liệu local từ Config (Dự phòng)
+            # Đồng bộ 2 chiều với Server KHÔNG chạy ở đây (import module không được gọi mạng):
+            # xem start_server_sync(), được bộ điều phối khởi động gọi.
             self.initialize_inventory()
             
-            # 2. LUỒNG 1: Đẩy danh sách sản phẩm từ Config -> Server (Để Server có dữ liệu)
-            t1 = threading.Thread(target=self.push_config_to_server, daemon=True)
-            t1.start()
-            
-            # 3. LUỒNG 2: Kéo bảng giá/khuyến mãi từ Server -> Client (Để cập nhật giá mới nhất nếu có)
-            t2 = threading.Thread(target=self.sync_products_from_server, daemon=True)
-            t2.start()
-            
         except sqlite3.Error as e:
             logging.error(f"Lỗi khi khởi tạo database: {e}", exc_info=True)
 
+    def start_server_sync(self):
+        """Chạy đồng bộ sản phẩm 2 chiều với Server trên 2 luồng nền. Trả về list luồng."""
+        logging.info("Bắt đầu đồng bộ 2 chiều sản phẩm với Server...")
+        # LUỒNG 1: Đẩy danh sách sản phẩm từ Config -> Server (Để Server có dữ liệu)
+        t1 = threading.Thread(target=self.push_config_to_server, daemon=True)
+        t1.start()
+        
+        # LUỒNG 2: Kéo bảng giá/khuyến mãi từ Server -> Client (Để cập nhật giá mới nhất nếu có)
+        t2 = threading.Thread(target=self.sync_products_from_server, daemon=True)
+        t2.start()
+        return [t1, t2]
+
     def register_customer(self, name, phone, dob, password, face_encoding=None):
         """
         SỬA ĐỔI: Lưu mật khẩu gốc, không mã hóa.
@@ -103,10 +148,8 @@ class LocalDatabaseManager:
         # Câu lệnh SQL đã được cập nhật để dùng cột 'password'
         sql = "INSERT INTO customers (user_id, full_name, phone_number, birthday, password, created_at, face_encoding, is_synced) VALUES (?, ?, ?, ?, ?, ?, ?, 0)"
         try:
-            with self._get_connection() as con:
-                # Truyền mật khẩu gốc (password) trực tiếp vào câu lệnh
-                con.execute(sql, (user_id, name, phone, dob, password, created_at, face_encoding))
-                con.commit()
+            # Truyền mật khẩu gốc (password) trực tiếp vào câu lệnh
+            self.pool.execute_write(sql, (user_id, name, phone, dob, password, created_at, face_encoding))
             logging.info(f"Đã đăng ký (không mã hóa) thành công cho: {name}")
             return {"code": user_id, "name": name, "phone": phone, "points": 0}
         except sqlite3.IntegrityError:
@@ -155,39 +198,19 @@ class LocalDatabaseManager:
         
         try:
             # Bước 3.1: Cập nhật CSDL
-            with self._get_connection() as con:
-                if server_user_id != user_id:
-                    # Server trả về ID mới, cập nhật cả ID và trạng thái synced
-                    con.execute("UPDATE customers SET user_id = ?, is_synced = 1 WHERE user_id = ?", (server_user_id, user_id))
-                    logging.info(f"SYNC: [DB] Đã đổi user_id {user_id} -> {server_user_id}.")
-                else:
-                    # Server trả về ID giống hệt, chỉ cập nhật trạng thái synced
-                    con.execute("UPDATE customers SET is_synced = 1 WHERE user_id = ?", (user_id,))
-                con.commit()
+            if server_user_id != user_id:
+                # Server trả về ID mới, cập nhật cả ID và trạng thái synced
+                self.pool.execute_write("UPDATE customers SET user_id = ?, is_synced = 1 WHERE user_id = ?",
+                                        (server_user_id, user_id), priority=PRIORITY_SYNC)
+                logging.info(f"SYNC: [DB] Đã đổi user_id {user_id} -> {server_user_id}.")
+            else:
+                # Server trả về ID giống hệt, chỉ cập nhật trạng thái synced
+                self.pool.execute_write("UPDATE customers SET is_synced = 1 WHERE user_id = ?",
+                                        (user_id,), priority=PRIORITY_SYNC)
 
             # Bước 3.2: Nếu ID đã thay đổi, cập nhật tài nguyên nhận diện khuôn mặt
             if server_user_id != user_id:
-                base_db_dir = 'core/Camera_AI/database'
-                old_user_dir = os.path.join(base_db_dir, str(user_id)) # Thư mục với ID cũ (local_...)
-                new_user_dir = os.path.join(base_db_dir, str(server_user_id)) # Thư mục với ID mới (user_...)
-                
-                # Đổi tên thư mục ảnh
-                if os.path.isdir(old_user_dir):
-                    logging.info(f"SYNC: [FS] Đang đổi tên thư mục ảnh từ '{user_id}' -> '{server_user_id}'")
-                    if os.path.exists(new_user_dir):
-                        # Gộp file nếu thư mục mới đã tồn tại
-                        for f in os.listdir(old_user_dir):
-                            shutil.move(os.path.join(old_user_dir, f), new_user_dir)
-                        shutil.rmtree(old_user_dir)
-                    else:
-                        os.rename(old_user_dir, new_user_dir)
-                    logging.info("SYNC: [FS] Đổi tên thư mục ảnh thành công.")
-
-                # Xóa file cache cũ để buộc hệ thống tạo lại với ID đúng
-                cache_path = os.path.join(base_db_dir, 'face_cache_edgeface_base.pkl')
-                if os.path.exists(cache_path):
-                    os.remove(cache_path)
-                    logging.warning("SYNC: [CACHE] Đã xóa file face cache cũ. Hệ thống sẽ tự tạo lại khi khởi động.")
+                self._rename_face_resources(str(user_id), str(server_user_id))
 
             # In thông báo thành công cuối cùng
             print("-" * 60)
@@ -197,6 +220,65 @@ class LocalDatabaseManager:
         except Exception as e:
             logging.error(f"SYNC: Lỗi nghiêm trọng khi cập nhật CSDL hoặc tài nguyên: {e}", exc_info=True)
 
+    def set_face_id_rename_callback(self, callback):
+        """Hệ thống AI đăng ký hàm callback(old_id, new_id) để đổi nhãn trong index đang chạy."""
+        self.face_id_rename_callback = callback
+
+    def _rename_face_resources(self, old_id, new_id):
+        """
+        Đổi thư mục ảnh + nhãn khuôn mặt từ ID cũ sang ID mới.
+        Không xóa cache: nếu hệ thống AI đang chạy thì đổi nhãn tại chỗ,
+        nếu chưa chạy thì ghi bản ghi đổi tên vào journal để áp dụng lúc tải index.
+        """
+        if self.face_id_rename_callback:
+            try:
+                self.face_id_rename_callback(old_id, new_id)
+                logging.info(f"SYNC: [FACE] Đã đổi nhãn khuôn mặt {old_id} -> {new_id}.")
+                return
+            except Exception as e:
+                logging.error(f"SYNC: [FACE] Lỗi callback đổi nhãn, dùng cách ghi journal: {e}")
+
+        base_db_dir = FACE_DB_DIR
+        old_user_dir = os.path.join(base_db_dir, old_id) # Thư mục với ID cũ (local_...)
+        new_user_dir = os.path.join(base_db_dir, new_id) # Thư mục với ID mới (user_...)
+        
+        # Đổi tên thư mục ảnh
+        if os.path.isdir(old_user_dir):
+            logging.info(f"SYNC: [FS] Đang đổi tên thư mục ảnh từ '{old_id}' -> '{new_id}'")
+            if os.path.exists(new_user_dir):
+                # Gộp file nếu thư mục mới đã tồn tại
+                for f in os.listdir(old_user_dir):
+                    shutil.move(os.path.join(old_user_dir, f), os.path.join(new_user_dir, f))
+                shutil.rmtree(old_user_dir)
+            else:
+                os.rename(old_user_dir, new_user_dir)
+            logging.info("SYNC: [FS] Đổi tên thư mục ảnh thành công.")
+
+        from core.Camera_AI.gallery_journal import append_rename_to_all
+        written = append_rename_to_all(base_db_dir, old_id, new_id)
+        logging.info(f"SYNC: [CACHE] Đã ghi đổi nhãn vào {written} journal khuôn mặt.")
+
+    def get_sync_state(self, key):
+        """Đọc giá trị đồng bộ đã lưu (ETag, version, hash...) hoặc None."""
+        try:
+            with self._get_connection() as con:
+                row = con.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+                return row['value'] if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Lỗi khi đọc sync_state '{key}': {e}")
+            return None
+
+    def set_sync_state(self, key, value):
+        try:
+            self.pool.execute_write(
+                "INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (key, value, datetime.now().isoformat()), priority=PRIORITY_SYNC)
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Lỗi khi lưu sync_state '{key}': {e}")
+            return False
+
     # Thêm hàm này vào trong class LocalDatabaseManager (cùng cấp với các hàm khác)
     def push_config_to_server(self):
         """
@@ -217,13 +299,22 @@ class LocalDatabaseManager:
                 })
             
             SERVER_URL = "https://rpi.vietseedscampaign.com/api/products/batch_sync"
+
+            # Bỏ qua nếu Config không đổi kể từ lần đẩy thành công gần nhất
+            config_hash = hashlib.sha256(
+                json.dumps(product_list, sort_keys=True, ensure_ascii=False).encode('utf-8')
+            ).hexdigest()
+            if self.get_sync_state(SYNC_KEY_CONFIG_HASH) == config_hash:
+                logging.info("📤 Config sản phẩm không đổi, bỏ qua bước đẩy lên Server.")
+                return
             
             logging.info(f"📤 Đang đẩy {len(product_list)} sản phẩm từ Config lên Server...")
             
             # Gửi request (timeout 5s để không làm chậm máy nếu mạng lag)
-            response = requests.post(SERVER_URL, json={"products": product_list}, timeout=10)
+            response = get_session().post(SERVER_URL, json={"products": product_list}, timeout=timeout_for("config_push"))
             
             if response.status_code == 200:
+                self.set_sync_state(SYNC_KEY_CONFIG_HASH, config_hash)
                 logging.info("✅ Đẩy sản phẩm lên Server THÀNH CÔNG.")
             else:
                 logging.warning(f"⚠️ Server trả về lỗi khi đẩy sản phẩm: {response.status_code}")
@@ -245,51 +336,81 @@ class LocalDatabaseManager:
 
         logging.info(f"🔄 Đang đồng bộ giá từ Server cho máy: {MY_DEVICE_ID}...")
 
+        etag_key = f"{SYNC_KEY_PRODUCTS_ETAG}:{MY_DEVICE_ID}"
+        version_key = f"{SYNC_KEY_PRODUCTS_VERSION}:{MY_DEVICE_ID}"
+
         try:
             # Gửi ID máy lên header để Server biết trả về giá nào
             headers = {'X-Device-ID': MY_DEVICE_ID}
+            # Request có điều kiện: Server trả 304 nếu bảng giá không đổi kể từ lần trước
+            last_etag = self.get_sync_state(etag_key)
+            if last_etag:
+                headers['If-None-Match'] = last_etag
+            # Cursor version: Server hỗ trợ thì chỉ trả về các món thay đổi sau version này
+            params = {}
+            last_version = self.get_sync_state(version_key)
+            if last_version:
+                params['since'] = last_version
             
-            response = requests.get(SERVER_API_URL, headers=headers, timeout=10)
+            response = get_session().get(SERVER_API_URL, headers=headers, params=params, timeout=timeout_for("products"))
+
+            if response.status_code == 304:
+                logging.info("✅ Bảng giá không đổi (304 Not Modified), bỏ qua cập nhật.")
+                return True
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
                     server_products = data.get('products', [])
+                    rows = [(
+                        p['item_name'],
+                        p['price'],
+                        p.get('cost_price', 0),
+                        p.get('units_left', 0),
+                        p.get('description', ''),
+                        p.get('reorder_point', 5)
+                    ) for p in server_products]
                     
+                    # Chỉ ghi những món thật sự thay đổi (so với dữ liệu đang có, đọc không chặn ghi)
                     with self._get_connection() as con:
-                        cursor = con.cursor()
-                        count = 0
-                        
-                        for p in server_products:
-                            # Server trả về gì thì Client lưu cái đó
-                            # Dùng INSERT OR REPLACE để: 
-                            # - Nếu chưa có món đó -> Thêm mới
-                            # - Nếu có rồi -> Cập nhật giá mới (price, cost_price...)
-                            
-                            cursor.execute("""
-                                INSERT INTO inventory (item_name, price, cost_price, units_left, description, reorder_point)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                                ON CONFLICT(item_name) DO UPDATE SET
-                                    price = excluded.price,
-                                    cost_price = excluded.cost_price,
-                                    description = excluded.description,
-                                    reorder_point = excluded.reorder_point
-                                    -- Lưu ý: Không update units_left (Tồn kho) nếu bạn muốn quản lý tồn kho tại máy
-                                    -- Nếu muốn Server áp đặt tồn kho thì bỏ comment dòng dưới:
-                                    --, units_left = excluded.units_left 
-                            """, (
-                                p['item_name'], 
-                                p['price'], 
-                                p.get('cost_price', 0), 
-                                p.get('units_left', 0), 
-                                p.get('description', ''),
-                                p.get('reorder_point', 5)
-                            ))
-                            count += 1
-                            
-                        con.commit()
-                        logging.info(f"✅ Đã cập nhật thành công {count} sản phẩm từ Server.")
-                        return True
+                        existing = {
+                            r['item_name']: (r['price'], r['cost_price'], r['description'], r['reorder_point'])
+                            for r in con.execute("SELECT item_name, price, cost_price, description, reorder_point FROM inventory")
+                        }
+                    changed = [r for r in rows if existing.get(r[0]) != (r[1], r[2], r[4], r[5])]
+
+                    def upsert_products(con, chunk, is_last):
+                        # Server trả về gì thì Client lưu cái đó:
+                        # - Nếu chưa có món đó -> Thêm mới
+                        # - Nếu có rồi -> Cập nhật giá mới (price, cost_price...)
+                        con.executemany("""
+                            INSERT INTO inventory (item_name, price, cost_price, units_left, description, reorder_point)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(item_name) DO UPDATE SET
+                                price = excluded.price,
+                                cost_price = excluded.cost_price,
+                                description = excluded.description,
+                                reorder_point = excluded.reorder_point
+                                -- Lưu ý: Không update units_left (Tồn kho) nếu bạn muốn quản lý tồn kho tại máy
+                                -- Nếu muốn Server áp đặt tồn kho thì bỏ comment dòng dưới:
+                                --, units_left = excluded.units_left 
+                        """, chunk)
+                        if not is_last:
+                            return len(chunk)
+                        # Lưu ETag/version cùng transaction với lô CUỐI: chỉ ghi nhận khi mọi lô đã vào DB
+                        now = datetime.now().isoformat()
+                        for key, value in ((etag_key, response.headers.get('ETag')), (version_key, data.get('version'))):
+                            if value is not None:
+                                con.execute(
+                                    "INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, ?) "
+                                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                                    (key, str(value), now))
+                        return len(chunk)
+
+                    # Độ ưu tiên thấp + chia lô: lệnh ghi lúc thanh toán chen vào được giữa 2 lô
+                    count = sum(self.pool.write_chunked(upsert_products, changed, priority=PRIORITY_SYNC))
+                    logging.info(f"✅ Đã cập nhật {count}/{len(rows)} sản phẩm thay đổi từ Server.")
+                    return True
                 else:
                     logging.warning("⚠️ Server trả về success=False.")
             else:
@@ -344,14 +465,13 @@ class LocalDatabaseManager:
                 is_synced = 1;
         """
         try:
-            with self._get_connection() as con:
-                con.execute(sql, (
-                    user_id,
-                    server_user_data.get('full_name'),
-                    server_user_data.get('phone_number'),
-                    server_user_data.get('points', 0),
-                    datetime.now().isoformat()
-                ))
+            self.pool.execute_write(sql, (
+                user_id,
+                server_user_data.get('full_name'),
+                server_user_data.get('phone_number'),
+                server_user_data.get('points', 0),
+                datetime.now().isoformat()
+            ), priority=PRIORITY_SYNC)
             logging.info(f"Đã thêm/cập nhật user {user_id} từ server vào CSDL local.")
             return True
         except sqlite3.Error as e:
@@ -363,34 +483,102 @@ class LocalDatabaseManager:
         now = datetime.now().strftime("%Y%m%d%H%M%S")
         rand_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
         return f"ORD-{now}-{rand_part}"
-    def save_transaction(self, total_amount, customer_name_str, items_detail_str, items_sold_list):
+    def save_transaction(self, total_amount, customer_name_str, items_detail_str, items_sold_list, sync_payload=None):
+        """
+        Lưu giao dịch + trừ tồn kho trong 1 transaction.
+        sync_payload: dict gửi lên API (items, customer_info...), được lưu dạng JSON để outbox
+        đồng bộ lại khi có mạng. order_code/timestamp sẽ được gắn thêm vào payload.
+        """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         order_code = self.generate_order_code()
+        payload_json = None
+        if sync_payload is not None:
+            payload_json = json.dumps(dict(sync_payload, order_code=order_code, timestamp=timestamp), ensure_ascii=False)
+        def insert_transaction(con):
+            cursor = con.cursor()
+            cursor.execute("INSERT INTO transaction_history (timestamp, order_code, total_amount, customer_name, items_detail, is_synced, sync_payload) VALUES (?, ?, ?, ?, ?, 0, ?)", (timestamp, order_code, total_amount, customer_name_str, items_detail_str, payload_json))
+            cursor.executemany("""
+                UPDATE inventory 
+                SET units_left = units_left - ?, 
+                    units_sold = units_sold + ? 
+                WHERE item_name = ?
+            """, [(item['quantity'], item['quantity'], item['product_name']) for item in items_sold_list])
         try:
-            with self._get_connection() as con:
-                cursor = con.cursor()
-                cursor.execute("INSERT INTO transaction_history (timestamp, order_code, total_amount, customer_name, items_detail, is_synced) VALUES (?, ?, ?, ?, ?, 0)", (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), order_code, total_amount, customer_name_str, items_detail_str))
-                for item in items_sold_list:
-                    cursor.execute("""
-                    UPDATE inventory 
-                    SET units_left = units_left - ?, 
-                        units_sold = units_sold + ? 
-                    WHERE item_name = ?
-                """, (item['quantity'], item['quantity'], item['product_name']))
-                return order_code
+            self._write(insert_transaction, priority=PRIORITY_CHECKOUT)
+            return order_code
         except sqlite3.Error as e:
             logging.error(f"LỖI LƯU GIAO DỊCH CỤC BỘ: {e}")
             return None 
     def mark_transaction_as_synced(self, order_code):
         """Đánh dấu một giao dịch đã được đồng bộ thành công."""
         try:
-            with self._get_connection() as con:
-                con.execute("UPDATE transaction_history SET is_synced = 1 WHERE order_code = ?", (order_code,))
+            self.pool.execute_write("UPDATE transaction_history SET is_synced = 1 WHERE order_code = ?",
+                                    (order_code,), priority=PRIORITY_SYNC)
             logging.info(f"Đã đánh dấu đồng bộ thành công cho đơn hàng {order_code}.")
             return True
         except sqlite3.Error as e:
             logging.error(f"Lỗi khi đánh dấu đồng bộ đơn hàng {order_code}: {e}")
             return False
+    def get_unsynced_transactions(self, limit=50):
+        """
+        Lấy tối đa `limit` giao dịch chưa đồng bộ cho outbox: đơn bị từ chối ít lần trước,
+        rồi cũ nhất trước (đơn hay bị từ chối không chặn các đơn mới ở đầu hàng đợi).
+        """
+        try:
+            with self._get_connection() as con:
+                return con.execute(
+                    "SELECT order_code, timestamp, total_amount, customer_name, items_detail, sync_payload, sync_attempts "
+                    "FROM transaction_history WHERE is_synced = 0 ORDER BY sync_attempts, id LIMIT ?", (limit,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Lỗi khi lấy danh sách giao dịch chưa đồng bộ: {e}")
+            return []
+    def mark_transactions_as_synced(self, order_codes):
+        """Đánh dấu nhiều giao dịch đã đồng bộ bằng 1 câu UPDATE. Trả về số dòng đã cập nhật."""
+        order_codes = list(order_codes)
+        if not order_codes:
+            return 0
+        placeholders = ",".join("?" * len(order_codes))
+        try:
+            return self.pool.execute_write(
+                f"UPDATE transaction_history SET is_synced = 1 WHERE order_code IN ({placeholders})",
+                order_codes, priority=PRIORITY_SYNC)
+        except sqlite3.Error as e:
+            logging.error(f"Lỗi khi đánh dấu đồng bộ {len(order_codes)} đơn hàng: {e}")
+            return 0
+    def record_transaction_rejections(self, order_codes, error, max_attempts):
+        """
+        Ghi nhận server từ chối các đơn: tăng sync_attempts, lưu lý do; đơn đạt max_attempts
+        lần thì chuyển sang TX_PARKED. Trả về số đơn vừa bị đỗ lại.
+        """
+        order_codes = list(order_codes)
+        if not order_codes:
+            return 0
+        placeholders = ",".join("?" * len(order_codes))
+
+        def bump(con):
+            con.execute(
+                "UPDATE transaction_history SET sync_attempts = sync_attempts + 1, sync_error = ?, "
+                "is_synced = CASE WHEN sync_attempts + 1 >= ? THEN ? ELSE is_synced END "
+                f"WHERE is_synced = 0 AND order_code IN ({placeholders})",
+                [str(error), max_attempts, TX_PARKED, *order_codes])
+            return con.execute(
+                f"SELECT COUNT(*) FROM transaction_history WHERE is_synced = ? AND order_code IN ({placeholders})",
+                [TX_PARKED, *order_codes]).fetchone()[0]
+        try:
+            return self._write(bump, priority=PRIORITY_SYNC)
+        except sqlite3.Error as e:
+            logging.error(f"Lỗi khi ghi nhận {len(order_codes)} đơn bị từ chối: {e}")
+            return 0
+    def requeue_parked_transactions(self):
+        """Đưa các đơn đã bị đỗ lại (TX_PARKED) về hàng đợi outbox, ví dụ sau khi sửa server."""
+        try:
+            return self.pool.execute_write(
+                "UPDATE transaction_history SET is_synced = 0, sync_attempts = 0 WHERE is_synced = ?",
+                (TX_PARKED,), priority=PRIORITY_SYNC)
+        except sqlite3.Error as e:
+            logging.error(f"Lỗi khi đưa lại đơn bị đỗ vào outbox: {e}")
+            return 0
     def get_unsynced_customers(self):
         """Lấy tất cả khách hàng có is_synced = 0."""
         try:
@@ -404,8 +592,8 @@ class LocalDatabaseManager:
         if not user_id: return False
         points_earned = int(total_amount / 1000)
         try:
-            with self._get_connection() as con:
-                con.cursor().execute("UPDATE customers SET points = points - ? + ? WHERE user_id = ?", (points_used, points_earned, user_id))
+            self.pool.execute_write("UPDATE customers SET points = points - ? + ? WHERE user_id = ?",
+                                    (points_used, points_earned, user_id), priority=PRIORITY_CHECKOUT)
             return True
         except sqlite3.Error as e:
             logging.error(f"Lỗi khi cập nhật điểm cho user {user_id}: {e}")
@@ -422,26 +610,27 @@ class LocalDatabaseManager:
             logging.warning("Không tìm thấy config.py, bỏ qua bước khởi tạo dự phòng.")
             return
 
-        try:
-            with self._get_connection() as con:
-                cursor = con.cursor()
-                count = 0
-                for key, (name, image_file, default_price) in PRODUCT_IMAGES_CONFIG.items():
-                    # Dùng INSERT OR IGNORE:
-                    # Nếu tên món hàng đã có (do Server đồng bộ trước đó) -> BỎ QUA
-                    # Nếu chưa có (máy mới tinh) -> THÊM VÀO
-                    cursor.execute("""
-                        INSERT OR IGNORE INTO inventory 
-                        (item_name, price, units_left, units_sold, cost_price, reorder_point, description)
-                        VALUES (?, ?, 0, 0, 0, 5, ?)
-                    """, (name, default_price, f"Image: {image_file}"))
-                    
-                    if cursor.rowcount > 0:
-                        count += 1
+        def insert_defaults(con):
+            cursor = con.cursor()
+            count = 0
+            for key, (name, image_file, default_price) in PRODUCT_IMAGES_CONFIG.items():
+                # Dùng INSERT OR IGNORE:
+                # Nếu tên món hàng đã có (do Server đồng bộ trước đó) -> BỎ QUA
+                # Nếu chưa có (máy mới tinh) -> THÊM VÀO
+                cursor.execute("""
+                    INSERT OR IGNORE INTO inventory 
+                    (item_name, price, units_left, units_sold, cost_price, reorder_point, description)
+                    VALUES (?, ?, 0, 0, 0, 5, ?)
+                """, (name, default_price, f"Image: {image_file}"))
                 
-                con.commit()
-                if count > 0:
-                    logging.info(f"Khởi tạo dự phòng: Đã thêm {count} món từ Config.")
+                if cursor.rowcount > 0:
+                    count += 1
+            return count
+
+        try:
+            count = self._write(insert_defaults)
+            if count > 0:
+                logging.info(f"Khởi tạo dự phòng: Đã thêm {count} món từ Config.")
         except sqlite3.Error as e:
             logging.error(f"Lỗi initialize_inventory: {e}")
     def get_customer_by_id(self, user_id):
@@ -472,8 +661,7 @@ class LocalDatabaseManager:
     def mark_customer_as_unsynced(self, user_id):
         """Đánh dấu một khách hàng cần được đồng bộ lại."""
         try:
-            with self._get_connection() as con:
-                con.execute("UPDATE customers SET is_synced = 0 WHERE user_id = ?", (user_id,))
+            self.pool.execute_write("UPDATE customers SET is_synced = 0 WHERE user_id = ?", (user_id,))
             logging.warning(f"Đã đánh dấu user {user_id} cần đồng bộ lại.")
             return True
         except sqlite3.Error as e:
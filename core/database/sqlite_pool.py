@@ -0,0 +1,121 @@
+# --- START OF FILE core/database/sqlite_pool.py ---
+#
+# Lớp truy cập SQLite dùng chung cho LocalDatabaseManager:
+# - Mỗi luồng giữ 1 kết nối đọc riêng, dùng lại (không connect mỗi lần gọi).
+# - WAL: đọc không chặn ghi, ghi không chặn đọc.
+# - Mọi lệnh GHI đi qua 1 luồng writer duy nhất với hàng đợi ưu tiên, nên ghi lúc thanh toán
+#   (save_transaction, update_customer_points) được xếp trước các lệnh ghi đồng bộ server
+#   và không bao giờ phải chờ khóa "database is locked".
+# - Ghi hàng loạt (đồng bộ server) đi qua write_chunked(): mỗi lô là 1 transaction ngắn,
+#   nên lệnh ghi lúc thanh toán chỉ phải chờ tối đa 1 lô đang chạy, không chờ cả executemany lớn.
+
+import sqlite3
+import logging
+import threading
+import itertools
+import queue
+from concurrent.futures import Future
+
+# Độ ưu tiên lệnh ghi (số nhỏ chạy trước)
+PRIORITY_CHECKOUT = 0
+PRIORITY_NORMAL = 5
+PRIORITY_SYNC = 10
+
+# Số dòng tối đa mỗi transaction của write_chunked()
+BULK_CHUNK_ROWS = 200
+
+
+class SQLitePool:
+    BUSY_TIMEOUT = 10
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",      # An toàn với WAL, ít fsync hơn FULL
+        "PRAGMA cache_size=-8000",        # ~8 MB page cache mỗi kết nối
+        "PRAGMA mmap_size=67108864",      # 64 MB
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA foreign_keys=ON",
+    )
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_queue = queue.PriorityQueue()
+        self._order = itertools.count()   # Giữ thứ tự FIFO giữa các lệnh cùng độ ưu tiên
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self._writer_thread.start()
+
+    def _connect(self):
+        con = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT)
+        con.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            try:
+                con.execute(pragma)
+            except sqlite3.Error as e:
+                logging.warning(f"SQLITE: Không áp dụng được '{pragma}': {e}")
+        return con
+
+    def connection(self):
+        """Kết nối riêng của luồng hiện tại (tạo lần đầu, sau đó dùng lại)."""
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._connect()
+            self._local.con = con
+        return con
+
+    # --- GHI ---
+    def write(self, func, priority=PRIORITY_NORMAL, wait=True):
+        """
+        Đưa func(con) vào hàng đợi của luồng writer, chạy trong 1 transaction.
+        wait=True: chờ và trả về kết quả của func (ngoại lệ sqlite3 được ném lại cho nơi gọi).
+        wait=False: trả về Future.
+        """
+        if threading.current_thread() is self._writer_thread:
+            # Gọi lồng từ chính luồng writer: chạy luôn, tránh tự chờ chính mình
+            return self._run(func)
+        future = Future()
+        self._write_queue.put((priority, next(self._order), func, future))
+        return future.result() if wait else future
+
+    def write_chunked(self, func, rows, chunk_size=BULK_CHUNK_ROWS, priority=PRIORITY_SYNC):
+        """
+        Ghi hàng loạt theo lô: func(con, lô, is_last) chạy trong 1 transaction riêng cho mỗi lô
+        (luôn gọi ít nhất 1 lần, kể cả khi rows rỗng). Lệnh ghi ưu tiên cao hơn được xếp
+        giữa 2 lô. Các lô commit riêng rẽ: ghi gì cần "tất cả hoặc không" thì ghi ở lô cuối.
+        Trả về list kết quả của từng lô.
+        """
+        rows = list(rows)
+        results = []
+        for start in range(0, len(rows), chunk_size) or [0]:
+            chunk = rows[start:start + chunk_size]
+            is_last = start + chunk_size >= len(rows)
+            results.append(self.write(lambda con, chunk=chunk, is_last=is_last: func(con, chunk, is_last),
+                                      priority=priority))
+        return results
+
+    def execute_write(self, sql, params=(), priority=PRIORITY_NORMAL):
+        """Tiện ích: chạy 1 câu lệnh ghi, trả về rowcount."""
+        return self.write(lambda con: con.execute(sql, params).rowcount, priority=priority)
+
+    def _run(self, func):
+        con = self.connection()
+        with con:  # commit nếu thành công, rollback nếu lỗi
+            return func(con)
+
+    def _writer_loop(self):
+        while True:
+            priority, _, func, future = self._write_queue.get()
+            if func is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(func))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def close(self):
+        """Dừng luồng writer sau khi đã ghi hết các lệnh trong hàng đợi."""
+        self._write_queue.put((float('inf'), next(self._order), None, None))
+        self._writer_thread.join(timeout=5)
+
+# --- END OF FILE core/database/sqlite_pool.py ---
@@ -3,6 +3,8 @@ import requests
 import logging 
 from datetime import datetime
 
+from .http_session import get_session, timeout_for
+
 # Đảm bảo IP và Port là chính xác
 SERVER_URL = "https://rpi.vietseedscampaign.com"  # Dùng IP của server nếu chạy trên máy khác
 API_HEADERS = {
@@ -14,7 +16,7 @@ class VendingAPIManager:
     def get_all_products(self):
         endpoint = f"{SERVER_URL}/api/products"
         try:
-            response = requests.get(endpoint, headers=API_HEADERS, timeout=15)
+            response = get_session().get(endpoint, headers=API_HEADERS, timeout=timeout_for("products"))
             response.raise_for_status()
             data = response.json()
             if data.get("success"):
@@ -28,7 +30,7 @@ class VendingAPIManager:
     def get_customer_by_id(self, user_id):
         endpoint = f"{SERVER_URL}/api/user/{user_id}"
         try:
-            response = requests.get(endpoint, headers=API_HEADERS, timeout=10)
+            response = get_session().get(endpoint, headers=API_HEADERS, timeout=timeout_for("user"))
             if response.status_code == 200:
                 data = response.json()
                 if data.get("success"):
@@ -48,7 +50,7 @@ class VendingAPIManager:
             "user_id": user_id
         }
         try:
-            response = requests.post(endpoint, json=payload, headers=API_HEADERS, timeout=15)
+            response = get_session().post(endpoint, json=payload, headers=API_HEADERS, timeout=timeout_for("register"))
             response.raise_for_status()
             data = response.json()
             if data.get("success"):
@@ -66,7 +68,7 @@ class VendingAPIManager:
         endpoint = f"{SERVER_URL}/api/user/login"
         payload = {"phone_number": phone_number, "password": password}
         try:
-            response = requests.post(endpoint, json=payload, headers=API_HEADERS, timeout=15)
+            response = get_session().post(endpoint, json=payload, headers=API_HEADERS, timeout=timeout_for("login"))
             # API trả về 200 OK nếu thành công, 401 Unauthorized nếu thất bại
             if response.status_code == 200:
                 data = response.json()
@@ -81,15 +83,17 @@ class VendingAPIManager:
             logging.error(f"API: Lỗi mạng khi đăng nhập: {e}")
             return None
 
-    def report_transaction(self, total_amount, items_list, customer_info=None):
+    def report_transaction(self, total_amount, items_list, customer_info=None, order_code=None):
         endpoint = f"{SERVER_URL}/api/transactions/record"
         payload = {
             "total_amount": total_amount,
             "customer_info": customer_info,
             "items": items_list
         }
+        if order_code:
+            payload["order_code"] = order_code
         try:
-            response = requests.post(endpoint, json=payload, headers=API_HEADERS, timeout=20)
+            response = get_session().post(endpoint, json=payload, headers=API_HEADERS, timeout=timeout_for("transaction"))
             response.raise_for_status()
             data = response.json()
             return data.get("success", False)
@@ -97,5 +101,72 @@ class VendingAPIManager:
             logging.error(f"API: Lỗi mạng khi đồng bộ giao dịch: {e}")
             return False
 
+    def _record_transaction(self, payload):
+        """
+        POST 1 giao dịch (dùng khi gửi lại từng đơn). Trả về True nếu server nhận, False nếu
+        server từ chối (4xx hoặc success=false), None nếu lỗi mạng/5xx (chưa biết, gửi lại sau).
+        """
+        endpoint = f"{SERVER_URL}/api/transactions/record"
+        try:
+            response = get_session().post(endpoint, json=payload, headers=API_HEADERS, timeout=timeout_for("transaction"))
+            if response.status_code >= 500:
+                logging.error(f"API: Server lỗi {response.status_code} khi ghi giao dịch {payload.get('order_code')}.")
+                return None
+            if response.status_code >= 400:
+                logging.warning(f"API: Server từ chối giao dịch {payload.get('order_code')} ({response.status_code}).")
+                return False
+            return bool(response.json().get("success", False))
+        except (requests.RequestException, ValueError) as e:
+            logging.error(f"API: Lỗi mạng khi đồng bộ giao dịch {payload.get('order_code')}: {e}")
+            return None
+
+    def _report_transactions_one_by_one(self, transactions):
+        accepted, rejected = [], []
+        for t in transactions:
+            ok = self._record_transaction({
+                "total_amount": t.get('total_amount'),
+                "customer_info": t.get('customer_info'),
+                "items": t.get('items', []),
+                "order_code": t['order_code'],
+            })
+            if ok is None:
+                # Mất mạng giữa chừng: trả về phần đã biết, các đơn còn lại gửi ở lần sau
+                return (accepted, rejected) if accepted or rejected else None
+            (accepted if ok else rejected).append(t['order_code'])
+        return accepted, rejected
+
+    def report_transactions_batch(self, transactions):
+        """
+        Gửi nhiều giao dịch trong 1 request (dùng bởi TransactionOutbox).
+        Mỗi phần tử có order_code để server bỏ qua đơn trùng (gửi lại an toàn).
+        Trả về (order_code đã nhận, order_code bị server từ chối), hoặc None nếu lỗi mạng/5xx.
+        Đơn không nằm trong 2 list (mất mạng giữa chừng) coi như chưa gửi.
+        Nếu server chưa có endpoint batch (404) thì gửi lần lượt từng đơn.
+        """
+        endpoint = f"{SERVER_URL}/api/transactions/batch_record"
+        order_codes = [t['order_code'] for t in transactions]
+        try:
+            response = get_session().post(endpoint, json={"transactions": transactions}, headers=API_HEADERS, timeout=timeout_for("transaction_batch"))
+            if response.status_code == 404:
+                logging.warning("API: Server chưa hỗ trợ batch_record, gửi từng giao dịch.")
+                return self._report_transactions_one_by_one(transactions)
+            if response.status_code >= 500:
+                logging.error(f"API: Server lỗi {response.status_code} khi nhận lô {len(transactions)} giao dịch.")
+                return None
+            if response.status_code >= 400:
+                logging.error(f"API: Server từ chối lô {len(transactions)} giao dịch ({response.status_code}): {response.text[:200]}")
+                return [], order_codes
+            data = response.json()
+            if not data.get("success", False):
+                logging.error(f"API: Server từ chối lô giao dịch: {data.get('message')}")
+                return [], order_codes
+            # Server có thể trả về danh sách đơn đã nhận; nếu không thì coi như nhận hết
+            accepted = list(data.get("accepted", order_codes))
+            accepted_set = set(accepted)
+            return accepted, [code for code in order_codes if code not in accepted_set]
+        except (requests.RequestException, ValueError) as e:
+            logging.error(f"API: Lỗi mạng khi đồng bộ lô {len(transactions)} giao dịch: {e}")
+            return None
+
 api_manager = VendingAPIManager()
 # --- END OF FILE core/features/api_manager.py ---
\ No newline at end of file
@@ -4,6 +4,7 @@ import threading
 import time
 import logging
 from ..database.local_database_manager import db_manager
+from .transaction_outbox import transaction_outbox
 
 SYNC_INTERVAL = 300  # 300 giây = 5 phút
 
@@ -12,17 +13,25 @@ class BackgroundSyncManager:
         self._stop_event = threading.Event()
         self._thread = threading.Thread(target=self._run_periodic_sync, daemon=True)
         self.is_running = False
+        self._run_immediately = True
 
-    def start(self):
+    def start(self, run_immediately=True):
+        """
+        run_immediately=False: lượt đồng bộ đầu tiên chờ 1 chu kỳ
+        (dùng khi lúc khởi động đã gọi sync_now() rồi).
+        """
         if not self.is_running:
             print("BACKGROUND_SYNC: Starting background sync manager...")
+            self._run_immediately = run_immediately
             self.is_running = True
             self._thread.start()
+            transaction_outbox.start()
 
     def stop(self):
         if self.is_running:
             print("BACKGROUND_SYNC: Stopping background sync manager...")
             self._stop_event.set()
+            transaction_outbox.stop()
             try:
                 self._thread.join(timeout=5)
             except Exception:
@@ -50,6 +59,8 @@ class BackgroundSyncManager:
     def _run_periodic_sync(self):
         """Hàm này chạy trong luồng nền để đồng bộ định kỳ."""
         print(f"BACKGROUND_SYNC: Luồng đồng bộ định kỳ đã bắt đầu, sẽ chạy mỗi {SYNC_INTERVAL} giây.")
+        if not self._run_immediately:
+            self._stop_event.wait(SYNC_INTERVAL)
         while not self._stop_event.is_set():
             # Gọi hàm đồng bộ chung
             self.sync_now()
@@ -78,8 +89,9 @@ class BackgroundSyncManager:
             # Hoặc khi chạy định kỳ, khoảng nghỉ 5 phút đã đủ lớn
 
     def _sync_unsynced_transactions(self):
-        # (Chưa triển khai)
-        pass
+        # Gửi theo lô qua outbox (luồng outbox cũng tự gửi lại với backoff khi mất mạng)
+        if not transaction_outbox.drain():
+            print("BACKGROUND_SYNC: Chưa đồng bộ hết giao dịch, outbox sẽ thử lại sau.")
 
 # Tạo một instance toàn cục
 sync_manager = BackgroundSyncManager()
\ No newline at end of file
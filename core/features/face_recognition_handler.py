@@ -1,9 +1,11 @@
 # --- START OF FILE core/features/face_recognition_handler.py (ĐÃ SỬA LỖI & TÁI CẤU TRÚC) ---
+#
+# Nhận diện nền trong vài giây. Không giữ gallery/index riêng: dùng chung FastFaceSearch
+# của FaceRecognitionSystemWebcam (FastFaceSearch.shared), nên đăng ký/đổi tên ở hệ thống
+# webcam có hiệu lực ngay ở đây và chỉ có 1 bản gallery trong RAM. Điểm so khớp là cosine.
 
 import threading
 import time
-import os
-import pickle
 import numpy as np
 from collections import Counter
 
@@ -12,22 +14,11 @@ try:
 except Exception:
     cv2 = None
 
-try:
-    import faiss
-except Exception:
-    faiss = None
-
-try:
-    from core.Camera_AI.model import ModelEmbedding, MediaPipeFaceDetector
-except Exception:
-    ModelEmbedding = None
-    MediaPipeFaceDetector = None
+from core.Camera_AI import ai_facade
 
-# Đường dẫn thống nhất
-CACHE_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Camera_AI', 'database', 'face_cache_edgeface_base.pkl'))
 RECOGNITION_TIME_LIMIT = 5.0
 MAX_EMBS = 100
-SIM_THRESHOLD = 0.6
+SIM_THRESHOLD = 0.6          # Ngưỡng cosine
 BLUR_THRESHOLD = 20.0
 BRIGHTNESS_MIN = 15
 BRIGHTNESS_MAX = 240
@@ -36,101 +27,47 @@ CAPTURE_HEIGHT = 720
 TARGET_FPS = 30
 
 class FaceRecognitionHandler:
-    def __init__(self):
+    def __init__(self, face_system=None, frame_bus=None):
+        """
+        face_system: FaceRecognitionSystemWebcam đang chạy (nên truyền vào). Handler dùng
+        chung searcher, detector, model và FrameBus của nó, không tải thêm bản nào.
+        Không có face_system: tự tải model/detector và lấy gallery dùng chung qua
+        FastFaceSearch.shared (cùng instance hệ thống webcam sẽ dùng nếu được tạo sau).
+        frame_bus: bỏ qua nếu có face_system; không có bus thì tự mở camera.
+        """
         print("FaceRecognitionHandler khởi tạo (background 5s recognition).")
 
-        self._reset_cache_attributes()
-        
-        # Tải cache lần đầu tiên
-        self._load_cache()
-
-        # Chuẩn bị model + detector
         self._detector = None
         self._embedder = None
-        if ModelEmbedding and MediaPipeFaceDetector:
-            try:
-                self._detector = MediaPipeFaceDetector()
-                self._embedder = ModelEmbedding()
-            except Exception as e:
-                print(f"[FR] Lỗi khởi tạo model/detector: {e}")
-        else:
-            print("[FR] Cảnh báo: Thiếu ModelEmbedding hoặc MediaPipeFaceDetector.")
-
-    def _reset_cache_attributes(self):
-        """Helper để reset tất cả các thuộc tính liên quan đến cache."""
-        self._cache_loaded = False
-        self._embeddings = None
-        self._labels = []
-        self._name_map = {}
-        self._faiss_index = None
-        self._dim = None
-        self._faiss_id_to_name = {}
+        self.searcher = None
+        self._align_batch = None
+        try:
+            library = ai_facade.load_library()
+            self._align_batch = library.align_faces_batch
+            if face_system is not None:
+                self._detector = face_system.detector
+                self._embedder = face_system.recognizer
+                self.searcher = face_system.searcher
+                frame_bus = face_system.frame_bus
+            else:
+                self._detector = library.FaceRecognitionSystemWebcam.create_detector()
+                self._embedder = library.FaceRecognitionSystemWebcam.create_recognizer()
+                self.searcher = library.FastFaceSearch.shared(
+                    self._embedder, self._embedder.model_name,
+                    library.FaceRecognitionSystemWebcam.DATABASE_DIR_NAME)
+        except Exception as e:
+            print(f"[FR] Lỗi khởi tạo model/detector/gallery: {e}")
+
+        self.frame_bus = frame_bus
 
     def reload_cache(self):
         """
-        Tải lại dữ liệu cache từ file .pkl.
-        Đây là phương thức public được gọi từ bên ngoài.
+        Tải lại gallery từ đĩa (snapshot + journal, không tính lại embedding).
+        Đăng ký trong cùng process không cần gọi hàm này: gallery đã dùng chung.
         """
         print("[FR_HANDLER] Yêu cầu tải lại dữ liệu cache nhận diện...")
-        self._load_cache()
-
-    def _load_cache(self):
-        """
-        Hàm nội bộ để đọc file cache và xây dựng index.
-        """
-        # Reset trạng thái trước khi tải
-        self._reset_cache_attributes()
-        
-        if not os.path.exists(CACHE_FILE):
-            print(f"[FR] Cache không tồn tại: {CACHE_FILE}")
-            return
-            
-        if faiss is None:
-            print('[FR] Cảnh báo: Thiếu thư viện FAISS, không thể dựng index nhận diện.')
-            return
-
-        try:
-            with open(CACHE_FILE, 'rb') as f:
-                cache = pickle.load(f)
-            
-            embs = cache.get('embeddings')
-            labels = cache.get('labels')
-            name_map = cache.get('name_map') or {}
-
-            if isinstance(embs, list):
-                embs = np.array(embs, dtype='float32')
-
-            if not isinstance(embs, np.ndarray) or embs.size == 0:
-                print('[FR] Cache embeddings rỗng hoặc không hợp lệ.')
-                return
-
-            self._embeddings = embs.astype('float32')
-            self._labels = np.array(labels) if labels is not None else np.zeros(len(embs))
-            self._name_map = name_map
-            self._dim = self._embeddings.shape[1]
-            
-            # Xây dựng FAISS index
-            index = faiss.IndexHNSWFlat(self._dim, 32)
-            normalized_embs = self._embeddings.copy() # Tạo bản sao để normalize
-            faiss.normalize_L2(normalized_embs)
-            index.add(normalized_embs)
-            
-            # Map faiss internal id -> name theo labels
-            for i in range(len(self._embeddings)):
-                label = self._labels[i]
-                name = self._name_map.get(label, 'Unknown')
-                self._faiss_id_to_name[i] = name
-            
-            self._faiss_index = index
-            self._cache_loaded = True
-            print(f"[FR] Đã load cache và dựng index thành công: {self._embeddings.shape[0]} embeddings.")
-        except Exception as e:
-            print(f"[FR] Lỗi nghiêm trọng khi load cache hoặc dựng index: {e}")
-            self._reset_cache_attributes() # Reset lại nếu có lỗi
-
-    # --- Các phương thức còn lại (start_recognition, _perform_recognition, ...) giữ nguyên ---
-    # Bạn có thể copy-paste chúng vào đây hoặc chỉ thay thế các hàm ở trên.
-    # Để chắc chắn, tôi sẽ cung cấp lại toàn bộ phần còn lại.
+        if self.searcher is not None:
+            self.searcher.reload()
 
     def start_recognition(self, completion_callback, time_limit: float = 5.0, full_time: bool = True):
         self._time_limit = max(0.5, float(time_limit))
@@ -146,29 +83,32 @@ class FaceRecognitionHandler:
         except Exception as e:
             print(f"[FR] Lỗi callback: {e}")
 
-    def _perform_recognition(self):
-        if not self._cache_loaded or self._faiss_index is None:
-            print('[FR] Cache chưa được tải hoặc index FAISS chưa sẵn sàng. Bỏ qua nhận diện.')
-            return None
-        if cv2 is None or self._detector is None or self._embedder is None:
-            print('[FR] Thiếu cv2, detector hoặc embedder. Bỏ qua nhận diện.')
-            return None
-
+    def _collect_faces(self):
+        """Thu các khuôn mặt đã căn chỉnh (112x112 RGB) trong thời gian cho phép."""
         cap = None
+        cursor = None
+        # Warp thẳng vào buffer cấp phát sẵn, trả về view faces_buf[:count]
+        faces_buf = np.empty((MAX_EMBS, 112, 112, 3), dtype=np.uint8)
+        count = 0
         try:
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
-                print('[FR] Không mở được camera.')
-                return None
+            if self.frame_bus is not None:
+                # Dùng chung camera qua bus, không mở lại thiết bị
+                cursor = self.frame_bus.subscribe()
+            else:
+                cap = cv2.VideoCapture(0)
+                if not cap.isOpened():
+                    print('[FR] Không mở được camera.')
+                    return faces_buf[:0]
             print('[FR] Camera background recognition START.')
 
-            start = time.time()
-            collected_embs = []
-            target_end = start + self._time_limit
-
+            target_end = time.time() + self._time_limit
             while time.time() < target_end:
-                ret, frame = cap.read()
-                if not ret: continue
+                if cursor is not None:
+                    frame = cursor.next(timeout=max(0.0, target_end - time.time()))
+                    if frame is None: continue
+                else:
+                    ret, frame = cap.read()
+                    if not ret: continue
 
                 gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
                 focus_val = cv2.Laplacian(gray, cv2.CV_64F).var()
@@ -176,55 +116,55 @@ class FaceRecognitionHandler:
                 if focus_val < BLUR_THRESHOLD or brightness < BRIGHTNESS_MIN or brightness > BRIGHTNESS_MAX:
                     continue
 
+                if count >= MAX_EMBS:
+                    if not self._full_time:
+                        break
+                    continue
+
                 faces = self._detector.detect(frame)
                 if not faces: continue
-                
-                x1, y1, x2, y2 = faces[0]
-                face_img = frame[y1:y2, x1:x2]
-                if face_img.size == 0: continue
-
-                if len(collected_embs) >= MAX_EMBS and not self._full_time:
-                    break 
-                
-                if len(collected_embs) < MAX_EMBS:
-                    try:
-                        emb = self._embedder.get_embedding(face_img)
-                        if isinstance(emb, np.ndarray) and emb.size > 0:
-                            collected_embs.append(emb[0] if emb.ndim == 2 else emb)
-                    except Exception:
-                        continue
-            
-            if not collected_embs:
+
+                # Căn chỉnh giống hệt lúc đăng ký/đăng nhập để điểm cosine so sánh được
+                _, keypoints = faces[0]
+                count += len(self._align_batch([frame], [keypoints], out=faces_buf[count:count + 1]))
+            return faces_buf[:count]
+        finally:
+            if cap: cap.release()
+            print('[FR] Camera background recognition END.')
+
+    def _perform_recognition(self):
+        if self.searcher is None or self.searcher.ntotal == 0:
+            print('[FR] Gallery chưa sẵn sàng hoặc rỗng. Bỏ qua nhận diện.')
+            return None
+        if cv2 is None or self._detector is None or self._embedder is None:
+            print('[FR] Thiếu cv2, detector hoặc embedder. Bỏ qua nhận diện.')
+            return None
+
+        try:
+            faces_rgb = self._collect_faces()
+            embeddings = self._embedder.get_embeddings_batch(faces_rgb) if len(faces_rgb) else None
+            if embeddings is None or len(embeddings) == 0:
                 print('[FR] Không thu được embedding nào hợp lệ.')
                 return None
-            
-            # Nhận diện dựa trên embedding thu thập được
+
+            # Nhận diện dựa trên embedding thu thập được: 1 lần tìm kiếm cho cả lô,
+            # điểm mỗi người = cosine cao nhất trên các prototype của người đó
             name_counter = Counter()
-            for emb in collected_embs:
-                query = np.array([emb], dtype='float32')
-                faiss.normalize_L2(query)
-                D, I = self._faiss_index.search(query, 1)
-                
-                best_idx = I[0][0]
-                best_dist = D[0][0]
-                cosine_sim = 1 - (best_dist**2 / 2) # Chuyển đổi từ L2 distance sang Cosine Similarity
-                
-                if cosine_sim >= SIM_THRESHOLD:
-                    name = self._faiss_id_to_name.get(best_idx, 'Unknown')
-                    if name != 'Unknown':
-                        name_counter[name] += 1
-            
+            for results in self.searcher.search_batch(embeddings, topk=1):
+                if not results:
+                    continue
+                name, cosine_sim = results[0]
+                if cosine_sim >= SIM_THRESHOLD and name != 'Unknown':
+                    name_counter[name] += 1
+
             if not name_counter:
                 print('[FR] Không có khuôn mặt nào khớp với ngưỡng cho phép.')
                 return None
-            
+
             most_common_name, count = name_counter.most_common(1)[0]
-            print(f"[FR] KQ search: name={most_common_name} xuất hiện {count} lần trong {len(collected_embs)} lần nhận diện.")
+            print(f"[FR] KQ search: name={most_common_name} xuất hiện {count} lần trong {len(embeddings)} lần nhận diện.")
             return most_common_name
 
         except Exception as e:
             print(f"[FR] Lỗi trong quá trình nhận diện: {e}")
             return None
-        finally:
-            if cap: cap.release()
-            print('[FR] Camera background recognition END.')
\ No newline at end of file
@@ -20,7 +20,9 @@ payos = PayOS(client_id, api_key, checksum_key)
 app = Flask(__name__, static_url_path="", static_folder="public")
 YOUR_DOMAIN = "http://localhost:5000"
 
-# Hàng đợi dùng để gửi tín hiệu từ Flask về Tkinter
+# Hàng đợi dùng để gửi tín hiệu từ Flask về Tkinter.
+# Có thể là queue.Queue hoặc PaymentEventBridge (đánh thức Tk ngay khi put).
+# Tín hiệu có dạng (kind, order_code) với kind = "success" / "cancel".
 shared_queue = None
 
 def set_shared_queue(queue_instance):
@@ -31,7 +33,7 @@ def set_shared_queue(queue_instance):
 def payment_success(order_code):
     print("Flask: Đã nhận yêu cầu thành công cho order", order_code)
     if shared_queue:
-        shared_queue.put("success")
+        shared_queue.put(("success", order_code))
         print("Flask: Đã gửi 'success' vào shared_queue")
     else:
         print("Flask: shared_queue chưa được gán!")
@@ -39,9 +41,11 @@ def payment_success(order_code):
 
 @app.route("/cancel")
 def payment_cancel():
-    print("Flask: Khách đã hủy thanh toán.")
+    # PayOS gắn orderCode vào query string của cancelUrl
+    order_code = request.args.get("orderCode", type=int)
+    print("Flask: Khách đã hủy thanh toán cho order", order_code)
     if shared_queue:
-        shared_queue.put("cancel")
+        shared_queue.put(("cancel", order_code))
         print("Flask: Đã gửi 'cancel' vào shared_queue")
     else:
         print("Flask: shared_queue chưa được gán!")
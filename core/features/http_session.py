@@ -0,0 +1,167 @@
+# --- START OF FILE core/features/http_session.py ---
+#
+# Session HTTP dùng chung cho MỌI lời gọi lên server:
+# - Keep-alive + connection pool: chỉ bắt tay TLS 1 lần cho mỗi kết nối, các request sau dùng lại.
+# - Retry tự động khi lỗi kết nối / 502-503-504 (POST chỉ retry khi chưa gửi được request).
+# - Timeout riêng theo từng loại endpoint.
+# - Đo thời gian bắt tay (TCP + TLS) so với thời gian request để theo dõi trên mạng 4G.
+
+import time
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# --- CẤU HÌNH ---
+POOL_CONNECTIONS = 4        # Số host được giữ pool
+POOL_MAXSIZE = 8            # Số kết nối tối đa mỗi host (các luồng sync chạy song song)
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5  # 0.5s, 1s, 2s...
+RETRY_STATUS_FORCELIST = (502, 503, 504)
+
+# (connect timeout, read timeout) theo từng loại endpoint
+TIMEOUTS = {
+    "default": (5, 15),
+    "products": (5, 15),
+    "user": (5, 10),
+    "register": (5, 15),
+    "login": (5, 15),
+    "transaction": (5, 20),
+    "transaction_batch": (5, 30),
+    "config_push": (5, 10),
+}
+
+
+def timeout_for(endpoint_name):
+    return TIMEOUTS.get(endpoint_name, TIMEOUTS["default"])
+
+
+class HttpMetrics:
+    """Thống kê thời gian bắt tay (mở kết nối mới) và thời gian request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.connect_seconds = 0.0
+            self.requests = 0
+            self.request_seconds = 0.0
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds += seconds
+
+    def record_request(self, seconds):
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "avg_connect_ms": 1000 * self.connect_seconds / self.connects if self.connects else 0.0,
+                "requests": self.requests,
+                "avg_request_ms": 1000 * self.request_seconds / self.requests if self.requests else 0.0,
+                # Tỉ lệ request phải mở kết nối mới (càng thấp càng tốt)
+                "reuse_ratio": 1 - self.connects / self.requests if self.requests else 0.0,
+            }
+
+    def log_summary(self):
+        s = self.snapshot()
+        logging.info(
+            f"HTTP: {s['requests']} request, {s['connects']} kết nối mới "
+            f"(bắt tay TB {s['avg_connect_ms']:.0f}ms, request TB {s['avg_request_ms']:.0f}ms, "
+            f"dùng lại {s['reuse_ratio']:.0%})"
+        )
+
+
+metrics = HttpMetrics()
+
+
+# --- Kết nối có đo thời gian bắt tay ---
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            metrics.record_connect(time.perf_counter() - t0)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        try:
+            super().connect()  # TCP + TLS handshake
+        finally:
+            metrics.record_connect(time.perf_counter() - t0)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def _record_response(response, *args, **kwargs):
+    metrics.record_request(response.elapsed.total_seconds())
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Trả về session dùng chung (tạo lần đầu)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=RETRY_TOTAL,
+                    backoff_factor=RETRY_BACKOFF_FACTOR,
+                    status_forcelist=RETRY_STATUS_FORCELIST,
+                    raise_on_status=False,
+                )
+                adapter = TimedHTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(_record_response)
+                _session = session
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            metrics.log_summary()
+            _session.close()
+            _session = None
+
+# --- END OF FILE core/features/http_session.py ---
@@ -1,38 +1,120 @@
 # --- START OF FILE core/features/payment_handler.py (ĐÃ ĐƯỢC ĐƠN GIẢN HÓA) ---
 
+import os
 import queue
 import logging
+import tkinter as tk
 
-def check_payment_queue(root, ui, shopping_logic, flask_to_tkinter_queue):
+
+def _split_message(message):
+    """Tín hiệu từ Flask có dạng (kind, order_code); vẫn chấp nhận chuỗi cũ 'success'/'cancel'."""
+    if isinstance(message, tuple):
+        return message[0], (message[1] if len(message) > 1 else None)
+    return message, None
+
+
+def handle_payment_message(ui, message):
     """
-    Chỉ lắng nghe tín hiệu từ web server thanh toán.
+    Xử lý 1 tín hiệu từ web server thanh toán (CHẠY TRÊN LUỒNG TK).
     Khi có tín hiệu 'success', gọi hàm show_thank_you_screen() của UI.
     Toàn bộ logic xử lý giao dịch sẽ do UI đảm nhiệm.
     """
-    try:
-        message = flask_to_tkinter_queue.get_nowait()
-        
-        # Đóng trình duyệt trong mọi trường hợp (thành công hoặc hủy)
-        if message in ["success", "cancel"]:
-            from ..utils.system_utils import close_chromium
-            close_chromium()
-
-        # Xử lý theo tín hiệu
-        if message == "success":
-            logging.info("PAYMENT_HANDLER: Nhận được tín hiệu thanh toán THÀNH CÔNG. Chuyển quyền xử lý cho UI...")
-            # Kích hoạt màn hình cảm ơn, nơi này sẽ tự xử lý phần còn lại
-            ui.show_thank_you_screen() 
-            
-        elif message == "cancel":
-            logging.info("PAYMENT_HANDLER: Nhận được tín hiệu thanh toán BỊ HỦY.")
-            # Chỉ cần hiện lại màn hình chính
-            if ui.root and ui.root.winfo_exists():
-                ui.root.deiconify()
-
-    except queue.Empty:
-        pass
-    
-    # Lên lịch kiểm tra lại sau 1 giây
-    root.after(1000, lambda: check_payment_queue(root, ui, shopping_logic, flask_to_tkinter_queue))
+    kind, order_code = _split_message(message)
+
+    # Đóng trình duyệt trong mọi trường hợp (thành công hoặc hủy)
+    if kind in ["success", "cancel"]:
+        from ..utils.system_utils import close_chromium
+        close_chromium()
+
+    # Xử lý theo tín hiệu
+    if kind == "success":
+        logging.info(f"PAYMENT_HANDLER: Nhận được tín hiệu thanh toán THÀNH CÔNG (order {order_code}). Chuyển quyền xử lý cho UI...")
+        # Kích hoạt màn hình cảm ơn, nơi này sẽ tự xử lý phần còn lại
+        ui.show_thank_you_screen()
+
+    elif kind == "cancel":
+        logging.info(f"PAYMENT_HANDLER: Nhận được tín hiệu thanh toán BỊ HỦY (order {order_code}).")
+        # Chỉ cần hiện lại màn hình chính
+        if ui.root and ui.root.winfo_exists():
+            ui.root.deiconify()
+
+
+class PaymentEventBridge:
+    """
+    Cầu nối sự kiện Flask -> Tkinter, thay cho việc poll queue mỗi giây.
+    Flask gọi bridge.put((kind, order_code)) như 1 queue bình thường; bridge ghi 1 byte vào
+    self-pipe, Tk được đánh thức NGAY qua createfilehandler và xử lý trên luồng chính.
+    Trên nền tảng không có createfilehandler (Windows), quay về poll với chu kỳ ngắn.
+    """
+
+    FALLBACK_POLL_MS = 100
+
+    def __init__(self, root, ui):
+        self.root = root
+        self.ui = ui
+        self._queue = queue.Queue()
+        self._read_fd = self._write_fd = None
+
+        try:
+            self._read_fd, self._write_fd = os.pipe()
+            os.set_blocking(self._read_fd, False)
+            os.set_blocking(self._write_fd, False)
+            self.root.tk.createfilehandler(self._read_fd, tk.READABLE, self._on_readable)
+            logging.info("PAYMENT_HANDLER: Dùng self-pipe + createfilehandler (không poll).")
+        except (AttributeError, OSError, tk.TclError) as e:
+            self._close_pipe()
+            logging.info(f"PAYMENT_HANDLER: Không dùng được createfilehandler ({e}), chuyển sang poll {self.FALLBACK_POLL_MS}ms.")
+            self.root.after(self.FALLBACK_POLL_MS, self._poll)
+
+    def put(self, message):
+        """(LUỒNG FLASK) Gửi tín hiệu và đánh thức vòng lặp Tk."""
+        self._queue.put(message)
+        if self._write_fd is not None:
+            try:
+                os.write(self._write_fd, b'\x01')
+            except BlockingIOError:
+                pass  # Pipe đầy nghĩa là Tk đã có sẵn tín hiệu chờ đọc
+
+    def _on_readable(self, fd, mask):
+        try:
+            while os.read(fd, 512):
+                pass
+        except BlockingIOError:
+            pass
+        self._drain()
+
+    def _poll(self):
+        self._drain()
+        if self.root.winfo_exists():
+            self.root.after(self.FALLBACK_POLL_MS, self._poll)
+
+    def _drain(self):
+        while True:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                handle_payment_message(self.ui, message)
+            except Exception as e:
+                logging.error(f"PAYMENT_HANDLER: Lỗi khi xử lý tín hiệu {message}: {e}")
+
+    def _close_pipe(self):
+        for fd in (self._read_fd, self._write_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._read_fd = self._write_fd = None
+
+    def close(self):
+        if self._read_fd is not None:
+            try:
+                self.root.tk.deletefilehandler(self._read_fd)
+            except Exception:
+                pass
+        self._close_pipe()
+
 
 # XÓA HOÀN TOÀN hàm background_task_handler khỏi file này.
\ No newline at end of file
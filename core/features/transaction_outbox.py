@@ -0,0 +1,158 @@
+# --- START OF FILE core/features/transaction_outbox.py ---
+#
+# Outbox giao dịch: mọi đơn hàng được ghi vào transaction_history (is_synced = 0) TRƯỚC,
+# sau đó luồng outbox gom các đơn chưa đồng bộ thành lô, gửi 1 request batch,
+# và đánh dấu đã đồng bộ bằng 1 câu UPDATE. Mất mạng -> chờ lùi dần (exponential backoff).
+# Server từ chối (dữ liệu sai, đơn cũ thiếu items...) -> gửi lại từng đơn để đơn lỗi không chặn
+# cả lô; mỗi đơn bị từ chối MAX_ATTEMPTS lần thì bị đỗ lại (is_synced = TX_PARKED), không gửi nữa.
+
+import json
+import random
+import threading
+import time
+import logging
+
+from ..database.local_database_manager import db_manager
+from .api_manager import api_manager
+
+
+class TransactionOutbox:
+    BATCH_SIZE = 50
+    MAX_ATTEMPTS = 5          # Số lần server từ chối 1 đơn trước khi đỗ lại
+    IDLE_INTERVAL = 300       # Giây giữa 2 lần quét khi mọi thứ đã đồng bộ
+    BACKOFF_BASE = 5          # Giây chờ sau lần lỗi đầu tiên
+    BACKOFF_MAX = 600         # Giới hạn trên thời gian chờ
+
+    def __init__(self, db=db_manager, api=api_manager):
+        self.db = db
+        self.api = api
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._drain_lock = threading.Lock()
+        self._thread = None
+        self._failures = 0
+        self._next_attempt = 0.0
+
+    def start(self):
+        if self._thread is None:
+            print("OUTBOX: Bắt đầu luồng đồng bộ giao dịch.")
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def notify(self):
+        """Gọi sau khi lưu đơn mới: đánh thức outbox (vẫn tôn trọng backoff nếu đang mất mạng)."""
+        self._wake.set()
+
+    @staticmethod
+    def _row_to_payload(row):
+        if row['sync_payload']:
+            try:
+                return json.loads(row['sync_payload'])
+            except ValueError:
+                logging.warning(f"OUTBOX: Payload hỏng cho đơn {row['order_code']}, dùng dữ liệu tối thiểu.")
+        # Đơn cũ (trước khi có outbox) không có payload API: gửi thông tin tối thiểu
+        return {
+            "order_code": row['order_code'],
+            "timestamp": row['timestamp'],
+            "total_amount": row['total_amount'],
+            "customer_info": None,
+            "items": [],
+            "items_detail": row['items_detail'],
+        }
+
+    def _send_batch(self, payloads):
+        """
+        Gửi 1 lô. Trả về (đã nhận, bị từ chối) hoặc None nếu lỗi mạng/server.
+        Đơn bị từ chối trong lô nhiều đơn được gửi lại riêng từng đơn: server có thể từ chối
+        cả lô (success=false) chỉ vì 1 đơn lỗi.
+        """
+        result = self.api.report_transactions_batch(payloads)
+        if result is None or len(payloads) == 1 or not result[1]:
+            return result
+        accepted, rejected = list(result[0]), result[1]
+        by_code = {p['order_code']: p for p in payloads}
+        still_rejected = []
+        for code in rejected:
+            single = self.api.report_transactions_batch([by_code[code]])
+            if single is None:
+                break  # Mất mạng: các đơn còn lại coi như chưa gửi
+            accepted.extend(single[0])
+            still_rejected.extend(single[1])
+        return accepted, still_rejected
+
+    def drain(self):
+        """
+        Gửi toàn bộ đơn chưa đồng bộ theo lô. Trả về True nếu đã gửi hết những gì gửi được
+        (đơn bị từ chối được ghi nhận, thử lại ở lần quét sau), False nếu gặp lỗi mạng/server
+        (phần còn lại sẽ gửi sau thời gian backoff). Mỗi đơn được gửi tối đa 1 lần mỗi lần drain.
+        """
+        with self._drain_lock:
+            total = 0
+            rejected_now = set()
+            try:
+                while not self._stop_event.is_set():
+                    rows = self.db.get_unsynced_transactions(limit=self.BATCH_SIZE + len(rejected_now))
+                    rows = [row for row in rows if row['order_code'] not in rejected_now][:self.BATCH_SIZE]
+                    if not rows:
+                        break
+                    payloads = [self._row_to_payload(row) for row in rows]
+                    result = self._send_batch(payloads)
+                    if result is None:
+                        return False
+                    accepted, rejected = result
+                    total += self.db.mark_transactions_as_synced(accepted)
+                    if rejected:
+                        rejected_now.update(rejected)
+                        parked = self.db.record_transaction_rejections(rejected, "server_rejected", self.MAX_ATTEMPTS)
+                        logging.warning(f"OUTBOX: Server từ chối {len(rejected)} đơn"
+                                        f"{f', {parked} đơn bị đỗ lại sau {self.MAX_ATTEMPTS} lần' if parked else ''}.")
+                    known = set(accepted) | set(rejected)
+                    if any(row['order_code'] not in known for row in rows):
+                        # Mất mạng giữa chừng: phần còn lại gửi lại sau
+                        return False
+                return True
+            finally:
+                if total:
+                    print(f"OUTBOX: Đã đồng bộ {total} giao dịch.")
+
+    def _backoff_delay(self):
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** (self._failures - 1)))
+        return delay * random.uniform(0.5, 1.0)  # Jitter để nhiều máy không gọi cùng lúc
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            remaining = self._next_attempt - time.monotonic()
+            if remaining > 0:
+                # Đang backoff: đơn mới chỉ được gửi khi hết thời gian chờ
+                self._stop_event.wait(remaining)
+                continue
+
+            self._wake.clear()
+            try:
+                ok = self.drain()
+            except Exception as e:
+                logging.error(f"OUTBOX: Lỗi khi đồng bộ giao dịch: {e}", exc_info=True)
+                ok = False
+
+            if ok:
+                self._failures = 0
+                self._next_attempt = 0.0
+                self._wake.wait(self.IDLE_INTERVAL)
+            else:
+                self._failures += 1
+                delay = self._backoff_delay()
+                self._next_attempt = time.monotonic() + delay
+                print(f"OUTBOX: Đồng bộ thất bại (lần {self._failures}), thử lại sau {delay:.0f} giây.")
+
+
+# Tạo một instance toàn cục
+transaction_outbox = TransactionOutbox()
+
+# --- END OF FILE core/features/transaction_outbox.py ---
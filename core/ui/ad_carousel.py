@@ -0,0 +1,82 @@
+# SHOPPING_KEYPAD_APP/core/ui/ad_carousel.py
+#
+# Carousel quảng cáo cho màn hình chào mừng, bộ nhớ có giới hạn:
+# - Chỉ giữ ảnh đang hiển thị + ảnh kế tiếp (LRU nhỏ), không giữ toàn bộ quảng cáo trong RAM.
+# - Ảnh kế tiếp được giải mã trước trên luồng nền (từ cache ảnh đã resize trên đĩa).
+# - Dùng lại 1 PhotoImage duy nhất, chỉ paste() nội dung mới vào.
+# Nhờ vậy thêm 20-30 quảng cáo theo mùa không làm tăng bộ nhớ.
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ImageTk
+
+from core.ui import image_cache
+
+
+class AdCarousel:
+    CACHE_SIZE = 2              # Ảnh hiện tại + ảnh kế tiếp
+    INTERVAL_MS = 4000          # Thời gian hiển thị mỗi quảng cáo
+
+    def __init__(self, image_paths, size=(1920, 1080)):
+        self.image_paths = list(image_paths)
+        self.size = size
+        self._lru = OrderedDict()       # index -> PIL Image
+        self._pending = {}              # index -> Future đang giải mã
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ad-prefetch")
+        self._index = -1
+        self._photo = None
+        if self.image_paths:
+            self._prefetch(0)
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def _decode(self, index):
+        return image_cache.load_resized(self.image_paths[index], self.size)
+
+    def _prefetch(self, index):
+        with self._lock:
+            if index in self._lru or index in self._pending:
+                return
+            self._pending[index] = self._executor.submit(self._decode, index)
+
+    def _get(self, index):
+        with self._lock:
+            if index in self._lru:
+                self._lru.move_to_end(index)
+                return self._lru[index]
+            future = self._pending.pop(index, None)
+        # Thường đã giải mã xong từ lượt trước; chỉ giải mã đồng bộ khi chưa kịp prefetch
+        img = future.result() if future is not None else self._decode(index)
+        with self._lock:
+            self._lru[index] = img
+            while len(self._lru) > self.CACHE_SIZE:
+                self._lru.popitem(last=False)
+        return img
+
+    def next_photo(self):
+        """
+        (LUỒNG TK) Chuyển sang quảng cáo kế tiếp, trả về PhotoImage để gán cho Label.
+        Luôn trả về cùng 1 đối tượng PhotoImage. Trả về None nếu không có ảnh nào đọc được.
+        """
+        for _ in range(len(self.image_paths)):
+            self._index = (self._index + 1) % len(self.image_paths)
+            try:
+                img = self._get(self._index)
+            except Exception as e:
+                print(f"Lỗi tải ảnh quảng cáo {self.image_paths[self._index]}: {e}")
+                continue
+            if self._photo is None:
+                self._photo = ImageTk.PhotoImage(img)
+            else:
+                self._photo.paste(img)
+            self._prefetch((self._index + 1) % len(self.image_paths))
+            return self._photo
+        return None
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            self._lru.clear()
+            self._pending.clear()
@@ -1,9 +1,8 @@
 # SHOPPING_KEYPAD_APP/core/ui/ai_face_login_screen.py
 import tkinter as tk
 import customtkinter as ctk
-import cv2
 import threading
-from PIL import Image, ImageTk
+from core.ui.camera_preview import CameraPreview
 import numpy as np
 import time
 from collections import Counter
@@ -20,7 +19,7 @@ class AIFaceLoginScreen(tk.Toplevel):
         self.ai_system = self.controller.camera_ai_system
         
         # 1. KIỂM TRA DATABASE RỖNG (giữ nguyên)
-        if self.ai_system.searcher.index.ntotal == 0:
+        if self.ai_system.searcher.ntotal == 0:
             print("[LOGIN_AI_SCREEN] Database rỗng, bỏ qua nhận diện.")
             self.after(0, self._skip_and_close)
             return 
@@ -71,22 +70,16 @@ class AIFaceLoginScreen(tk.Toplevel):
             self.destroy() 
 
     def _camera_preview_loop(self):
-        """Vòng lặp này CHỈ hiển thị camera, không tính toán."""
-        if not self._recognition_capture_running or not self.winfo_exists():
-            return
-
-        # Lấy ảnh mới nhất (do luồng ngầm của thư viện cung cấp)
-        frame_bgr = self.ai_system.get_latest_frame_for_display()
-
-        if frame_bgr is not None:
-            frame_display = cv2.resize(frame_bgr, (640, 480))
-            frame_rgb = cv2.cvtColor(frame_display, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            imgtk = ImageTk.PhotoImage(image=img)
-            self.camera_label.imgtk = imgtk
-            self.camera_label.configure(image=imgtk)
-
-        self.after(33, self._camera_preview_loop) # ~30fps
+        """Chỉ hiển thị camera: việc resize/đổi màu chạy ở luồng nền của CameraPreview."""
+        self.camera_preview = CameraPreview(self.camera_label, self.ai_system.frame_bus)
+        self.camera_preview.start()
+
+    def destroy(self):
+        # Dừng luồng chuẩn bị ảnh preview trước khi hủy cửa sổ
+        preview = getattr(self, 'camera_preview', None)
+        if preview is not None:
+            preview.stop()
+        super().destroy()
 
     # === CÁC HÀM CẬP NHẬT UI (Callback) ===
     # (Được gọi bởi luồng worker)
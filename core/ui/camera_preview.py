@@ -0,0 +1,80 @@
+# SHOPPING_KEYPAD_APP/core/ui/camera_preview.py
+import threading
+import cv2
+from PIL import Image, ImageTk
+
+
+class CameraPreview:
+    """
+    Hiển thị camera lên 1 tk.Label mà KHÔNG làm nặng luồng Tk.
+    - Luồng worker: đọc frame mới từ FrameBus, resize + BGR->RGB + tạo PIL Image đúng kích thước.
+    - Luồng Tk: chỉ paste ảnh đã chuẩn bị vào 1 PhotoImage dùng lại (không tạo mới mỗi frame),
+      và chỉ khi thật sự có frame mới.
+    """
+
+    DEFAULT_SIZE = (640, 480)
+    DEFAULT_INTERVAL_MS = 33  # ~30fps
+
+    def __init__(self, label, frame_bus, size=DEFAULT_SIZE, interval_ms=DEFAULT_INTERVAL_MS):
+        self.label = label
+        self.frame_bus = frame_bus
+        self.size = tuple(size)
+        self.interval_ms = interval_ms
+
+        self._photo = None
+        self._pending = None          # PIL Image mới nhất chưa hiển thị
+        self._lock = threading.Lock()
+        self._running = False
+        self._worker = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._worker = threading.Thread(target=self._prepare_loop, daemon=True)
+        self._worker.start()
+        self._refresh()
+
+    def stop(self):
+        self._running = False
+
+    def _prepare_loop(self):
+        """(LUỒNG NỀN) Chuẩn bị ảnh hiển thị cho từng frame mới."""
+        cursor = self.frame_bus.subscribe(start_at_latest=False)
+        while self._running:
+            frame_bgr = cursor.next(timeout=0.5)
+            if frame_bgr is None:
+                continue
+            try:
+                frame_display = cv2.resize(frame_bgr, self.size, interpolation=cv2.INTER_LINEAR)
+                img = Image.fromarray(cv2.cvtColor(frame_display, cv2.COLOR_BGR2RGB))
+            except Exception as e:
+                print(f"[PREVIEW] Lỗi chuẩn bị ảnh: {e}")
+                continue
+            with self._lock:
+                self._pending = img
+
+    def _refresh(self):
+        """(LUỒNG TK) Chỉ blit ảnh đã chuẩn bị sẵn."""
+        if not self._running:
+            return
+        try:
+            if not self.label.winfo_exists():
+                self._running = False
+                return
+        except Exception:
+            self._running = False
+            return
+
+        with self._lock:
+            img, self._pending = self._pending, None
+
+        if img is not None:
+            if self._photo is None:
+                self._photo = ImageTk.PhotoImage(image=img)
+                self.label.configure(image=self._photo)
+                self.label.imgtk = self._photo  # giữ tham chiếu, tránh bị GC
+            else:
+                self._photo.paste(img)
+
+        self.label.after(self.interval_ms, self._refresh)
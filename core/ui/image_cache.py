@@ -0,0 +1,126 @@
+# SHOPPING_KEYPAD_APP/core/ui/image_cache.py
+#
+# Cache trên đĩa cho ảnh UI đã resize sẵn (quảng cáo 1920x1080, sản phẩm 150x200...).
+# Khóa cache = hash nội dung file gốc + kích thước đích, nên tự mất hiệu lực khi ảnh gốc
+# hoặc kích thước thay đổi. Lần khởi động bình thường chỉ đọc ảnh đã resize, không LANCZOS.
+import os
+import glob
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+CACHE_DIR_NAME = ".resized"
+CACHE_VERSION = 1           # Tăng khi đổi cách resize để bỏ toàn bộ cache cũ
+PNG_COMPRESS_LEVEL = 1      # Nén nhẹ: đọc nhanh, không tốn nhiều dung lượng
+MAX_WORKERS = 4             # PIL nhả GIL khi decode/resize nên thread pool là đủ
+
+_write_lock = threading.Lock()
+
+
+def _cache_dir_for(src_path):
+    return os.path.join(os.path.dirname(os.path.abspath(src_path)), CACHE_DIR_NAME)
+
+
+def _content_hash(src_path, size):
+    h = hashlib.sha1()
+    h.update(f"v{CACHE_VERSION}:{size[0]}x{size[1]}:".encode())
+    with open(src_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def _cache_path(src_path, size):
+    """(đường dẫn file cache, tiền tố chung của mọi bản cache cho ảnh + kích thước này)."""
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    prefix = f"{stem}_{size[0]}x{size[1]}_"
+    cache_dir = _cache_dir_for(src_path)
+    return os.path.join(cache_dir, f"{prefix}{_content_hash(src_path, size)}.png"), prefix
+
+
+def _resize_and_store(src_path, size, cache_path, prefix, resample):
+    with Image.open(src_path) as img:
+        resized = img.resize(size, resample)
+
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        resized.save(tmp_path, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        with _write_lock:
+            os.replace(tmp_path, cache_path)
+            # Xóa các bản cũ của cùng ảnh + kích thước (ảnh gốc đã đổi)
+            for old in glob.glob(os.path.join(cache_dir, f"{glob.escape(prefix)}*.png")):
+                if old != cache_path:
+                    try:
+                        os.remove(old)
+                    except OSError:
+                        pass
+    except OSError as e:
+        print(f"[IMG_CACHE] Không ghi được cache cho {src_path}: {e}")
+    return resized
+
+
+def load_resized(src_path, size, resample=Image.Resampling.LANCZOS):
+    """
+    Trả về PIL Image đã resize về `size` (đã load vào RAM, đóng file).
+    Dùng bản trong cache nếu có, nếu không thì resize rồi ghi cache.
+    """
+    size = (int(size[0]), int(size[1]))
+    cache_path, prefix = _cache_path(src_path, size)
+
+    if os.path.exists(cache_path):
+        try:
+            with Image.open(cache_path) as cached:
+                return cached.copy()  # copy() đọc hết dữ liệu trước khi file bị đóng
+        except Exception as e:
+            print(f"[IMG_CACHE] Cache hỏng {cache_path}, tạo lại: {e}")
+
+    return _resize_and_store(src_path, size, cache_path, prefix, resample)
+
+
+def ensure_cached(src_path, size, resample=Image.Resampling.LANCZOS):
+    """
+    Đảm bảo đã có bản resize trên đĩa mà KHÔNG giữ ảnh trong RAM.
+    Ném lỗi nếu ảnh gốc không đọc được.
+    """
+    size = (int(size[0]), int(size[1]))
+    cache_path, prefix = _cache_path(src_path, size)
+    if not os.path.exists(cache_path):
+        _resize_and_store(src_path, size, cache_path, prefix, resample)
+
+
+def load_many(jobs, max_workers=MAX_WORKERS):
+    """
+    jobs: list (đường dẫn, kích thước). Tải song song, trả về list ảnh cùng thứ tự;
+    phần tử lỗi là Exception tương ứng (để nơi gọi tự log).
+    """
+    def _load(job):
+        try:
+            return load_resized(*job)
+        except Exception as e:
+            return e
+
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        return list(pool.map(_load, jobs))
+
+
+def warm_many(jobs, max_workers=MAX_WORKERS):
+    """
+    Như load_many nhưng chỉ tạo cache cho ảnh còn thiếu, không trả về ảnh.
+    Trả về list cùng thứ tự: None nếu thành công, Exception nếu lỗi.
+    """
+    def _warm(job):
+        try:
+            ensure_cached(*job)
+            return None
+        except Exception as e:
+            return e
+
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        return list(pool.map(_warm, jobs))
@@ -3,7 +3,7 @@
 # --- Imports cơ bản ---
 import tkinter as tk
 from tkinter import PhotoImage, messagebox
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import os, itertools, sys, requests, webbrowser, re, datetime
 import customtkinter as ctk
 import subprocess, signal, time, threading
@@ -18,10 +18,13 @@ project_root = os.path.join(current_dir, '..', '..') # Đi lùi 2 cấp (từ /c
 sys.path.append(project_root)
 
 # --- Imports từ project ---
-import core.Camera_AI.face_recognition_library
-from core.Camera_AI.face_recognition_library import FaceRecognitionSystemWebcam
+# Thư viện AI (torch, mediapipe, faiss) chỉ được import khi cần, qua ai_facade
+from core.Camera_AI import ai_facade
 from core.features.shopping_logic import ShoppingLogic
 from core.database.local_database_manager import db_manager
+from core.features.transaction_outbox import transaction_outbox
+from core.ui import image_cache
+from core.ui.ad_carousel import AdCarousel
 from config import TEMP_MESSAGE_DURATION, IMAGE_BASE_PATH, PRODUCT_IMAGES_CONFIG, AD_IMAGES_CONFIG
 
 # --- Imports các màn hình UI đã tách ---
@@ -34,6 +37,8 @@ from core.ui.ui_confirmation import ConfirmationScreen
 from core.ui.ui_thankyou import ThankYouScreen
 from core.ui.ui_main import MainView
 
+AD_SCREEN_SIZE = (1920, 1080)
+
 class AdvancedUIManager:
     # --- Cấu hình (giữ nguyên) ---
     CAPTURE_WIDTH = 1280
@@ -47,32 +52,100 @@ class AdvancedUIManager:
     PRODUCT_IMAGES_CONFIG = PRODUCT_IMAGES_CONFIG
 
 
-    def __init__(self, root, shopping_logic_instance, api_manager_instance):
+    def __init__(self, root, shopping_logic_instance, api_manager_instance, startup=None):
+        """
+        startup: StartupOrchestrator (core/utils/startup.py). Nếu có, hệ thống AI và ảnh
+        được tải song song ở các stage "ai_system" / "images"; màn hình chào mừng hiện ngay
+        khi ảnh xong, AI được gắn vào khi sẵn sàng. Nếu None: khởi tạo tuần tự như cũ.
+        """
         self.root = root
         self.logic = shopping_logic_instance
         self.api_manager = api_manager_instance
+        self.startup = startup
         
         # Thêm db_manager vào self để LoginScreen có thể truy cập
         self.db_manager = db_manager
+        self.camera_ai_system = None
+        self._pending_ai_actions = []  # (action, fallback) chờ hệ thống AI sẵn sàng
+        self.face_enabled = ai_facade.is_enabled()
+        if startup is None and self.face_enabled and not self._init_camera_ai_system():
+            return
+        
+        decoded_images = None
+        if startup is not None:
+            try:
+                decoded_images = startup.result("images")
+            except Exception as e:
+                print(f"UI_INIT: Stage tải ảnh lỗi ({e}), tải lại trên luồng chính.")
+        self._setup_ui(decoded_images)
+
+        if startup is not None and self.face_enabled:
+            startup.when_done("ai_system", lambda system, error: self.root.after(0, self._on_ai_system_ready, system, error))
+
+    def _init_camera_ai_system(self):
+        """Khởi tạo tuần tự (khi không có bộ điều phối khởi động). Trả về False nếu lỗi."""
         print("UI_INIT: Khởi tạo Hệ thống AI Camera (FaceRecognitionSystemWebcam)...")
         try:
             # Dòng này sẽ khởi tạo model EdgeFace, MediaPipe, FAISS
             # và tự khởi động luồng webcam (daemon)
-            self.camera_ai_system = FaceRecognitionSystemWebcam()
-            print("UI_INIT: Hệ thống AI Camera đã sẵn sàng.")
+            self.attach_camera_ai_system(ai_facade.create_system())
+            return True
         except FileNotFoundError as e:
             print(f"LỖI NGHIÊM TRỌNG: Không tìm thấy file model: {e}")
             messagebox.showerror("Lỗi AI", f"Không tìm thấy file model AI: {e}\nVui lòng kiểm tra thư mục 'checkpoints'. Ứng dụng sẽ thoát.")
             self.root.destroy()
-            return
+            return False
         except Exception as e:
             print(f"LỖI NGHIÊM TRỌNG: Không thể khởi tạo FaceRecognitionSystemWebcam: {e}")
             import traceback
             traceback.print_exc()
             messagebox.showerror("Lỗi AI", f"Không thể tải model AI: {e}\nỨng dụng sẽ thoát.")
             self.root.destroy()
+            return False
+
+    def attach_camera_ai_system(self, camera_ai_system):
+        self.camera_ai_system = camera_ai_system
+        # Khi đồng bộ server đổi ID khách hàng, đổi nhãn khuôn mặt tại chỗ (không xóa cache)
+        self.db_manager.set_face_id_rename_callback(self.camera_ai_system.rename_person)
+        print("UI_INIT: Hệ thống AI Camera đã sẵn sàng.")
+
+    def _on_ai_system_ready(self, camera_ai_system, error):
+        """(LUỒNG TK) Stage 'ai_system' của bộ điều phối khởi động đã xong."""
+        if self.is_closing:
             return
-        
+        if error is not None:
+            # Bán hàng vẫn hoạt động, chỉ tắt các chức năng khuôn mặt
+            print(f"LỖI NGHIÊM TRỌNG: Không thể khởi tạo FaceRecognitionSystemWebcam: {error}")
+            self.face_enabled = False
+            messagebox.showerror("Lỗi AI", f"Không thể tải model AI: {error}\nChức năng nhận diện khuôn mặt sẽ bị tắt.")
+        else:
+            self.attach_camera_ai_system(camera_ai_system)
+        actions, self._pending_ai_actions = self._pending_ai_actions, []
+        for action, fallback in actions:
+            # AI lỗi: hoàn tất thao tác đang chờ theo đường không dùng khuôn mặt, không bỏ dở
+            if error is None:
+                action()
+            else:
+                fallback()
+
+    def _run_when_ai_ready(self, action, waiting_message, fallback):
+        """
+        Chạy action ngay nếu AI đã sẵn sàng, nếu chưa thì chờ (trả về False).
+        fallback: chạy thay cho action nếu stage 'ai_system' lỗi (như khi máy tắt AI).
+        """
+        if self.camera_ai_system is not None:
+            action()
+            return True
+        if not self.face_enabled or self.startup is None or self.startup.is_done("ai_system"):
+            # AI đã lỗi: không còn gì để chờ
+            fallback()
+            return False
+        self._pending_ai_actions.append((action, fallback))
+        self.status_message_var.set(waiting_message)
+        self.root.deiconify()
+        return False
+
+    def _setup_ui(self, decoded_images=None):
         self.root.withdraw()
         self.root.title("Máy bán hàng tự động")
         screen_width = self.root.winfo_screenwidth()
@@ -96,9 +169,8 @@ class AdvancedUIManager:
         self.points_used_in_transaction = 0 
 
         # --- Cache hình ảnh (dùng chung) ---
-        self.cached_ad_images = []
+        self.ad_carousel = None # Carousel quảng cáo, được WelcomeScreen sử dụng
         self.cached_product_images = {}
-        self.ad_imgs_cycle = None # Vòng lặp này sẽ được WelcomeScreen sử dụng
 
         # --- Quản lý Keyboard & Taskbar ---
         self.keyboard_process = None 
@@ -109,7 +181,7 @@ class AdvancedUIManager:
         self.enable_post_register_embedding = True
 
         print("UI_INIT: Bắt đầu kiểm tra và khởi tạo cache nhận diện...")
-        self._preload_all_images()
+        self._preload_all_images(decoded_images)
         
         # === SỬA LỖI KẾT NỐI ===
         # Khởi tạo MainView và lưu tham chiếu
@@ -143,6 +215,13 @@ class AdvancedUIManager:
         """
         Hiển thị màn hình nhận diện.
         """
+        if self.camera_ai_system is None:
+            # AI tắt hoặc chưa tải xong: vào thẳng màn hình chính (vẫn mua hàng / đăng nhập SĐT được)
+            print("UI: Hệ thống AI chưa sẵn sàng, bỏ qua nhận diện khuôn mặt.")
+            if self.face_enabled:
+                self.status_message_var.set("Nhận diện khuôn mặt đang khởi động, vui lòng thử lại sau giây lát.")
+            self.root.deiconify()
+            return
         AIFaceLoginScreen(self.root, self)
         self.root.withdraw()
     def show_login_screen(self):
@@ -157,7 +236,27 @@ class AdvancedUIManager:
         """
         Hiển thị màn hình chụp ảnh (được gọi bởi RegisterScreen).
         """
-        AIFaceRegistrationScreen(self.root, self, local_user_id, name, phone, dob, password, original_register_window)
+        finish_without_face = lambda: self._complete_registration_without_face(
+            local_user_id, name, phone, dob, password, original_register_window)
+        if not self.face_enabled:
+            finish_without_face()
+            return
+        # Nếu AI chưa tải xong thì mở màn hình chụp ngay khi sẵn sàng
+        self._run_when_ai_ready(
+            lambda: AIFaceRegistrationScreen(self.root, self, local_user_id, name, phone, dob, password, original_register_window),
+            "Đang khởi động camera nhận diện, vui lòng chờ...",
+            finish_without_face
+        )
+
+    def _complete_registration_without_face(self, local_user_id, name, phone, dob, password, original_register_window):
+        """Máy không dùng AI (hoặc AI lỗi): hoàn tất đăng ký không cần dữ liệu khuôn mặt."""
+        registration_data = self.db_manager.get_customer_by_id(local_user_id)
+        self._on_background_task_complete(registration_data, None, original_register_window)
+        threading.Thread(
+            target=self._background_registration_and_embedding,
+            args=(name, phone, dob, password, original_register_window, local_user_id),
+            daemon=True
+        ).start()
 
     def _show_confirmation_screen(self):
         """
@@ -401,27 +500,43 @@ class AdvancedUIManager:
     # PRELOAD HÌNH ẢNH
     # ==================================================================
     
-    def _preload_all_images(self):
+    @staticmethod
+    def load_images_for_display():
+        """
+        Chuẩn bị ảnh quảng cáo / sản phẩm. Không đụng tới Tk nên chạy được ở luồng nền
+        (stage "images" lúc khởi động).
+        Trả về (list đường dẫn ảnh quảng cáo dùng được, {product_id: PIL Image hoặc None}).
+        Quảng cáo KHÔNG được giải mã ở đây: AdCarousel tự giải mã dần khi hiển thị.
+        """
         print("Bắt đầu tải trước và xử lý hình ảnh...")
-        screen_width = 1920
-        screen_height = 1080
-        for img_file in AD_IMAGES_CONFIG:
-            try:
-                img = Image.open(f"{IMAGE_BASE_PATH}{img_file}")
-                img = img.resize((screen_width, screen_height), Image.Resampling.LANCZOS)
-                self.cached_ad_images.append(ImageTk.PhotoImage(img))
-            except Exception as e:
-                print(f"Lỗi tải ảnh quảng cáo {img_file}: {e}")
+        # Ảnh đã resize được lấy từ cache trên đĩa (core/ui/image_cache.py);
+        # chỉ ảnh mới/đã đổi mới phải resize, và các ảnh đó được xử lý song song.
         img_size = (150, 200)
-        for product_id, (_, img_file, _) in PRODUCT_IMAGES_CONFIG.items():
-            try:
-                img_path = f"{IMAGE_BASE_PATH}{img_file}"
-                img = Image.open(img_path)
-                img = img.resize(img_size, Image.Resampling.LANCZOS)
-                self.cached_product_images[product_id] = ImageTk.PhotoImage(img)
-            except Exception as e:
-                print(f"Lỗi tải ảnh sản phẩm {img_file}: {e}")
-                self.cached_product_images[product_id] = None
+        ad_jobs = [(f"{IMAGE_BASE_PATH}{img_file}", AD_SCREEN_SIZE) for img_file in AD_IMAGES_CONFIG]
+        product_items = [(product_id, img_file) for product_id, (_, img_file, _) in PRODUCT_IMAGES_CONFIG.items()]
+        product_jobs = [(f"{IMAGE_BASE_PATH}{img_file}", img_size) for _, img_file in product_items]
+
+        ad_paths = []
+        for (ad_path, _), error in zip(ad_jobs, image_cache.warm_many(ad_jobs)):
+            if error is not None:
+                print(f"Lỗi tải ảnh quảng cáo {ad_path}: {error}")
+            else:
+                ad_paths.append(ad_path)
+        product_images = {}
+        for (product_id, img_file), img in zip(product_items, image_cache.load_many(product_jobs)):
+            if isinstance(img, Exception):
+                print(f"Lỗi tải ảnh sản phẩm {img_file}: {img}")
+                product_images[product_id] = None
+            else:
+                product_images[product_id] = img
+        return ad_paths, product_images
+
+    def _preload_all_images(self, decoded_images=None):
+        """(LUỒNG TK) Tạo carousel quảng cáo + PhotoImage sản phẩm (tự đọc nếu chưa có decoded_images)."""
+        ad_paths, product_images = decoded_images or self.load_images_for_display()
+        self.ad_carousel = AdCarousel(ad_paths, AD_SCREEN_SIZE)
+        for product_id, img in product_images.items():
+            self.cached_product_images[product_id] = ImageTk.PhotoImage(img) if img is not None else None
         print("Tải trước hình ảnh hoàn tất!")
 
 
@@ -591,16 +706,9 @@ class AdvancedUIManager:
             items_sold_list_for_local_db.append({"product_name": name, "quantity": quantity})
         items_detail_str = ", ".join(items_detail_parts)
 
-        # 1. LƯU GIAO DỊCH VÀO DB LOCAL
-        order_code = db_manager.save_transaction(
-            total_amount, customer_name, items_detail_str, items_sold_list_for_local_db
-        )
-        if not order_code:
-            print("UI ERROR: Không thể lưu giao dịch vào DB local.")
-            return
-        print(f"UI: Giao dịch {order_code} đã được lưu vào DB local.")
-
+        # 1. TÍNH ĐIỂM (trước khi lưu, để payload đồng bộ mang theo điểm mới)
         final_new_points = 0
+        amount_eligible_for_reward = 0
         if user_id:
             # --- FIX: TÍNH SỐ TIỀN THỰC TRẢ ĐỂ TÍNH ĐIỂM ---
             # Giá trị 1 điểm = 100 VNĐ (theo logic file confirmation)
@@ -611,6 +719,36 @@ class AdvancedUIManager:
 
             print(f"DEBUG: Giá gốc: {total_amount}, Giảm: {discount_value}, Tính điểm trên: {amount_eligible_for_reward}")
 
+            # Điểm mới = điểm hiện tại - điểm dùng + điểm thưởng (giống update_customer_points)
+            current_user_data = db_manager.get_customer_by_id(user_id) or self.customer_info or {}
+            current_points = current_user_data.get('points', 0) or 0
+            final_new_points = current_points - self.points_used_in_transaction + int(amount_eligible_for_reward / 1000)
+
+        # Payload API được lưu cùng giao dịch (outbox), để gửi lại được khi mất mạng
+        customer_info_for_api = None
+        if self.customer_info and user_id:
+            customer_info_for_api = {
+                "user_id": user_id,
+                "name": self.customer_name,
+                "new_total_points": final_new_points  # <--- QUAN TRỌNG: Server cần field này để update
+            }
+        sync_payload = {
+            "total_amount": total_amount,
+            "items": [{'product_id': pid, 'quantity': count} for pid, count in product_counts.items()],
+            "customer_info": customer_info_for_api,
+        }
+
+        # 2. LƯU GIAO DỊCH VÀO DB LOCAL
+        order_code = db_manager.save_transaction(
+            total_amount, customer_name, items_detail_str, items_sold_list_for_local_db,
+            sync_payload=sync_payload
+        )
+        if not order_code:
+            print("UI ERROR: Không thể lưu giao dịch vào DB local.")
+            return
+        print(f"UI: Giao dịch {order_code} đã được lưu vào DB local.")
+
+        if user_id:
             # Truyền amount_eligible_for_reward vào thay vì total_amount
             db_manager.update_customer_points(user_id, self.points_used_in_transaction, amount_eligible_for_reward)
             
@@ -622,31 +760,8 @@ class AdvancedUIManager:
             
             print(f"UI: Đã cập nhật điểm Local. Điểm mới: {final_new_points}")
 
-        # 3. ĐỒNG BỘ LÊN SERVER (NỀN) - GỬI KÈM ĐIỂM MỚI
-        def sync_transaction_task():
-            print(f"SYNC: Bắt đầu đồng bộ đơn hàng {order_code} lên server...")
-            final_api_items = [{'product_id': pid, 'quantity': count} for pid, count in product_counts.items()]
-            
-            # Chuẩn bị thông tin khách hàng gửi lên API
-            customer_info_for_api = None
-            if self.customer_info and user_id:
-                customer_info_for_api = {
-                    "user_id": user_id,
-                    "name": self.customer_name,
-                    "new_total_points": final_new_points  # <--- QUAN TRỌNG: Server cần field này để update
-                }
-
-            success = self.api_manager.report_transaction(
-                total_amount, final_api_items, customer_info_for_api
-            )
-            
-            if success:
-                print(f"SYNC: Đồng bộ đơn hàng {order_code} và cập nhật điểm lên server THÀNH CÔNG.")
-                db_manager.mark_transaction_as_synced(order_code)
-            else:
-                print(f"SYNC: Đồng bộ đơn hàng {order_code} THẤT BẠI. Sẽ thử lại sau.")
-                
-        threading.Thread(target=sync_transaction_task, daemon=True).start()
+        # 3. ĐỒNG BỘ LÊN SERVER (NỀN) - outbox gửi theo lô, tự thử lại khi mất mạng
+        transaction_outbox.notify()
 
         # 4. ĐIỀU KHIỂN LED
         try:
@@ -674,6 +789,8 @@ class AdvancedUIManager:
 
         print("UI: Dừng camera handler...")
         self._cleanup_keyboard()
+        if self.ad_carousel is not None:
+            self.ad_carousel.close()
         self.logic.close_resources()
 
         if self.hide_keyboard_timer:
@@ -1,7 +1,7 @@
 import tkinter as tk
 import customtkinter as ctk
 from tkinter import PhotoImage
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import os
 
 # --- BẮT ĐẦU SỬA LỖI IMPORT ---
@@ -12,6 +12,7 @@ sys.path.append(project_root)
 # --- KẾT THÚC SỬA LỖI IMPORT ---
 
 from config import IMAGE_BASE_PATH, PRODUCT_IMAGES_CONFIG
+from core.ui import image_cache
 
 class MainView:
     """
@@ -78,9 +79,8 @@ class MainView:
                     item_frame.config(image=photo_img, text=display_text, font=("Arial", font_sizes["name"]))
                     item_frame.image = photo_img
                 else:
-                    img = Image.open(img_path)
-                    img = img.resize(img_size, Image.Resampling.LANCZOS)
-                    photo_img = ImageTk.PhotoImage(img)
+                    # Ảnh chưa có trong bộ nhớ: lấy bản đã resize từ cache trên đĩa
+                    photo_img = ImageTk.PhotoImage(image_cache.load_resized(img_path, img_size))
                     item_frame.config(image=photo_img, text=display_text, font=("Arial", font_sizes["name"]))
                     item_frame.image = photo_img
             except Exception as e:
@@ -1,6 +1,5 @@
 # SHOPPING_KEYPAD_APP/core/ui/welcome_screen.py
 import tkinter as tk
-import itertools
 try:
     from PIL import Image, ImageTk
     import sys
@@ -36,11 +35,9 @@ class WelcomeScreen(tk.Toplevel):
         self.ad_label = tk.Label(clickable_frame, bg="white")
         self.ad_label.pack(fill="both", expand=True)
 
-        if not self.controller.cached_ad_images:
+        if not self.controller.ad_carousel:
             self.ad_label.config(text="Không có ảnh quảng cáo!", font=("Arial", 24))
         else:
-            if self.controller.ad_imgs_cycle is None:
-                self.controller.ad_imgs_cycle = itertools.cycle(self.controller.cached_ad_images)
             self._update_ad()
 
         clickable_frame.bind("<Button-1>", self._on_welcome_click)
@@ -51,12 +48,16 @@ class WelcomeScreen(tk.Toplevel):
     def _update_ad(self):
         if not self.winfo_exists():
             return
+        carousel = self.controller.ad_carousel
         try:
-            img = next(self.controller.ad_imgs_cycle)
+            img = carousel.next_photo()
+            if img is None:
+                self.ad_label.config(image="", text="Không có ảnh quảng cáo!", font=("Arial", 24))
+                return
             self.ad_label.config(image=img)
             self.ad_label.image = img
-            self.after(4000, self._update_ad)
-        except (StopIteration, tk.TclError):
+            self.after(carousel.INTERVAL_MS, self._update_ad)
+        except tk.TclError:
             pass
 
     def _on_welcome_click(self, event):
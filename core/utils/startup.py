@@ -0,0 +1,154 @@
+# --- START OF FILE core/utils/startup.py ---
+#
+# Điều phối khởi động ứng dụng: các bước (stage) độc lập chạy song song trên luồng riêng,
+# mỗi bước khai báo các bước nó phụ thuộc. Ghi lại thời gian của từng bước để theo dõi
+# thời gian khởi động nguội (máy khởi động lại mỗi đêm).
+
+import time
+import logging
+import threading
+
+
+class StageFailed(Exception):
+    """Bước khởi động thất bại (hoặc bị bỏ qua vì bước phụ thuộc thất bại)."""
+
+
+class _Stage:
+    def __init__(self, name, func, depends):
+        self.name = name
+        self.func = func
+        self.depends = tuple(depends)
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.callbacks = []
+
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class StartupOrchestrator:
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._t0 = None
+
+    def add_stage(self, name, func, depends=()):
+        """
+        Đăng ký 1 bước: func() chạy trên luồng riêng sau khi mọi bước trong `depends` xong.
+        Giá trị trả về của func được lưu lại, lấy bằng result(name).
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage '{name}' đã tồn tại")
+        for dep in depends:
+            if dep not in self._stages:
+                raise ValueError(f"Stage '{name}' phụ thuộc '{dep}' chưa được khai báo")
+        self._stages[name] = _Stage(name, func, depends)
+        return self
+
+    def start(self, log_summary=True):
+        """Chạy mọi bước. log_summary=True: in bảng thời gian khi tất cả các bước đã xong."""
+        self._t0 = time.perf_counter()
+        for stage in self._stages.values():
+            threading.Thread(target=self._run_stage, args=(stage,), name=f"startup-{stage.name}", daemon=True).start()
+        if log_summary:
+            threading.Thread(target=self._log_when_all_done, daemon=True).start()
+        return self
+
+    def _log_when_all_done(self):
+        self.wait(list(self._stages))
+        print(f"[STARTUP] Hoàn tất mọi bước sau {time.perf_counter() - self._t0:.2f}s.")
+        self.log_summary()
+
+    def _run_stage(self, stage):
+        for dep in stage.depends:
+            dep_stage = self._stages[dep]
+            dep_stage.done.wait()
+            if dep_stage.error is not None:
+                stage.error = StageFailed(f"bỏ qua vì '{dep}' thất bại")
+                self._finish(stage)
+                return
+
+        stage.started_at = time.perf_counter()
+        try:
+            stage.result = stage.func()
+        except Exception as e:
+            logging.error(f"STARTUP: Stage '{stage.name}' lỗi: {e}", exc_info=True)
+            stage.error = e
+        stage.finished_at = time.perf_counter()
+        if stage.error is None:
+            print(f"[STARTUP] '{stage.name}' xong sau {stage.duration:.2f}s "
+                  f"(t+{stage.finished_at - self._t0:.2f}s)")
+        self._finish(stage)
+
+    def _finish(self, stage):
+        with self._lock:
+            stage.done.set()
+            callbacks, stage.callbacks = stage.callbacks, []
+        for callback in callbacks:
+            self._invoke(callback, stage)
+
+    @staticmethod
+    def _invoke(callback, stage):
+        try:
+            callback(stage.result, stage.error)
+        except Exception as e:
+            logging.error(f"STARTUP: Lỗi callback của stage '{stage.name}': {e}", exc_info=True)
+
+    # --- Truy vấn ---
+    def is_done(self, name):
+        return self._stages[name].done.is_set()
+
+    def wait(self, names, timeout=None):
+        """Chờ các bước trong `names` xong. Trả về False nếu hết timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in ([names] if isinstance(names, str) else names):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self._stages[name].done.wait(remaining):
+                return False
+        return True
+
+    def result(self, name):
+        """Kết quả của bước (ném StageFailed nếu bước lỗi). Chờ nếu chưa xong."""
+        stage = self._stages[name]
+        stage.done.wait()
+        if stage.error is not None:
+            raise StageFailed(f"Stage '{name}' thất bại: {stage.error}") from stage.error
+        return stage.result
+
+    def when_done(self, name, callback):
+        """
+        Gọi callback(result, error) khi bước xong (ngay lập tức nếu đã xong).
+        Callback chạy trên luồng của bước đó: code UI cần chuyển về luồng Tk bằng after().
+        """
+        stage = self._stages[name]
+        with self._lock:
+            if not stage.done.is_set():
+                stage.callbacks.append(callback)
+                return
+        self._invoke(callback, stage)
+
+    def timings(self):
+        """{tên bước: (bắt đầu sau t0, thời gian chạy, lỗi)} (giây)."""
+        out = {}
+        for name, stage in self._stages.items():
+            start = None if stage.started_at is None else stage.started_at - self._t0
+            out[name] = (start, stage.duration, stage.error)
+        return out
+
+    def log_summary(self):
+        print("[STARTUP] Thời gian từng bước:")
+        for name, (start, duration, error) in self.timings().items():
+            if error is not None:
+                print(f"  - {name:<16} LỖI: {error}")
+            elif duration is None:
+                print(f"  - {name:<16} chưa xong")
+            else:
+                print(f"  - {name:<16} bắt đầu t+{start:.2f}s, chạy {duration:.2f}s")
+
+# --- END OF FILE core/utils/startup.py ---
@@ -3,7 +3,6 @@
 
 import tkinter as tk
 import threading
-import queue
 import sys
 import os
 
@@ -15,8 +14,12 @@ from core.features.shopping_logic import ShoppingLogic
 from core.ui.ui_controller import AdvancedUIManager
 from core.features.api_manager import VendingAPIManager 
 from core.features.flask_QR import app, set_shared_queue, run_flask_app
-from core.features.payment_handler import check_payment_queue
+from core.features.payment_handler import PaymentEventBridge
 from core.features.background_sync import sync_manager
+from core.features.http_session import close_session
+from core.database.local_database_manager import db_manager
+from core.Camera_AI import ai_facade
+from core.utils.startup import StartupOrchestrator
 
 # --- Import driver phần cứng (với kiểm tra lỗi) ---
 try:
@@ -35,6 +38,7 @@ def main():
     Nhiệm vụ: Khởi tạo và điều phối các module chính.
     """
     ui_instance = None  # Khai báo trước để dùng trong khối finally
+    payment_bridge = None
 
     try:
         print("--- BẮT ĐẦU KHỞI TẠO ỨNG DỤNG MÁY BÁN HÀNG ---")
@@ -43,43 +47,66 @@ def main():
         root = tk.Tk()
         shopping_logic = ShoppingLogic()
         api_manager = VendingAPIManager()
-        flask_to_tkinter_queue = queue.Queue()
-        set_shared_queue(flask_to_tkinter_queue)
 
-        # 2. Khởi tạo driver phần cứng
-        if LED_AVAILABLE:
-            initialize_led_controller()
-
-        # 3. Đồng bộ dữ liệu ban đầu TRƯỚC KHI UI khởi động
-        # Đảm bảo UI bắt đầu với dữ liệu mới nhất có thể.
-        print("[MAIN] Chạy đồng bộ dữ liệu ban đầu...")
-        sync_manager.sync_now()
-        print("[MAIN] Đồng bộ ban đầu hoàn tất.")
+        # 2. Các bước khởi động chạy SONG SONG (xem core/utils/startup.py)
+        # Chỉ stage "images" là bắt buộc để hiện màn hình chào mừng; AI và đồng bộ server
+        # tiếp tục chạy nền và được gắn vào UI khi xong.
+        startup = StartupOrchestrator()
+        startup.add_stage("hardware", lambda: initialize_led_controller() if LED_AVAILABLE else False)
+        startup.add_stage("images", AdvancedUIManager.load_images_for_display)
+        if ai_facade.is_enabled():
+            # Thư viện AI (torch, mediapipe, faiss) được import lazy ngay trong các stage này
+            startup.add_stage("face_detector", ai_facade.create_detector)
+            startup.add_stage("face_model", ai_facade.create_recognizer)
+            # Tải index FAISS + mở camera, dùng detector/model đã tải ở 2 stage trên
+            def create_ai_system():
+                system = ai_facade.create_system(
+                    detector=startup.result("face_detector"),
+                    recognizer=startup.result("face_model")
+                )
+                # Đăng ký ngay trong stage (không chờ luồng Tk) để đổi ID khách hàng
+                # của initial_sync đi thẳng vào index, không ghi vào journal đang được nạp
+                db_manager.set_face_id_rename_callback(system.rename_person)
+                return system
+            startup.add_stage("ai_system", create_ai_system, depends=("face_detector", "face_model"))
+        else:
+            print("[MAIN] FACE_LOGIN_ENABLED = False: chạy không có hệ thống AI khuôn mặt.")
+        startup.add_stage("product_sync", lambda: [t.join() for t in db_manager.start_server_sync()])
+        # Đồng bộ ban đầu (khách hàng + giao dịch), sau đó chuyển sang đồng bộ định kỳ.
+        # Chờ "ai_system" xong (kể cả khi lỗi, nên không dùng depends): đồng bộ khách hàng có thể
+        # đổi ID local_* -> ID server, không được chạy trong lúc FastFaceSearch đang nạp/gộp journal.
+        def initial_sync():
+            if ai_facade.is_enabled():
+                startup.wait("ai_system")
+            sync_manager.sync_now()
+            sync_manager.start(run_immediately=False)
+        startup.add_stage("initial_sync", initial_sync)
+        startup.start()
 
-        # 4. Khởi tạo UI Manager
-        # AdvancedUIManager sẽ tự động khởi tạo thư viện FaceRecognitionSystem bên trong nó.
-        # Đây là điểm duy nhất mà logic AI/Camera được kích hoạt.
-        print("[MAIN] Đang khởi tạo giao diện người dùng và hệ thống AI/Camera...")
+        # 3. Khởi tạo UI Manager ngay khi ảnh sẵn sàng
+        print("[MAIN] Đang chờ các bước cần cho giao diện...")
+        startup.wait(["images"])
+        print("[MAIN] Đang khởi tạo giao diện người dùng (AI/Camera tiếp tục tải nền)...")
         ui_instance = AdvancedUIManager(
             root=root,
             shopping_logic_instance=shopping_logic,
-            api_manager_instance=api_manager
+            api_manager_instance=api_manager,
+            startup=startup
         )
 
-        # 5. Khởi động các luồng nền hỗ trợ
+        # 4. Khởi động các luồng nền hỗ trợ
         print("[MAIN] Đang khởi động các dịch vụ nền...")
         
+        # Cầu nối sự kiện thanh toán Flask -> Tkinter (đánh thức Tk ngay, không poll)
+        # Phải gán trước khi Flask chạy để không mất tín hiệu.
+        payment_bridge = PaymentEventBridge(root, ui_instance)
+        set_shared_queue(payment_bridge)
+
         # Khởi động server thanh toán Flask
         flask_thread = threading.Thread(target=run_flask_app, daemon=True)
         flask_thread.start()
         
-        # Bắt đầu luồng đồng bộ định kỳ (chạy sau mỗi X phút)
-        sync_manager.start()
-
-        # Bắt đầu luồng lắng nghe tín hiệu thanh toán từ Flask
-        check_payment_queue(root, ui_instance, shopping_logic, flask_to_tkinter_queue)
-
-        # 6. Chạy vòng lặp chính của giao diện Tkinter
+        # 5. Chạy vòng lặp chính của giao diện Tkinter
         print("[MAIN] Khởi tạo hoàn tất. Bắt đầu vòng lặp chính của ứng dụng.")
         root.mainloop()
 
@@ -92,6 +119,14 @@ def main():
         # Dọn dẹp tài nguyên khi ứng dụng thoát (dù thành công hay thất bại)
         print("[MAIN] Bắt đầu dọn dẹp tài nguyên trước khi thoát...")
         sync_manager.stop()
+        close_session()  # Ghi log thống kê bắt tay/request HTTP
+
+        # Gỡ file handler khỏi Tk và đóng self-pipe của cầu nối thanh toán
+        if payment_bridge is not None:
+            payment_bridge.close()
+
+        # Dừng và chờ luồng dựng index ANN (FAISS/OpenMP chạy lúc thoát làm process bị abort)
+        ai_facade.shutdown()
         
         if LED_AVAILABLE:
             close_led_controller()
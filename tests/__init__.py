@@ -0,0 +1 @@
+# Để thư mục này được coi là một package
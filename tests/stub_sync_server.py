@@ -0,0 +1,142 @@
+# --- START OF FILE tests/stub_sync_server.py ---
+#
+# Server giả lập API đồng bộ giao dịch, chạy cục bộ (không cần mạng), dùng cho test outbox:
+#   POST /api/transactions/batch_record  {"transactions": [...]}
+#   POST /api/transactions/record        {...1 giao dịch...}
+# Chế độ:
+# - batch_supported=False: trả 404 cho batch_record (server cũ, client phải gửi từng đơn).
+# - atomic_batches=True: từ chối CẢ LÔ (success=false) nếu có 1 đơn không hợp lệ.
+# - offline=True (đổi lúc đang chạy): mọi request trả 503.
+# Đơn không hợp lệ: thiếu order_code hoặc items rỗng (giống đơn cũ trước khi có outbox).
+#
+# Chạy tay (trỏ SERVER_URL trong api_manager.py tới địa chỉ in ra):
+#   python -m tests.stub_sync_server --port 8765 [--no-batch] [--atomic]
+
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BATCH_PATH = '/api/transactions/batch_record'
+RECORD_PATH = '/api/transactions/record'
+
+
+class StubSyncServer:
+    def __init__(self, host='127.0.0.1', port=0, batch_supported=True, atomic_batches=False):
+        self.batch_supported = batch_supported
+        self.atomic_batches = atomic_batches
+        self.offline = False
+        self.orders = {}        # order_code -> giao dịch đã nhận (gửi trùng thì ghi đè)
+        self.requests = []      # (path, số giao dịch) theo thứ tự nhận
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-sync-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def count_requests(self, path):
+        with self._lock:
+            return sum(1 for p, _ in self.requests if p == path)
+
+    @staticmethod
+    def is_valid(transaction):
+        return bool(transaction.get('order_code')) and bool(transaction.get('items'))
+
+    def handle(self, path, body):
+        """Xử lý 1 request, trả về (HTTP status, dict JSON)."""
+        with self._lock:
+            if path == BATCH_PATH:
+                transactions = body.get('transactions') or []
+                self.requests.append((path, len(transactions)))
+                if self.offline:
+                    return 503, {"success": False, "message": "offline"}
+                if not self.batch_supported:
+                    return 404, {"success": False, "message": "not found"}
+                valid = [t for t in transactions if self.is_valid(t)]
+                if self.atomic_batches and len(valid) < len(transactions):
+                    return 200, {"success": False, "message": "lô có giao dịch không hợp lệ"}
+                for t in valid:
+                    self.orders[t['order_code']] = t
+                return 200, {"success": True, "accepted": [t['order_code'] for t in valid]}
+
+            if path == RECORD_PATH:
+                self.requests.append((path, 1))
+                if self.offline:
+                    return 503, {"success": False, "message": "offline"}
+                if not self.is_valid(body):
+                    return 422, {"success": False, "message": "giao dịch không hợp lệ"}
+                self.orders[body['order_code']] = body
+                return 200, {"success": True}
+
+            self.requests.append((path, 0))
+            return 404, {"success": False, "message": "not found"}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    body = None
+                if isinstance(body, dict):
+                    status, payload = server.handle(self.path, body)
+                else:
+                    status, payload = 400, {"success": False, "message": "JSON không hợp lệ"}
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass  # Không in log mỗi request khi chạy test
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập API đồng bộ giao dịch.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-batch', action='store_true', help="Trả 404 cho batch_record (server cũ)")
+    parser.add_argument('--atomic', action='store_true', help="Từ chối cả lô nếu có 1 đơn không hợp lệ")
+    args = parser.parse_args()
+
+    server = StubSyncServer(port=args.port, batch_supported=not args.no_batch, atomic_batches=args.atomic).start()
+    print(f"[STUB] Đang chạy tại {server.url} (Ctrl+C để dừng)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"[STUB] Đã nhận {len(server.orders)} giao dịch.")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE tests/stub_sync_server.py ---
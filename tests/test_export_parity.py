@@ -0,0 +1,78 @@
+# --- START OF FILE tests/test_export_parity.py ---
+#
+# Test parity embedding giữa bản eager và graph đã export (core/Camera_AI/export_model.py):
+# với cùng ảnh mặt, embedding TorchScript / ONNX phải có cosine >= PARITY_MIN_COSINE (0.999)
+# so với eager. Graph được export vào thư mục tạm, không ghi đè checkpoints/exported/.
+# Bỏ qua nếu thiếu torch (hoặc onnxruntime cho ONNX) hoặc thiếu file checkpoint.
+#
+# Chạy: python -m pytest tests/test_export_parity.py -q
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Các thư viện face_recognition_library import ngay khi nạp module
+pytest.importorskip("torch")
+pytest.importorskip("timm")
+pytest.importorskip("faiss")
+pytest.importorskip("cv2")
+pytest.importorskip("mediapipe")
+
+from core.Camera_AI import model_registry
+from core.Camera_AI import export_model
+from core.Camera_AI.face_recognition_library import ModelEmbedding
+
+
+@pytest.fixture(scope="module")
+def model_name():
+    name = model_registry.resolve_model_name()
+    path = model_registry.checkpoint_path(name)
+    if not os.path.exists(path):
+        pytest.skip(f"thiếu checkpoint {path}")
+    return name
+
+
+@pytest.fixture(scope="module")
+def export_dir(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patcher:
+        patcher.setattr(model_registry, 'EXPORT_DIR', str(tmp_path_factory.mktemp("exported")))
+        yield model_registry.EXPORT_DIR
+
+
+@pytest.fixture(scope="module")
+def reference(model_name, export_dir):
+    return ModelEmbedding(model_name, backend=model_registry.BACKEND_EAGER)
+
+
+@pytest.fixture(scope="module")
+def faces():
+    # Ảnh thật trong database nếu có, thiếu thì bù ảnh ngẫu nhiên (giống CLI export)
+    testset = os.path.join(model_registry.MODULE_ROOT, 'database')
+    return export_model.sample_faces(testset, export_model.PARITY_SAMPLES)
+
+
+def test_parity_threshold():
+    assert export_model.PARITY_MIN_COSINE >= 0.999
+
+
+def test_torchscript_matches_eager(model_name, reference, faces):
+    backend = model_registry.BACKEND_TORCHSCRIPT
+    export_model.export_torchscript(reference, model_registry.exported_path(model_name, backend))
+
+    assert export_model.check_parity(reference, model_name, backend, faces)
+
+
+def test_onnx_matches_eager(model_name, reference, faces):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    if model_registry.get_spec(model_name).quantized:
+        pytest.skip(f"{model_name} lượng tử hóa động, không export được sang ONNX")
+    backend = model_registry.BACKEND_ONNX
+    export_model.export_onnx(reference, model_registry.exported_path(model_name, backend))
+
+    assert export_model.check_parity(reference, model_name, backend, faces)
+
+# --- END OF FILE tests/test_export_parity.py ---
@@ -0,0 +1,168 @@
+# --- START OF FILE tests/test_transaction_outbox.py ---
+#
+# Test outbox giao dịch với server giả lập cục bộ (tests/stub_sync_server.py):
+# gửi theo lô, quay về gửi từng đơn khi server cũ trả 404, đơn bị từ chối không chặn cả lô
+# và bị đỗ lại sau MAX_ATTEMPTS lần, mất mạng thì giữ nguyên đơn và chờ lùi dần.
+#
+# Chạy: python -m unittest discover -s tests -t .
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tests.stub_sync_server import StubSyncServer, BATCH_PATH, RECORD_PATH
+
+_tmp_dir = None
+_old_cwd = None
+_patches = []
+
+
+def setUpModule():
+    # local_database_manager tạo DB mặc định trong thư mục hiện tại ngay khi import:
+    # import trong thư mục tạm để không đụng tới DB thật của máy
+    global _tmp_dir, _old_cwd, http_session, api_module, LocalDatabaseManager, TX_PARKED, TransactionOutbox
+    _old_cwd = os.getcwd()
+    _tmp_dir = tempfile.mkdtemp(prefix="outbox_test_")
+    os.chdir(_tmp_dir)
+
+    from core.features import http_session
+    from core.features import api_manager as api_module
+    from core.database.local_database_manager import LocalDatabaseManager, TX_PARKED
+    from core.features.transaction_outbox import TransactionOutbox
+
+    # Không retry/backoff trong urllib3: test mất mạng phải trả kết quả ngay
+    _patches.append(mock.patch.object(http_session, 'RETRY_TOTAL', 0))
+    for p in _patches:
+        p.start()
+
+
+def tearDownModule():
+    for p in _patches:
+        p.stop()
+    http_session.close_session()
+    os.chdir(_old_cwd)
+    shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+class TransactionOutboxTest(unittest.TestCase):
+    def setUp(self):
+        http_session.close_session()  # Session mới, dùng cấu hình retry đã patch
+        self.db = LocalDatabaseManager(os.path.join(_tmp_dir, f"{self._testMethodName}.db"))
+        self.addCleanup(self.db.pool.close)
+        self.outbox = TransactionOutbox(db=self.db, api=api_module.VendingAPIManager())
+
+    def start_server(self, **kwargs):
+        server = StubSyncServer(**kwargs).start()
+        self.addCleanup(server.close)
+        patcher = mock.patch.object(api_module, 'SERVER_URL', server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def save_orders(self, count, legacy=False):
+        """Lưu `count` đơn; legacy=True: đơn cũ không có payload API (items rỗng)."""
+        codes = []
+        for i in range(count):
+            payload = None if legacy else {
+                "total_amount": 1000 + i,
+                "customer_info": None,
+                "items": [{"product_name": "Pepsi", "quantity": 1, "price": 1000 + i}],
+            }
+            codes.append(self.db.save_transaction(1000 + i, "Khách lẻ", "Pepsi x1", [], sync_payload=payload))
+        return codes
+
+    def sync_state(self, order_code):
+        row = self.db._get_connection().execute(
+            "SELECT is_synced, sync_attempts FROM transaction_history WHERE order_code = ?", (order_code,)).fetchone()
+        return row['is_synced'], row['sync_attempts']
+
+    def test_drains_in_batches(self):
+        server = self.start_server()
+        codes = self.save_orders(120)
+
+        self.assertTrue(self.outbox.drain())
+
+        self.assertEqual(server.count_requests(BATCH_PATH), 3)  # 50 + 50 + 20
+        self.assertEqual(set(server.orders), set(codes))
+        self.assertEqual(self.db.get_unsynced_transactions(), [])
+
+    def test_falls_back_to_single_records_when_batch_endpoint_missing(self):
+        server = self.start_server(batch_supported=False)
+        codes = self.save_orders(3)
+
+        self.assertTrue(self.outbox.drain())
+
+        self.assertEqual(server.count_requests(RECORD_PATH), 3)
+        self.assertEqual(set(server.orders), set(codes))
+        self.assertEqual(self.db.get_unsynced_transactions(), [])
+
+    def test_rejected_order_does_not_block_the_batch(self):
+        # Server từ chối cả lô vì 1 đơn cũ (items rỗng) nằm ở đầu hàng đợi
+        server = self.start_server(atomic_batches=True)
+        legacy = self.save_orders(1, legacy=True)[0]
+        good = self.save_orders(4)
+
+        self.assertTrue(self.outbox.drain())
+
+        self.assertEqual(set(server.orders), set(good))
+        self.assertEqual(self.sync_state(legacy), (0, 1))
+        # Đơn mới sau đó vẫn được gửi trước đơn đã bị từ chối
+        newer = self.save_orders(1)[0]
+        self.assertEqual(self.db.get_unsynced_transactions(limit=1)[0]['order_code'], newer)
+
+    def test_rejected_order_is_parked_after_max_attempts(self):
+        self.start_server()
+        self.outbox.MAX_ATTEMPTS = 3
+        legacy = self.save_orders(1, legacy=True)[0]
+
+        for attempt in range(1, 4):
+            self.assertTrue(self.outbox.drain())
+            self.assertEqual(self.sync_state(legacy)[1], attempt)
+
+        self.assertEqual(self.sync_state(legacy)[0], TX_PARKED)
+        self.assertEqual(self.db.get_unsynced_transactions(), [])
+        self.assertEqual(self.db.requeue_parked_transactions(), 1)
+        self.assertEqual(self.sync_state(legacy), (0, 0))
+
+    def test_offline_keeps_orders_without_counting_attempts(self):
+        server = self.start_server()
+        server.offline = True
+        codes = self.save_orders(2)
+
+        self.assertFalse(self.outbox.drain())
+        self.assertEqual([self.sync_state(c) for c in codes], [(0, 0), (0, 0)])
+
+        server.offline = False
+        self.assertTrue(self.outbox.drain())
+        self.assertEqual(set(server.orders), set(codes))
+
+    def test_unreachable_server_fails_drain(self):
+        server = self.start_server()
+        server.close()
+        self.save_orders(1)
+
+        self.assertFalse(self.outbox.drain())
+        self.assertEqual(len(self.db.get_unsynced_transactions()), 1)
+
+    def test_backoff_grows_and_is_capped(self):
+        outbox = self.outbox
+        delays = []
+        for failures in (1, 2, 3, 30):
+            outbox._failures = failures
+            delays.append(outbox._backoff_delay())
+        base = outbox.BACKOFF_BASE
+        self.assertTrue(base * 0.5 <= delays[0] <= base)
+        self.assertTrue(base * 2 <= delays[2] <= base * 4)
+        self.assertLessEqual(delays[3], outbox.BACKOFF_MAX)
+        self.assertGreaterEqual(delays[3], outbox.BACKOFF_MAX * 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# --- END OF FILE tests/test_transaction_outbox.py ---